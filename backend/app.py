@@ -1,28 +1,87 @@
 # app.py - Flask Backend with MongoDB
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_pymongo import PyMongo
+from pymongo import InsertOne, UpdateOne, UpdateMany, DeleteOne, ReturnDocument
+from pymongo.errors import BulkWriteError, PyMongoError
+from pymongo.write_concern import WriteConcern
 from werkzeug.security import generate_password_hash, check_password_hash
 from bson.objectid import ObjectId
-from datetime import datetime
+from bson.errors import InvalidId
+from bson.decimal128 import Decimal128
+from gridfs import GridFS
+from datetime import datetime, date
 import jwt
+import click
 from functools import wraps
 import os
 from dotenv import load_dotenv
-from io import BytesIO
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
-from openpyxl import Workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from datetime import timedelta
+try:
+    import orjson
+except ImportError:  # falls back to the stdlib encoder
+    orjson = None
+from datetime import timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from collections import OrderedDict
+import threading
+import queue
+import atexit
+import time
+import random
+import base64
+import re
+import csv
+import io
+import zipfile
+import tempfile
+import hashlib
+import socket
 
 # Load environment variables
 load_dotenv()
 
+# JSON provider that encodes ObjectId and datetime directly, so routes can return raw documents
+def bson_default(obj):
+    if isinstance(obj, (ObjectId, Decimal128)):
+        return str(obj)
+    if isinstance(obj, bytes):
+        return base64.b64encode(obj).decode()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+class BSONJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return json.dumps(obj, default=bson_default, ensure_ascii=False)
+        # Naive datetimes serialise like isoformat(); non-string keys match the stdlib behaviour
+        return orjson.dumps(obj, default=bson_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s) if orjson is not None else json.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None:
+            return self._app.response_class(self.dumps(obj), mimetype=self.mimetype)
+        # Hand orjson's bytes straight to the response without a str round trip
+        body = orjson.dumps(obj, default=bson_default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = BSONJSONProvider(app)
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
 
 # Configuration
@@ -31,6 +90,423 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-change-this'
 
 mongo = PyMongo(app)
 
+# Index migrations - each version lists (collection, keys, options) to build and, optionally,
+# (collection, name) pairs to drop and a 'run' callable for a one-off data change that has to
+# land with it. Append a new version instead of editing an applied one.
+# Run `flask migrate-indexes` when deploying; builds on large collections can take minutes.
+INDEX_MIGRATIONS = [
+    {
+        'version': 1,
+        'description': 'Indexes for per-user lookups and sorted feeds',
+        'indexes': [
+            ('users', [('email', 1)], {'name': 'email_1'}),
+            ('todos', [('user_id', 1), ('created_at', -1)], {'name': 'user_id_1_created_at_-1'}),
+            ('tickets', [('user_id', 1), ('created_at', -1)], {'name': 'user_id_1_created_at_-1'}),
+            ('tickets', [('user_id', 1), ('ticket_id', 1)], {'name': 'user_id_1_ticket_id_1'}),
+            ('comments', [('todo_id', 1), ('created_at', -1)], {'name': 'todo_id_1_created_at_-1'}),
+            ('ticket_comments', [('ticket_id', 1), ('created_at', -1)], {'name': 'ticket_id_1_created_at_-1'}),
+            ('activities', [('user_id', 1), ('created_at', -1)], {'name': 'user_id_1_created_at_-1'})
+        ]
+    },
+    {
+        'version': 2,
+        'description': 'Keyset pagination index for todos',
+        'indexes': [
+            ('todos', [('user_id', 1), ('created_at', -1), ('_id', -1)], {'name': 'user_id_1_created_at_-1__id_-1'})
+        ]
+    },
+    {
+        'version': 3,
+        'description': 'Filter and pagination indexes for tickets',
+        'indexes': [
+            ('tickets', [('user_id', 1), ('created_at', -1), ('_id', -1)], {'name': 'user_id_1_created_at_-1__id_-1'}),
+            ('tickets', [('user_id', 1), ('client_name', 1), ('created_at', -1), ('_id', -1)], {'name': 'user_id_1_client_name_1_created_at_-1__id_-1'}),
+            ('tickets', [('user_id', 1), ('status', 1), ('created_at', -1), ('_id', -1)], {'name': 'user_id_1_status_1_created_at_-1__id_-1'}),
+            ('tickets', [('user_id', 1), ('priority', 1), ('created_at', -1), ('_id', -1)], {'name': 'user_id_1_priority_1_created_at_-1__id_-1'})
+        ]
+    },
+    {
+        'version': 4,
+        'description': 'Per-user local-date analytics rollups',
+        'indexes': [
+            ('daily_stats', [('user_id', 1), ('date', 1)], {'name': 'user_id_1_date_1', 'unique': True})
+        ]
+    },
+    {
+        'version': 5,
+        'description': 'Export job queue',
+        'indexes': [
+            ('export_jobs', [('status', 1), ('created_at', 1)], {'name': 'status_1_created_at_1'}),
+            ('export_jobs', [('expires_at', 1)], {'name': 'expires_at_1'})
+        ]
+    },
+    {
+        'version': 6,
+        'description': 'Delta sync change feeds and tombstones',
+        'indexes': [
+            ('todos', [('user_id', 1), ('updated_at', 1)], {'name': 'user_id_1_updated_at_1'}),
+            ('tickets', [('user_id', 1), ('updated_at', 1)], {'name': 'user_id_1_updated_at_1'}),
+            ('comments', [('user_id', 1), ('created_at', 1)], {'name': 'user_id_1_created_at_1'}),
+            ('ticket_comments', [('user_id', 1), ('created_at', 1)], {'name': 'user_id_1_created_at_1'}),
+            ('tombstones', [('user_id', 1), ('deleted_at', 1)], {'name': 'user_id_1_deleted_at_1'}),
+            ('tombstones', [('deleted_at', 1)], {'name': 'deleted_at_ttl', 'expireAfterSeconds': 30 * 24 * 3600})
+        ]
+    },
+    {
+        'version': 7,
+        'description': 'Per-user text indexes for search',
+        'indexes': [
+            ('todos', [('user_id', 1), ('text', 'text')], {'name': 'user_id_1_text_text'}),
+            ('tickets', [('user_id', 1), ('subject', 'text'), ('description', 'text')],
+             {'name': 'user_id_1_subject_text_description_text', 'weights': {'subject': 5, 'description': 1}}),
+            ('comments', [('user_id', 1), ('text', 'text')], {'name': 'user_id_1_text_text'}),
+            ('ticket_comments', [('user_id', 1), ('text', 'text')], {'name': 'user_id_1_text_text'})
+        ]
+    },
+    {
+        'version': 8,
+        'description': 'Client directory',
+        'indexes': [
+            ('clients', [('user_id', 1), ('name', 1)], {'name': 'user_id_1_name_1', 'unique': True}),
+            ('clients', [('user_id', 1), ('name_key', 1)], {'name': 'user_id_1_name_key_1'})
+        ]
+    },
+    {
+        'version': 9,
+        'description': 'Persistent AI response cache expiry',
+        'indexes': [
+            ('ai_cache', [('expires_at', 1)], {'name': 'expires_at_ttl', 'expireAfterSeconds': 0})
+        ]
+    },
+    {
+        'version': 10,
+        'description': 'Background AI job expiry',
+        'indexes': [
+            ('ai_jobs', [('expires_at', 1)], {'name': 'expires_at_ttl', 'expireAfterSeconds': 0})
+        ]
+    },
+    {
+        'version': 11,
+        'description': 'AI job queue',
+        'indexes': [
+            ('ai_jobs', [('provider', 1), ('status', 1), ('created_at', 1)], {'name': 'provider_1_status_1_created_at_1'})
+        ]
+    },
+    {
+        'version': 12,
+        'description': 'Drop per-user created_at indexes covered by the keyset indexes',
+        'indexes': [],
+        'drop': [
+            ('todos', 'user_id_1_created_at_-1'),
+            ('tickets', 'user_id_1_created_at_-1')
+        ]
+    },
+    {
+        'version': 13,
+        'description': 'Build the client directory from existing tickets',
+        'indexes': [],
+        'run': lambda: rebuild_clients()
+    },
+    {
+        'version': 14,
+        'description': 'AI worker heartbeats',
+        'indexes': [
+            ('ai_workers', [('expires_at', 1)], {'name': 'expires_at_ttl', 'expireAfterSeconds': 0})
+        ]
+    },
+    # A collection has at most one text index, so the old one goes in its own version first
+    {
+        'version': 15,
+        'description': 'Drop the subject/description tickets text index',
+        'indexes': [],
+        'drop': [('tickets', 'user_id_1_subject_text_description_text')]
+    },
+    {
+        'version': 16,
+        'description': 'Tickets text index covering ticket_id and client_name for get_tickets search',
+        'indexes': [
+            ('tickets', [('user_id', 1), ('ticket_id', 'text'), ('client_name', 'text'), ('subject', 'text'), ('description', 'text')],
+             {'name': 'user_id_1_ticket_text', 'weights': {'ticket_id': 10, 'client_name': 5, 'subject': 5, 'description': 1}})
+        ]
+    },
+    {
+        'version': 17,
+        'description': 'Set user_id on comments written before comments stored it, so search finds them',
+        'indexes': [],
+        'run': lambda: backfill_comment_owners()
+    }
+]
+
+# Representative query per route, used by `flask check-indexes` to confirm an IXSCAN plan
+INDEXED_QUERIES = [
+    ('login', 'users', {'email': 'user@example.com'}, None),
+    ('get_todos', 'todos', {'user_id': '000000000000000000000000'}, [('created_at', -1)]),
+    ('get_todos (paginated)', 'todos', {'user_id': '000000000000000000000000'}, [('created_at', -1), ('_id', -1)]),
+    ('get_tickets', 'tickets', {'user_id': '000000000000000000000000'}, [('created_at', -1)]),
+    ('get_tickets (status filter)', 'tickets', {'user_id': '000000000000000000000000', 'status': 'open'}, [('created_at', -1), ('_id', -1)]),
+    ('get_tickets (client filter)', 'tickets', {'user_id': '000000000000000000000000', 'client_name': 'Acme'}, [('created_at', -1), ('_id', -1)]),
+    ('get_tickets (search)', 'tickets', {'user_id': '000000000000000000000000', '$text': {'$search': '"acme"'}}, [('created_at', -1), ('_id', -1)]),
+    ('create_ticket', 'tickets', {'ticket_id': 'T-1', 'user_id': '000000000000000000000000'}, None),
+    ('get_comments', 'comments', {'todo_id': '000000000000000000000000'}, [('created_at', -1)]),
+    ('get_ticket_comments', 'ticket_comments', {'ticket_id': '000000000000000000000000'}, [('created_at', -1)]),
+    ('get_user_stats', 'daily_stats', {'user_id': '000000000000000000000000', 'date': {'$gte': '2024-01-01'}}, None),
+    ('sync', 'todos', {'user_id': '000000000000000000000000', 'updated_at': {'$gt': datetime(2024, 1, 1)}}, None),
+    ('sync', 'tombstones', {'user_id': '000000000000000000000000', 'deleted_at': {'$gt': datetime(2024, 1, 1)}}, None),
+    ('get_ticket_clients', 'clients', {'user_id': '000000000000000000000000'}, [('name', 1)]),
+    ('search_clients', 'clients', {'user_id': '000000000000000000000000', 'name_key': {'$regex': '^ac'}}, [('name_key', 1)]),
+    ('search', 'todos', {'user_id': '000000000000000000000000', '$text': {'$search': 'report'}}, None),
+    ('search', 'tickets', {'user_id': '000000000000000000000000', '$text': {'$search': 'report'}}, None),
+    ('claim_ai_job', 'ai_jobs', {'provider': 'gemini', 'status': 'queued'}, [('created_at', 1)]),
+    ('create_ai_job', 'ai_workers', {'expires_at': {'$gt': datetime(2024, 1, 1)}}, None),
+    ('get_activities', 'activities', {'user_id': '000000000000000000000000'}, [('created_at', -1)])
+]
+
+def get_index_version():
+    latest = mongo.db.schema_migrations.find_one({}, sort=[('version', -1)])
+    return latest['version'] if latest else 0
+
+def apply_index_migrations():
+    current_version = get_index_version()
+    applied = []
+
+    for migration in INDEX_MIGRATIONS:
+        if migration['version'] <= current_version:
+            continue
+
+        for collection, keys, options in migration['indexes']:
+            mongo.db[collection].create_index(keys, **options)
+        for collection, name in migration.get('drop', []):
+            if name in mongo.db[collection].index_information():
+                mongo.db[collection].drop_index(name)
+        if migration.get('run'):
+            migration['run']()
+
+        mongo.db.schema_migrations.insert_one({
+            'version': migration['version'],
+            'description': migration['description'],
+            'applied_at': datetime.utcnow()
+        })
+        applied.append(migration['version'])
+
+    return applied
+
+def _winning_stages(plan):
+    stages = [plan.get('stage')]
+    if plan.get('inputStage'):
+        stages.extend(_winning_stages(plan['inputStage']))
+    for child in plan.get('inputStages', []):
+        stages.extend(_winning_stages(child))
+    return stages
+
+def explain_indexed_queries():
+    results = []
+    for route, collection, query, sort in INDEXED_QUERIES:
+        cursor = mongo.db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        # Newer servers wrap the classic plan under queryPlan
+        stages = _winning_stages(plan.get('queryPlan', plan))
+        results.append({
+            'route': route,
+            'collection': collection,
+            'stages': stages,
+            'indexed': 'IXSCAN' in stages and 'COLLSCAN' not in stages
+        })
+    return results
+
+# Opt-in for hosts without a deploy step: the first request starts the build on a background
+# thread and is served straight away with whatever indexes already exist. A failed build is
+# logged and not retried until the process restarts.
+index_migration_started = False
+index_migration_lock = threading.Lock()
+
+def run_index_migrations():
+    try:
+        applied = apply_index_migrations()
+        if applied:
+            print(f"Applied index migrations: {applied}")
+    except Exception as e:
+        print(f"Index migration failed: {str(e)}")
+
+@app.before_request
+def start_index_migrations():
+    global index_migration_started
+    if index_migration_started or os.getenv('AUTO_MIGRATE_INDEXES', 'false').lower() != 'true':
+        return
+
+    with index_migration_lock:
+        if index_migration_started:
+            return
+        index_migration_started = True
+    # Started lazily so no thread exists in a pre-fork master process
+    threading.Thread(target=run_index_migrations, name='index-migrations', daemon=True).start()
+
+@app.cli.command('migrate-indexes')
+def migrate_indexes_command():
+    """Build any index migrations that have not been applied yet."""
+    applied = apply_index_migrations()
+    if applied:
+        print(f"Applied index migrations: {applied}")
+    else:
+        print(f"Indexes already at version {get_index_version()}")
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """Explain each route's query and fail if any of them is a collection scan."""
+    results = explain_indexed_queries()
+    for result in results:
+        status = 'IXSCAN' if result['indexed'] else 'COLLSCAN'
+        print(f"{status:8} {result['route']} ({result['collection']}): {' <- '.join(result['stages'])}")
+
+    if not all(result['indexed'] for result in results):
+        raise SystemExit(1)
+
+# In-process cache with TTL expiry and LRU eviction
+class TTLCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups * 100, 1) if lookups else 0
+            }
+
+# Resolved users for token_required; password and avatar are loaded only by the routes that need them
+USER_CACHE_PROJECTION = {'password': 0, 'avatar': 0}
+user_cache = TTLCache(int(os.getenv('USER_CACHE_SIZE', 1000)), int(os.getenv('USER_CACHE_TTL', 60)))
+
+def get_cached_user(user_id):
+    user = user_cache.get(user_id)
+    if user is None:
+        user = mongo.db.users.find_one({'_id': ObjectId(user_id)}, USER_CACHE_PROJECTION)
+        if user is not None:
+            user_cache.set(user_id, user)
+    # Hand out a copy so a route can't modify the cached document
+    return dict(user) if user is not None else None
+
+# Write-behind activity log - events are buffered per process and written with insert_many
+# once ACTIVITY_FLUSH_SIZE events are queued or every ACTIVITY_FLUSH_INTERVAL seconds
+class ActivityLogger:
+    def __init__(self, mode, flush_size, flush_interval, write_concern, max_buffer=10000):
+        self.mode = mode
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.write_concern = write_concern
+        self.max_buffer = max_buffer
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.flusher = None
+
+    def collection(self):
+        return mongo.db.activities.with_options(write_concern=self.write_concern)
+
+    def log(self, activity):
+        self.log_many([activity])
+
+    def log_many(self, activities):
+        if self.mode == 'sync':
+            self.collection().insert_many(activities, ordered=False)
+            return
+
+        with self.lock:
+            self.buffer.extend(activities)
+            full = len(self.buffer) >= self.flush_size
+            if self.flusher is None:
+                # Started lazily so no thread exists in a pre-fork master process
+                self.flusher = threading.Thread(target=self.run, name='activity-logger', daemon=True)
+                self.flusher.start()
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.buffer = self.buffer, []
+        if not pending:
+            return
+
+        try:
+            self.collection().insert_many(pending, ordered=False)
+        except Exception as e:
+            print(f"Activity flush failed: {str(e)}")
+            retry = self.unwritten(pending, e)
+            if retry:
+                # Keep the events for the next flush, dropping the oldest if the database stays down
+                with self.lock:
+                    self.buffer = (retry + self.buffer)[-self.max_buffer:]
+
+    def unwritten(self, pending, error):
+        """The events a failed flush did not store. insert_many has set _id on every event by now,
+        so a duplicate key means an earlier attempt stored it and only its acknowledgement was lost."""
+        if isinstance(error, BulkWriteError):
+            failed = {write_error['index'] for write_error in error.details.get('writeErrors', [])
+                      if write_error.get('code') != 11000}
+            return [activity for index, activity in enumerate(pending) if index in failed]
+        
+        # Anything else (a lost connection, a write concern timeout) says nothing about which
+        # events landed, so ask; if that fails too, duplicates are caught on the next flush
+        try:
+            written = {doc['_id'] for doc in mongo.db.activities.find(
+                {'_id': {'$in': [activity['_id'] for activity in pending if '_id' in activity]}}, {'_id': 1}
+            )}
+        except Exception:
+            written = set()
+        return [activity for activity in pending if activity.get('_id') not in written]
+
+def parse_write_concern(value):
+    return WriteConcern(w=int(value) if value.isdigit() else value)
+
+# Serverless instances are frozen after each response, so Vercel defaults to synchronous writes
+activity_logger = ActivityLogger(
+    mode=os.getenv('ACTIVITY_LOG_MODE', 'sync' if os.getenv('VERCEL') else 'buffered'),
+    flush_size=int(os.getenv('ACTIVITY_FLUSH_SIZE', 50)),
+    flush_interval=float(os.getenv('ACTIVITY_FLUSH_INTERVAL', 2)),
+    write_concern=parse_write_concern(os.getenv('ACTIVITY_WRITE_CONCERN', '1'))
+)
+atexit.register(activity_logger.flush)
+
 # Token verification decorator
 def token_required(f):
     @wraps(f)
@@ -43,7 +519,10 @@ def token_required(f):
         try:
             token = token.split(' ')[1]  # Remove 'Bearer ' prefix
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = mongo.db.users.find_one({'_id': ObjectId(data['user_id'])})
+            # Scoped tokens (event streams) only open what they were issued for
+            if 'scope' in data:
+                raise jwt.InvalidTokenError('Scoped token')
+            current_user = get_cached_user(data['user_id'])
         except:
             return jsonify({'message': 'Token is invalid!'}), 401
         
@@ -158,12 +637,15 @@ def login():
 @app.route('/api/user/profile', methods=['GET'])
 @token_required
 def get_user_profile(current_user):
+    # avatar is left out of the cached user, so load it here
+    avatar_doc = mongo.db.users.find_one({'_id': current_user['_id']}, {'avatar': 1}) or {}
+    
     user_data = {
         'id': str(current_user['_id']),
         'email': current_user['email'],
         'name': current_user.get('name', ''),
         'mobile': current_user.get('mobile', ''),
-        'avatar': current_user.get('avatar', ''),
+        'avatar': avatar_doc.get('avatar', ''),
         'timezone': current_user.get('timezone', 'UTC'),
         'theme': current_user.get('theme', 'light'),
         'notifications': current_user.get('notifications', {
@@ -222,9 +704,10 @@ def update_user_profile(current_user):
         {'_id': current_user['_id']},
         {'$set': update_data}
     )
+    user_cache.invalidate(str(current_user['_id']))
     
     # Log activity
-    mongo.db.activities.insert_one({
+    activity_logger.log({
         'user_id': str(current_user['_id']),
         'type': 'profile_updated',
         'description': 'Updated profile settings',
@@ -244,8 +727,9 @@ def change_password(current_user):
     if not current_password or not new_password:
         return jsonify({'message': 'Current and new password required'}), 400
     
-    # Verify current password
-    if not check_password_hash(current_user['password'], current_password):
+    # Verify current password (the hash is never kept in the user cache)
+    user = mongo.db.users.find_one({'_id': current_user['_id']}, {'password': 1})
+    if not user or not check_password_hash(user['password'], current_password):
         return jsonify({'message': 'Current password is incorrect'}), 400
     
     # Update password
@@ -257,9 +741,10 @@ def change_password(current_user):
             'updated_at': datetime.utcnow()
         }}
     )
+    user_cache.invalidate(str(current_user['_id']))
     
     # Log activity
-    mongo.db.activities.insert_one({
+    activity_logger.log({
         'user_id': str(current_user['_id']),
         'type': 'password_changed',
         'description': 'Changed account password',
@@ -268,40 +753,373 @@ def change_password(current_user):
     
     return jsonify({'message': 'Password changed successfully'}), 200
 
-# Todo Routes
-@app.route('/api/todos', methods=['GET'])
-@token_required
-def get_todos(current_user):
-    todos = list(mongo.db.todos.find({'user_id': str(current_user['_id'])}))
+# Keyset pagination helpers - cursors are opaque tokens for (created_at, _id)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(doc):
+    payload = json.dumps({'created_at': doc['created_at'].isoformat(), 'id': str(doc['_id'])})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    return datetime.fromisoformat(payload['created_at']), ObjectId(payload['id'])
+
+def get_page_size():
+    limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def paginate(collection, query, projection=None):
+    """Return (docs, next_cursor) for one page of query, newest first."""
+    limit = get_page_size()
+    cursor = request.args.get('cursor')
+    
+    # The cursor is built from created_at, so it must survive any projection
+    if projection:
+        projection = dict(projection, created_at=1)
+
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        query = {'$and': [query, {'$or': [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, '_id': {'$lt': last_id}}
+        ]}]}
+
+    # Fetch one extra document to know whether another page exists
+    docs = list(collection.find(query, projection).sort([('created_at', -1), ('_id', -1)]).limit(limit + 1))
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+def wants_pagination():
+    return 'limit' in request.args or 'cursor' in request.args
+
+# Sparse fieldsets - ?fields=a,b or ?view=<name> become a MongoDB projection
+TODO_FIELDS = ['text', 'completed', 'priority', 'category', 'created_at', 'time_spent',
+               'started_at', 'completed_at', 'estimated_time']
+TODO_VIEWS = {
+    'list': ['text', 'completed', 'priority', 'category', 'created_at'],
+    'full': TODO_FIELDS
+}
+TICKET_FIELDS = ['ticket_id', 'client_name', 'subject', 'description', 'status', 'priority',
+                 'created_at', 'updated_at']
+TICKET_VIEWS = {
+    'list': ['ticket_id', 'client_name', 'subject', 'status', 'priority', 'created_at', 'updated_at'],
+    'full': TICKET_FIELDS
+}
+
+def get_projection(allowed_fields, views):
+    """Projection for the requested fields or view, or None for whole documents."""
+    fields = request.args.get('fields')
+    view = request.args.get('view')
+    
+    if fields is not None:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        if not names:
+            raise ValueError('fields must name at least one field')
+    elif view:
+        if view not in views:
+            raise ValueError(f'Unknown view: {view}')
+        names = views[view]
+    else:
+        return None
     
-    # Convert ObjectId to string
-    for todo in todos:
-        todo['_id'] = str(todo['_id'])
-        todo['created_at'] = todo['created_at'].isoformat()
+    unknown = [name for name in names if name not in allowed_fields]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}')
     
-    return jsonify(todos), 200
+    # _id is always returned by MongoDB unless excluded
+    return {name: 1 for name in names}
 
-@app.route('/api/todos', methods=['POST'])
-@token_required
-def create_todo(current_user):
-    data = request.get_json()
+def parse_date_range(start_date, end_date):
+    """Build a created_at filter from ISO dates; end_date is inclusive of the whole day."""
+    date_filter = {}
+    if start_date:
+        date_filter['$gte'] = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
+    if end_date:
+        end_datetime = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+        end_datetime = end_datetime.replace(hour=23, minute=59, second=59)
+        date_filter['$lte'] = end_datetime
+    return date_filter
+
+# Per-user data versions - a counter per scope, bumped by every route that writes todos or tickets
+def bump_data_version(user_id, *scopes):
+    mongo.db.data_versions.update_one(
+        {'_id': user_id},
+        {'$inc': {scope: 1 for scope in scopes}, '$set': {'updated_at': datetime.utcnow()}},
+        upsert=True
+    )
+
+def get_data_version(user_id, scope):
+    versions = mongo.db.data_versions.find_one({'_id': user_id}, {scope: 1}) or {}
+    return versions.get(scope, 0)
+
+def versioned_etag(scope):
+    """Answer If-None-Match from the user's data version, before the wrapped route queries anything."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            user_id = str(current_user['_id'])
+            # Filters, fields and cursors change the body, so the query string is part of the tag
+            stamp = f'{user_id}|{scope}|{get_data_version(user_id, scope)}|{request.full_path}'
+            etag = hashlib.sha256(stamp.encode()).hexdigest()[:32]
+            
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(f(current_user, *args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        
+        return decorated
     
-    todo = {
+    return decorator
+
+# Change events - pushed over /api/events so open tabs can patch their state instead of refetching.
+# EVENT_BACKEND=memory fans out inside this process and only suits single-process deployments;
+# EVENT_BACKEND=changestream tails a MongoDB change stream (replica set required), so every
+# worker sees writes made by any other and routes don't publish anything themselves.
+EVENT_BACKEND = os.getenv('EVENT_BACKEND', 'memory')
+EVENT_QUEUE_SIZE = int(os.getenv('EVENT_QUEUE_SIZE', 100))
+# Each open stream holds a web worker thread, so streams get only part of the pool (16 threads in the Procfile)
+EVENT_MAX_STREAMS = int(os.getenv('EVENT_MAX_STREAMS', 8))
+EVENT_MAX_STREAMS_PER_USER = int(os.getenv('EVENT_MAX_STREAMS_PER_USER', 3))
+# Stream tokens travel in the URL, where access and proxy logs keep them, so they expire quickly
+EVENT_TOKEN_TTL = 60
+EVENT_KEEPALIVE = 15
+EVENT_COLLECTIONS = {'todos': 'todo', 'tickets': 'ticket', 'comments': 'comment', 'ticket_comments': 'ticket_comment',
+                     'ai_jobs': 'ai_job'}
+
+class StreamLimitError(Exception):
+    """No stream slot is free for this user or this process."""
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+class EventBroker:
+    def __init__(self, queue_size, max_streams, max_streams_per_user):
+        self.queue_size = queue_size
+        self.max_streams = max_streams
+        self.max_streams_per_user = max_streams_per_user
+        self.subscribers = {}
+        self.streams = 0
+        self.lock = threading.Lock()
+    
+    def subscribe(self, user_id):
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            if len(self.subscribers.get(user_id, ())) >= self.max_streams_per_user:
+                raise StreamLimitError(f'At most {self.max_streams_per_user} open event streams per user', 429)
+            if self.streams >= self.max_streams:
+                raise StreamLimitError('Too many open event streams, please try again shortly', 503)
+            self.subscribers.setdefault(user_id, set()).add(subscriber)
+            self.streams += 1
+        return subscriber
+    
+    def unsubscribe(self, user_id, subscriber):
+        with self.lock:
+            queues = self.subscribers.get(user_id, set())
+            if subscriber in queues:
+                queues.discard(subscriber)
+                self.streams -= 1
+            if not queues:
+                self.subscribers.pop(user_id, None)
+    
+    def publish(self, user_id, event):
+        with self.lock:
+            queues = list(self.subscribers.get(user_id, ()))
+        for subscriber in queues:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # A stalled client can't catch up event by event; drop its backlog and have it resync
+                while not subscriber.empty():
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        break
+                subscriber.put_nowait({'op': 'resync'})
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'backend': EVENT_BACKEND,
+                'users': len(self.subscribers),
+                'streams': self.streams,
+                'max_streams': self.max_streams,
+                'max_streams_per_user': self.max_streams_per_user
+            }
+
+class ChangeStreamFanout:
+    def __init__(self, broker):
+        self.broker = broker
+        self.thread = None
+        self.lock = threading.Lock()
+    
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+    
+    def run(self):
+        pipeline = [{'$match': {
+            'ns.coll': {'$in': list(EVENT_COLLECTIONS) + ['tombstones']},
+            'operationType': {'$in': ['insert', 'update', 'replace']}
+        }}]
+        resume_token = None
+        while True:
+            try:
+                with mongo.db.watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        self.dispatch(change)
+            except PyMongoError as e:
+                print(f"Change stream error, reconnecting: {str(e)}")
+                time.sleep(1)
+    
+    def dispatch(self, change):
+        doc = change.get('fullDocument')
+        # updateLookup finds nothing when the document was deleted before the lookup ran
+        if not doc or not doc.get('user_id'):
+            return
+        
+        collection = change['ns']['coll']
+        if collection == 'tombstones':
+            event = {'type': doc['type'], 'id': doc['id'], 'op': 'delete'}
+        elif change['operationType'] == 'update':
+            description = change.get('updateDescription', {})
+            fields = dict(description.get('updatedFields', {}))
+            fields.update({field: None for field in description.get('removedFields', [])})
+            event = {'type': EVENT_COLLECTIONS[collection], 'id': str(doc['_id']), 'op': 'update', 'fields': fields}
+        else:
+            event = {'type': EVENT_COLLECTIONS[collection], 'id': str(doc['_id']), 'op': 'create', 'fields': doc}
+        self.broker.publish(doc['user_id'], event)
+
+event_broker = EventBroker(EVENT_QUEUE_SIZE, EVENT_MAX_STREAMS, EVENT_MAX_STREAMS_PER_USER)
+change_stream_fanout = ChangeStreamFanout(event_broker)
+
+def publish_change(user_id, kind, doc_id, op, fields=None):
+    if EVENT_BACKEND != 'memory':
+        return
+    event = {'type': kind, 'id': str(doc_id), 'op': op}
+    if fields is not None:
+        event['fields'] = fields
+    event_broker.publish(user_id, event)
+
+@app.route('/api/events/token', methods=['POST'])
+@token_required
+def create_event_token(current_user):
+    expires_at = datetime.utcnow() + timedelta(seconds=EVENT_TOKEN_TTL)
+    token = jwt.encode({
+        'user_id': str(current_user['_id']),
+        'scope': 'events',
+        'exp': expires_at
+    }, app.config['SECRET_KEY'], algorithm='HS256')
+    return jsonify({'token': token, 'expires_at': expires_at}), 200
+
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    # EventSource can't set headers, so it passes a short-lived stream token in the query string;
+    # the login token is only accepted in the Authorization header
+    try:
+        if request.headers.get('Authorization'):
+            data = jwt.decode(request.headers['Authorization'].replace('Bearer ', ''), app.config['SECRET_KEY'], algorithms=['HS256'])
+            if 'scope' in data:
+                raise jwt.InvalidTokenError('Scoped tokens are not accepted in the header')
+        else:
+            data = jwt.decode(request.args.get('token', ''), app.config['SECRET_KEY'], algorithms=['HS256'])
+            if data.get('scope') != 'events':
+                raise jwt.InvalidTokenError('Not a stream token')
+        user_id = data['user_id']
+    except Exception:
+        return jsonify({'message': 'Token is invalid!'}), 401
+    
+    if EVENT_BACKEND == 'changestream':
+        change_stream_fanout.start()
+    try:
+        subscriber = event_broker.subscribe(user_id)
+    except StreamLimitError as e:
+        response = jsonify({'message': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, e.status_code
+    
+    def generate():
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                event = subscriber.get(timeout=EVENT_KEEPALIVE)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            yield f'event: change\ndata: {app.json.dumps(event)}\n\n'
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs even if the client goes away before the first chunk, which a finally in generate() would miss
+    response.call_on_close(lambda: event_broker.unsubscribe(user_id, subscriber))
+    return response
+
+def build_todo(data, user_id):
+    return {
         'text': data.get('text'),
         'completed': False,
         'priority': data.get('priority', 'medium'),
         'category': data.get('category', 'personal'),
-        'user_id': str(current_user['_id']),
+        'user_id': user_id,
         'created_at': datetime.utcnow(),
+        'updated_at': datetime.utcnow(),
         'time_spent': 0,  # in minutes
         'started_at': None,
         'completed_at': None,
         'estimated_time': data.get('estimated_time', 0)  # in minutes
     }
+
+# Fields a client may change through update_todo and bulk updates
+TODO_UPDATE_FIELDS = ['text', 'completed', 'priority', 'category']
+
+# Todo Routes
+@app.route('/api/todos', methods=['GET'])
+@token_required
+@versioned_etag('todos')
+def get_todos(current_user):
+    query = {'user_id': str(current_user['_id'])}
+    
+    try:
+        projection = get_projection(TODO_FIELDS, TODO_VIEWS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    # Paginated mode is opt-in; without limit/cursor the full list is returned
+    if wants_pagination():
+        try:
+            todos, next_cursor = paginate(mongo.db.todos, query, projection)
+        except (ValueError, KeyError, TypeError, InvalidId):
+            return jsonify({'message': 'Invalid limit or cursor'}), 400
+    else:
+        todos, next_cursor = list(mongo.db.todos.find(query, projection)), None
+    
+    if wants_pagination():
+        return jsonify({'todos': todos, 'next_cursor': next_cursor}), 200
     
-    result = mongo.db.todos.insert_one(todo)
-    todo['_id'] = str(result.inserted_id)
-    todo['created_at'] = todo['created_at'].isoformat()
+    return jsonify(todos), 200
+
+@app.route('/api/todos', methods=['POST'])
+@token_required
+def create_todo(current_user):
+    data = request.get_json()
+    
+    todo = build_todo(data, str(current_user['_id']))
+    
+    mongo.db.todos.insert_one(todo)
+    bump_data_version(str(current_user['_id']), 'todos')
+    publish_change(str(current_user['_id']), 'todo', todo['_id'], 'create', todo)
     
     return jsonify(todo), 201
 
@@ -319,56 +1137,210 @@ def update_todo(current_user, todo_id):
     if not todo:
         return jsonify({'message': 'Todo not found'}), 404
     
-    update_data = {}
-    if 'text' in data:
-        update_data['text'] = data['text']
-    if 'completed' in data:
-        update_data['completed'] = data['completed']
-    if 'priority' in data:
-        update_data['priority'] = data['priority']
-    if 'category' in data:
-        update_data['category'] = data['category']
+    update_data = {field: data[field] for field in TODO_UPDATE_FIELDS if field in data}
+    update_data['updated_at'] = datetime.utcnow()
+    
+    completing = 'completed' in data and data['completed'] and not todo.get('completed')
+    reopening = 'completed' in data and not data['completed'] and todo.get('completed')
+    if completing:
+        update_data['completed_at'] = datetime.utcnow()
+    elif reopening:
+        update_data['completed_at'] = None
     
     mongo.db.todos.update_one(
         {'_id': ObjectId(todo_id)},
         {'$set': update_data}
     )
+    bump_data_version(str(current_user['_id']), 'todos')
+    publish_change(str(current_user['_id']), 'todo', todo_id, 'update', update_data)
     
     # Log activity for completed tasks
-    if 'completed' in data and data['completed'] and not todo.get('completed'):
+    if completing:
         # Task completed
-        mongo.db.activities.insert_one({
+        activity_logger.log({
             'user_id': str(current_user['_id']),
             'type': 'task_completed',
             'description': f'Completed task: {todo["text"]}',
             'task_id': todo_id,
             'created_at': datetime.utcnow()
         })
-        update_data['completed_at'] = datetime.utcnow()
-    elif 'completed' in data and not data['completed'] and todo.get('completed'):
+        record_daily_stats(current_user, update_data['completed_at'], completed=1)
+    elif reopening:
         # Task reopened
-        mongo.db.activities.insert_one({
+        activity_logger.log({
             'user_id': str(current_user['_id']),
             'type': 'task_reopened',
             'description': f'Reopened task: {todo["text"]}',
             'task_id': todo_id,
             'created_at': datetime.utcnow()
         })
-        update_data['completed_at'] = None
+        # Take the completion back off the day it was counted on
+        if todo.get('completed_at'):
+            record_daily_stats(current_user, todo['completed_at'], completed=-1)
 
     return jsonify({'message': 'Todo updated successfully'}), 200
 
+# Bulk create/update/delete/complete in one bulk_write
+MAX_BULK_OPERATIONS = 500
+
+@app.route('/api/todos/bulk', methods=['POST'])
+@token_required
+def bulk_todos(current_user):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'message': 'Request body must be a JSON object'}), 400
+    operations = data.get('operations')
+    
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'message': 'operations must be a non-empty list'}), 400
+    if len(operations) > MAX_BULK_OPERATIONS:
+        return jsonify({'message': f'At most {MAX_BULK_OPERATIONS} operations per request'}), 400
+    
+    user_id = str(current_user['_id'])
+    results = [None] * len(operations)
+    todo_ids = {}
+    
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op not in ('create', 'update', 'delete', 'complete'):
+            results[index] = {'index': index, 'op': op, 'status': 'invalid', 'message': 'Unknown operation'}
+        elif op in ('create', 'update') and not isinstance(operation.get('data') or {}, dict):
+            results[index] = {'index': index, 'op': op, 'status': 'invalid', 'message': 'data must be an object'}
+        elif op != 'create':
+            try:
+                todo_ids[index] = ObjectId(operation.get('id'))
+            except (InvalidId, TypeError):
+                results[index] = {'index': index, 'op': op, 'status': 'invalid', 'message': 'Invalid todo id'}
+    
+    # One ownership check for every referenced todo, like update_todo/delete_todo do one at a time
+    owned = {}
+    if todo_ids:
+        owned = {todo['_id']: todo for todo in mongo.db.todos.find(
+            {'_id': {'$in': list(set(todo_ids.values()))}, 'user_id': user_id},
+            {'text': 1, 'completed': 1, 'completed_at': 1}
+        )}
+    
+    writes = []
+    write_indexes = []
+    activities = {}
+    rollups = {}
+    changes = {}
+    deleted_ids = []
+    now = datetime.utcnow()
+    
+    for index, operation in enumerate(operations):
+        if results[index]:
+            continue
+        op = operation['op']
+        
+        if op == 'create':
+            todo = build_todo(operation.get('data') or {}, user_id)
+            todo['_id'] = ObjectId()
+            writes.append(InsertOne(todo))
+            write_indexes.append(index)
+            changes[index] = ('create', todo)
+            results[index] = {'index': index, 'op': op, 'status': 'created', 'id': str(todo['_id'])}
+            continue
+        
+        todo_id = todo_ids[index]
+        todo = owned.get(todo_id)
+        if not todo:
+            results[index] = {'index': index, 'op': op, 'status': 'not_found', 'id': str(todo_id)}
+            continue
+        
+        if op == 'delete':
+            writes.append(DeleteOne({'_id': todo_id, 'user_id': user_id}))
+            write_indexes.append(index)
+            changes[index] = ('delete', None)
+            deleted_ids.append(str(todo_id))
+            if todo.get('completed') and todo.get('completed_at'):
+                rollups[index] = (todo['completed_at'], -1)
+            del owned[todo_id]
+            results[index] = {'index': index, 'op': op, 'status': 'deleted', 'id': str(todo_id)}
+            continue
+        
+        data = operation.get('data') or {}
+        if op == 'complete':
+            data = {'completed': True}
+        update_data = {field: data[field] for field in TODO_UPDATE_FIELDS if field in data}
+        if not update_data:
+            results[index] = {'index': index, 'op': op, 'status': 'invalid', 'id': str(todo_id), 'message': 'No fields to update'}
+            continue
+        
+        if 'completed' in update_data and bool(update_data['completed']) != bool(todo.get('completed')):
+            completed = bool(update_data['completed'])
+            update_data['completed_at'] = now if completed else None
+            if completed:
+                rollups[index] = (now, 1)
+            elif todo.get('completed_at'):
+                rollups[index] = (todo['completed_at'], -1)
+            activities[index] = {
+                'user_id': user_id,
+                'type': 'task_completed' if completed else 'task_reopened',
+                'description': f'{"Completed" if completed else "Reopened"} task: {todo["text"]}',
+                'task_id': str(todo_id),
+                'created_at': now
+            }
+            todo['completed'] = completed
+            todo['completed_at'] = update_data['completed_at']
+        
+        update_data['updated_at'] = now
+        writes.append(UpdateOne({'_id': todo_id, 'user_id': user_id}, {'$set': update_data}))
+        write_indexes.append(index)
+        changes[index] = ('update', update_data)
+        results[index] = {'index': index, 'op': op, 'status': 'updated', 'id': str(todo_id)}
+    
+    if writes:
+        try:
+            mongo.db.todos.bulk_write(writes, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                index = write_indexes[error['index']]
+                results[index] = dict(results[index], status='failed', message=error.get('errmsg', 'Write failed'))
+                activities.pop(index, None)
+                rollups.pop(index, None)
+                changes.pop(index, None)
+                if results[index]['id'] in deleted_ids:
+                    deleted_ids.remove(results[index]['id'])
+        bump_data_version(user_id, 'todos')
+    
+    # Delete associated comments
+    if deleted_ids:
+        mongo.db.comments.delete_many({'todo_id': {'$in': deleted_ids}})
+        record_tombstones(user_id, 'todo', deleted_ids)
+    
+    if activities:
+        activity_logger.log_many(list(activities.values()))
+    
+    if rollups:
+        record_daily_stats_bulk(current_user, rollups.values())
+    
+    for index, (op, fields) in changes.items():
+        publish_change(user_id, 'todo', results[index]['id'], op, fields)
+    
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    
+    return jsonify({'results': results, 'summary': summary}), 200
+
 @app.route('/api/todos/<todo_id>', methods=['DELETE'])
 @token_required
 def delete_todo(current_user, todo_id):
-    result = mongo.db.todos.delete_one({
+    todo = mongo.db.todos.find_one_and_delete({
         '_id': ObjectId(todo_id),
         'user_id': str(current_user['_id'])
-    })
+    }, projection={'completed': 1, 'completed_at': 1})
     
-    if result.deleted_count == 0:
+    if not todo:
         return jsonify({'message': 'Todo not found'}), 404
     
+    bump_data_version(str(current_user['_id']), 'todos')
+    if todo.get('completed') and todo.get('completed_at'):
+        record_daily_stats(current_user, todo['completed_at'], completed=-1)
+    record_tombstones(str(current_user['_id']), 'todo', [todo_id])
+    publish_change(str(current_user['_id']), 'todo', todo_id, 'delete')
+    
     # Delete associated comments
     mongo.db.comments.delete_many({'todo_id': todo_id})
     
@@ -378,21 +1350,19 @@ def delete_todo(current_user, todo_id):
 @app.route('/api/todos/<todo_id>', methods=['GET'])
 @token_required
 def get_todo(current_user, todo_id):
+    try:
+        projection = get_projection(TODO_FIELDS, TODO_VIEWS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
     todo = mongo.db.todos.find_one({
         '_id': ObjectId(todo_id),
         'user_id': str(current_user['_id'])
-    })
+    }, projection)
     
     if not todo:
         return jsonify({'message': 'Todo not found'}), 404
     
-    todo['_id'] = str(todo['_id'])
-    todo['created_at'] = todo['created_at'].isoformat()
-    if todo.get('completed_at'):
-        todo['completed_at'] = todo['completed_at'].isoformat()
-    if todo.get('started_at'):
-        todo['started_at'] = todo['started_at'].isoformat()
-    
     return jsonify(todo), 200
 
 # Start/Stop time tracking
@@ -414,13 +1384,16 @@ def toggle_time_tracking(current_user, todo_id):
         if todo.get('started_at'):
             return jsonify({'message': 'Timer already running'}), 400
         
+        started_at = datetime.utcnow()
         mongo.db.todos.update_one(
             {'_id': ObjectId(todo_id)},
-            {'$set': {'started_at': datetime.utcnow()}}
+            {'$set': {'started_at': started_at, 'updated_at': started_at}}
         )
+        bump_data_version(str(current_user['_id']), 'todos')
+        publish_change(str(current_user['_id']), 'todo', todo_id, 'update', {'started_at': started_at, 'updated_at': started_at})
         
         # Log activity
-        mongo.db.activities.insert_one({
+        activity_logger.log({
             'user_id': str(current_user['_id']),
             'type': 'timer_started',
             'description': f'Started working on: {todo["text"]}',
@@ -444,13 +1417,15 @@ def toggle_time_tracking(current_user, todo_id):
         mongo.db.todos.update_one(
             {'_id': ObjectId(todo_id)},
             {
-                '$set': {'time_spent': new_time_spent},
+                '$set': {'time_spent': new_time_spent, 'updated_at': datetime.utcnow()},
                 '$unset': {'started_at': ''}
             }
         )
+        bump_data_version(str(current_user['_id']), 'todos')
+        publish_change(str(current_user['_id']), 'todo', todo_id, 'update', {'time_spent': new_time_spent, 'started_at': None})
         
         # Log activity
-        mongo.db.activities.insert_one({
+        activity_logger.log({
             'user_id': str(current_user['_id']),
             'type': 'timer_stopped',
             'description': f'Worked {minutes_spent} minutes on: {todo["text"]}',
@@ -458,6 +1433,7 @@ def toggle_time_tracking(current_user, todo_id):
             'time_spent': minutes_spent,
             'created_at': datetime.utcnow()
         })
+        record_daily_stats(current_user, datetime.utcnow(), time_spent=minutes_spent)
         
         return jsonify({
             'message': 'Timer stopped',
@@ -482,10 +1458,6 @@ def get_comments(current_user, todo_id):
     
     comments = list(mongo.db.comments.find({'todo_id': todo_id}).sort('created_at', -1))
     
-    for comment in comments:
-        comment['_id'] = str(comment['_id'])
-        comment['created_at'] = comment['created_at'].isoformat()
-    
     return jsonify(comments), 200
 
 @app.route('/api/todos/<todo_id>/comments', methods=['POST'])
@@ -504,14 +1476,14 @@ def add_comment(current_user, todo_id):
     
     comment = {
         'todo_id': todo_id,
+        'user_id': str(current_user['_id']),
         'text': data.get('text'),
         'user_email': current_user['email'],
         'created_at': datetime.utcnow()
     }
     
-    result = mongo.db.comments.insert_one(comment)
-    comment['_id'] = str(result.inserted_id)
-    comment['created_at'] = comment['created_at'].isoformat()
+    mongo.db.comments.insert_one(comment)
+    publish_change(str(current_user['_id']), 'comment', comment['_id'], 'create', comment)
     
     return jsonify(comment), 201
 
@@ -525,22 +1497,213 @@ def delete_comment(current_user, todo_id, comment_id):
     
     if result.deleted_count == 0:
         return jsonify({'message': 'Comment not found'}), 404
+    record_tombstones(str(current_user['_id']), 'comment', [comment_id])
+    publish_change(str(current_user['_id']), 'comment', comment_id, 'delete')
     
     return jsonify({'message': 'Comment deleted successfully'}), 200
 
+# Delta sync for the PWA - everything changed since a token, plus tombstones for deletions.
+# Children of a deleted todo/ticket get no tombstones of their own; clients drop them with the parent.
+SYNC_TOMBSTONE_TTL = 30 * 24 * 3600
+# Tokens are backdated so writes that were in flight during a sync are picked up by the next one
+SYNC_OVERLAP = timedelta(seconds=5)
+
+def record_tombstones(user_id, kind, ids):
+    now = datetime.utcnow()
+    mongo.db.tombstones.insert_many([
+        {'user_id': user_id, 'type': kind, 'id': str(doc_id), 'deleted_at': now} for doc_id in ids
+    ])
+
+def encode_sync_token(when):
+    return base64.urlsafe_b64encode(when.isoformat().encode()).decode().rstrip('=')
+
+def decode_sync_token(token):
+    padded = token + '=' * (-len(token) % 4)
+    return datetime.fromisoformat(base64.urlsafe_b64decode(padded.encode()).decode())
+
+@app.route('/api/sync', methods=['GET'])
+@token_required
+def sync_changes(current_user):
+    user_id = str(current_user['_id'])
+    now = datetime.utcnow()
+    since = request.args.get('since')
+    
+    if since:
+        try:
+            since = decode_sync_token(since)
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({'message': 'Invalid sync token'}), 400
+    
+    # Tombstones older than the TTL are gone, so stale clients have to start over
+    full = not since or since < now - timedelta(seconds=SYNC_TOMBSTONE_TTL)
+    
+    if full:
+        todos = list(mongo.db.todos.find({'user_id': user_id}))
+        tickets = list(mongo.db.tickets.find({'user_id': user_id}).sort('created_at', -1))
+        # Looked up by parent, so comments written before they stored user_id are included too
+        response = {
+            'full': True,
+            'todos': todos,
+            'tickets': tickets,
+            'comments': list(mongo.db.comments.find({'todo_id': {'$in': [str(todo['_id']) for todo in todos]}})),
+            'ticket_comments': list(mongo.db.ticket_comments.find({'ticket_id': {'$in': [str(ticket['_id']) for ticket in tickets]}})),
+            'deleted': []
+        }
+    else:
+        changed = {'user_id': user_id, 'updated_at': {'$gt': since}}
+        created = {'user_id': user_id, 'created_at': {'$gt': since}}
+        response = {
+            'full': False,
+            'todos': list(mongo.db.todos.find(changed)),
+            'tickets': list(mongo.db.tickets.find(changed)),
+            'comments': list(mongo.db.comments.find(created)),
+            'ticket_comments': list(mongo.db.ticket_comments.find(created)),
+            'deleted': list(mongo.db.tombstones.find(
+                {'user_id': user_id, 'deleted_at': {'$gt': since}},
+                {'_id': 0, 'type': 1, 'id': 1, 'deleted_at': 1}
+            ))
+        }
+    
+    response['next_token'] = encode_sync_token(now - SYNC_OVERLAP)
+    return jsonify(response), 200
+
+# Full-text search over the per-user text indexes. Each collection is ranked by textScore and the
+# top hits are merged, so paging is by offset and capped rather than keyset. Raw scores depend on
+# field weights and text length, so each source's scores are divided by its best score first.
+SEARCH_SOURCES = {
+    'todo': {'collection': 'todos', 'fields': ['text'], 'parent': None},
+    'ticket': {'collection': 'tickets', 'fields': ['subject', 'description', 'client_name', 'ticket_id'], 'parent': None},
+    'comment': {'collection': 'comments', 'fields': ['text'], 'parent': 'todo_id'},
+    'ticket_comment': {'collection': 'ticket_comments', 'fields': ['text'], 'parent': 'ticket_id'}
+}
+MAX_SEARCH_QUERY = 200
+MAX_SEARCH_OFFSET = 1000
+SEARCH_SNIPPET_LENGTH = 160
+
+def search_pattern(q):
+    # $text matches stems, so highlight any word starting with a shortened form of each term
+    terms = [term for term in re.findall(r'-?\w+', q) if not term.startswith('-')]
+    stems = sorted({term if len(term) <= 4 else term[:len(term) - 2] for term in terms}, key=len, reverse=True)
+    if not stems:
+        return None
+    return re.compile(r'\b(?:' + '|'.join(re.escape(stem) for stem in stems) + r')\w*', re.IGNORECASE)
+
+def build_snippet(text, pattern):
+    """Cut a window of text around the first match; highlights are [start, end) offsets into the snippet."""
+    match = pattern.search(text) if pattern else None
+    start = max(0, match.start() - SEARCH_SNIPPET_LENGTH // 3) if match else 0
+    end = min(len(text), start + SEARCH_SNIPPET_LENGTH)
+    snippet = text[start:end]
+    highlights = [[found.start(), found.end()] for found in pattern.finditer(snippet)] if pattern else []
+    if start > 0:
+        snippet = '\u2026' + snippet
+        highlights = [[begin + 1, finish + 1] for begin, finish in highlights]
+    if end < len(text):
+        snippet += '\u2026'
+    return snippet, highlights
+
+def search_hit(kind, doc, pattern):
+    source = SEARCH_SOURCES[kind]
+    # Tickets show the matching field, preferring the subject
+    text = next((doc.get(field) for field in source['fields']
+                 if doc.get(field) and pattern and pattern.search(doc[field])), None)
+    text = text or doc.get(source['fields'][0]) or ''
+    snippet, highlights = build_snippet(text, pattern)
+    hit = {
+        'type': kind,
+        'id': str(doc['_id']),
+        'score': round(doc['score'], 4),
+        'snippet': snippet,
+        'highlights': highlights,
+        'created_at': doc.get('created_at')
+    }
+    if kind == 'ticket':
+        hit['title'] = doc.get('subject')
+    if source['parent']:
+        hit['parent_id'] = doc.get(source['parent'])
+    return hit
+
+@app.route('/api/search', methods=['GET'])
+@token_required
+def search(current_user):
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'message': 'q is required'}), 400
+    if len(q) > MAX_SEARCH_QUERY:
+        return jsonify({'message': f'q must be at most {MAX_SEARCH_QUERY} characters'}), 400
+    
+    types = request.args.get('types')
+    types = [kind.strip() for kind in types.split(',') if kind.strip()] if types else list(SEARCH_SOURCES)
+    unknown = [kind for kind in types if kind not in SEARCH_SOURCES]
+    if unknown:
+        return jsonify({'message': f'Unknown types: {", ".join(unknown)}'}), 400
+    
+    try:
+        limit = get_page_size()
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'message': 'Invalid limit or offset'}), 400
+    if offset < 0 or offset > MAX_SEARCH_OFFSET:
+        return jsonify({'message': f'offset must be between 0 and {MAX_SEARCH_OFFSET}'}), 400
+    
+    user_id = str(current_user['_id'])
+    hits = []
+    for kind in types:
+        source = SEARCH_SOURCES[kind]
+        projection = {field: 1 for field in source['fields']}
+        projection.update({'created_at': 1, 'score': {'$meta': 'textScore'}})
+        if source['parent']:
+            projection[source['parent']] = 1
+        # Any page of the merged ranking is drawn from each collection's top offset + limit hits
+        cursor = mongo.db[source['collection']].find(
+            {'user_id': user_id, '$text': {'$search': q}}, projection
+        ).sort([('score', {'$meta': 'textScore'})]).limit(offset + limit + 1)
+        docs = list(cursor)
+        # The first page always includes each source's best hit, so this scale holds across pages
+        for doc in docs:
+            doc['score'] = doc['score'] / docs[0]['score']
+        hits.extend((kind, doc) for doc in docs)
+    
+    # Ties (each source's best hit scores 1) go to the newest document
+    hits.sort(key=lambda hit: (hit[1]['score'], hit[1].get('created_at') or datetime.min), reverse=True)
+    pattern = search_pattern(q)
+    results = [search_hit(kind, doc, pattern) for kind, doc in hits[offset:offset + limit]]
+    has_more = len(hits) > offset + limit and offset + limit <= MAX_SEARCH_OFFSET
+    
+    return jsonify({'results': results, 'next_offset': offset + limit if has_more else None}), 200
+
+def backfill_comment_owners():
+    """Copy user_id from the parent todo/ticket onto comments written before comments stored it."""
+    for collection, parents, parent_field in [('comments', 'todos', 'todo_id'), ('ticket_comments', 'tickets', 'ticket_id')]:
+        updated = 0
+        parent_ids = mongo.db[collection].distinct(parent_field, {'user_id': {'$exists': False}})
+        for start in range(0, len(parent_ids), IMPORT_BATCH_SIZE):
+            batch = parent_ids[start:start + IMPORT_BATCH_SIZE]
+            object_ids = [ObjectId(parent_id) for parent_id in batch if ObjectId.is_valid(parent_id)]
+            writes = [
+                UpdateMany({parent_field: str(parent['_id']), 'user_id': {'$exists': False}}, {'$set': {'user_id': parent['user_id']}})
+                for parent in mongo.db[parents].find({'_id': {'$in': object_ids}}, {'user_id': 1})
+            ]
+            if writes:
+                updated += mongo.db[collection].bulk_write(writes, ordered=False).modified_count
+        print(f"Set user_id on {updated} {collection}")
+
+@app.cli.command('backfill-comment-owners')
+def backfill_comment_owners_command():
+    """Copy user_id from the parent todo/ticket onto comments written before comments stored it."""
+    backfill_comment_owners()
+
 # Activity Feed
 @app.route('/api/activities', methods=['GET'])
 @token_required
 def get_activities(current_user):
     limit = int(request.args.get('limit', 50))
+    # Write out this worker's buffered events so the feed includes them
+    activity_logger.flush()
     activities = list(mongo.db.activities.find(
         {'user_id': str(current_user['_id'])}
     ).sort('created_at', -1).limit(limit))
     
-    for activity in activities:
-        activity['_id'] = str(activity['_id'])
-        activity['created_at'] = activity['created_at'].isoformat()
-    
     return jsonify(activities), 200
 
 @app.route('/api/health', methods=['GET'])
@@ -552,19 +1715,9 @@ def health_check():
 @token_required
 def debug_user_settings(current_user):
     api_settings = current_user.get('api_settings', {})
-    ai_provider = api_settings.get('ai_provider', 'gemini')
     
     # Get the actual API key that would be used
-    if ai_provider == 'gemini':
-        api_key = api_settings.get('gemini_api_key', '') or os.getenv('GEMINI_API_KEY')
-    elif ai_provider == 'openai':
-        api_key = api_settings.get('openai_api_key', '') or os.getenv('OPENAI_API_KEY')
-    elif ai_provider == 'claude':
-        api_key = api_settings.get('claude_api_key', '') or os.getenv('CLAUDE_API_KEY')
-    elif ai_provider == 'custom':
-        api_key = api_settings.get('custom_api_key', '')
-    else:
-        api_key = None
+    ai_provider, api_key, custom_endpoint = get_ai_settings(current_user)
     
     return jsonify({
         'user_id': str(current_user['_id']),
@@ -576,44 +1729,44 @@ def debug_user_settings(current_user):
         'api_key_preview': api_key[:10] + '...' if api_key and len(api_key) > 10 else api_key,
         'has_env_gemini_key': bool(os.getenv('GEMINI_API_KEY')),
         'env_gemini_key_length': len(os.getenv('GEMINI_API_KEY', '')),
-        'gemini_url': f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={'[KEY]' if api_key else '[NO_KEY]'}"
+        'gemini_url': GEMINI_URL
+    }), 200
+
+# Cache statistics for this worker process
+@app.route('/api/debug/cache-stats', methods=['GET'])
+@token_required
+def debug_cache_stats(current_user):
+    return jsonify({
+        'user_cache': user_cache.stats(),
+        'export_cache': export_cache.stats(),
+        'ai_cache': ai_cache.stats(),
+        'ai_single_flight': ai_flight.stats(),
+        'ai_jobs': ai_job_stats(),
+        'events': event_broker.stats()
     }), 200
 
 # Test AI API endpoint
 @app.route('/api/debug/test-ai', methods=['POST'])
 @token_required
 def test_ai_api(current_user):
-    api_settings = current_user.get('api_settings', {})
-    ai_provider = api_settings.get('ai_provider', 'gemini')
-    
-    # Get API key
-    if ai_provider == 'gemini':
-        api_key = api_settings.get('gemini_api_key', '') or os.getenv('GEMINI_API_KEY')
-    else:
-        return jsonify({'message': 'Only Gemini testing supported for now'}), 400
+    ai_provider, api_key, custom_endpoint = get_ai_settings(current_user)
     
-    if not api_key:
+    if ai_provider not in AI_PROVIDERS:
+        return jsonify({'message': 'Invalid AI provider selected.'}), 400
+    if not api_key or (ai_provider == 'custom' and not custom_endpoint):
         return jsonify({'message': 'No API key found'}), 400
     
     # Simple test prompt
     test_prompt = "Say 'Hello, this is a test response' in JSON format: {\"message\": \"your response\"}"
     
     try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-        payload = {
-            "contents": [{
-                "parts": [{
-                    "text": test_prompt
-                }]
-            }]
-        }
-        
-        response = requests.post(url, json=payload)
+        response = ai_client.send(ai_provider, api_key, test_prompt, custom_endpoint)
         
         return jsonify({
             'status_code': response.status_code,
             'response_text': response.text[:1000],  # First 1000 chars
-            'url': url.replace(api_key, '[HIDDEN_KEY]'),
+            'url': response.url,
+            'provider': ai_provider,
             'success': response.status_code == 200
         }), 200
         
@@ -623,99 +1776,621 @@ def test_ai_api(current_user):
             'success': False
         }), 200
 
+# Daily stats rollups - one document per user and local date, kept up to date by the
+# todo and timer routes so analytics never has to regroup raw todos
+def get_user_timezone(user):
+    try:
+        return ZoneInfo(user.get('timezone') or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        return ZoneInfo('UTC')
+
+def local_date(user, when):
+    # Stored datetimes are naive UTC
+    return when.replace(tzinfo=dt_timezone.utc).astimezone(get_user_timezone(user)).strftime('%Y-%m-%d')
+
+def daily_stats_change(completed=0, time_spent=0):
+    return {
+        '$inc': {'completed': completed, 'time_spent': time_spent},
+        '$set': {'updated_at': datetime.utcnow()}
+    }
+
+def record_daily_stats(user, when, completed=0, time_spent=0):
+    mongo.db.daily_stats.update_one(
+        {'user_id': str(user['_id']), 'date': local_date(user, when)},
+        daily_stats_change(completed, time_spent),
+        upsert=True
+    )
+
+def record_daily_stats_bulk(user, changes):
+    """Apply (when, completed_delta) pairs with one write per local date."""
+    per_date = {}
+    for when, completed in changes:
+        date = local_date(user, when)
+        per_date[date] = per_date.get(date, 0) + completed
+    
+    updates = [
+        UpdateOne({'user_id': str(user['_id']), 'date': date}, daily_stats_change(completed), upsert=True)
+        for date, completed in per_date.items() if completed
+    ]
+    if updates:
+        mongo.db.daily_stats.bulk_write(updates, ordered=False)
+
+def rebuild_daily_stats(user):
+    """Recompute a user's rollups from todos (completions) and timer_stopped activities (time).
+    
+    Completed todos without a completed_at timestamp cannot be placed on a day and are skipped.
+    """
+    user_id = str(user['_id'])
+    timezone_name = get_user_timezone(user).key
+    
+    def local_day(field):
+        return {'$dateToString': {'format': '%Y-%m-%d', 'date': field, 'timezone': timezone_name}}
+    
+    rollups = {}
+    completions = mongo.db.todos.aggregate([
+        {'$match': {'user_id': user_id, 'completed': True, 'completed_at': {'$type': 'date'}}},
+        {'$group': {'_id': local_day('$completed_at'), 'count': {'$sum': 1}}}
+    ])
+    for row in completions:
+        rollups.setdefault(row['_id'], {'completed': 0, 'time_spent': 0})['completed'] = row['count']
+    
+    time_entries = mongo.db.activities.aggregate([
+        {'$match': {'user_id': user_id, 'type': 'timer_stopped'}},
+        {'$group': {'_id': local_day('$created_at'), 'minutes': {'$sum': '$time_spent'}}}
+    ])
+    for row in time_entries:
+        rollups.setdefault(row['_id'], {'completed': 0, 'time_spent': 0})['time_spent'] = row['minutes']
+    
+    mongo.db.daily_stats.delete_many({'user_id': user_id})
+    now = datetime.utcnow()
+    if rollups:
+        mongo.db.daily_stats.insert_many([
+            {'user_id': user_id, 'date': date, **values, 'updated_at': now}
+            for date, values in rollups.items()
+        ])
+    return len(rollups)
+
+@app.cli.command('backfill-daily-stats')
+@click.option('--user-id', default=None, help='Only rebuild rollups for this user')
+def backfill_daily_stats_command(user_id):
+    """Rebuild daily_stats rollups from existing todos and activities."""
+    query = {'_id': ObjectId(user_id)} if user_id else {}
+    users = 0
+    days = 0
+    for user in mongo.db.users.find(query, {'timezone': 1}):
+        days += rebuild_daily_stats(user)
+        users += 1
+    print(f"Rebuilt {days} daily rollups for {users} users")
+
 # Analytics and Stats
+STATS_SECTIONS = ['counts', 'time', 'categories', 'priorities', 'daily']
+
 @app.route('/api/analytics/stats', methods=['GET'])
 @token_required
 def get_user_stats(current_user):
-    user_id = str(current_user['_id'])
+    sections = request.args.get('sections')
+    sections = [name.strip() for name in sections.split(',') if name.strip()] if sections else STATS_SECTIONS
+    unknown = [name for name in sections if name not in STATS_SECTIONS]
+    if unknown:
+        return jsonify({'message': f'Unknown sections: {", ".join(unknown)}'}), 400
     
-    # Basic counts
-    total_todos = mongo.db.todos.count_documents({'user_id': user_id})
-    completed_todos = mongo.db.todos.count_documents({'user_id': user_id, 'completed': True})
-    active_todos = total_todos - completed_todos
-    
-    # Time stats
-    time_pipeline = [
-        {'$match': {'user_id': user_id}},
-        {'$group': {
-            '_id': None,
-            'total_time': {'$sum': '$time_spent'},
-            'avg_time': {'$avg': '$time_spent'}
-        }}
-    ]
-    time_stats = list(mongo.db.todos.aggregate(time_pipeline))
-    total_time = time_stats[0]['total_time'] if time_stats else 0
-    avg_time = time_stats[0]['avg_time'] if time_stats else 0
+    return jsonify(compute_user_stats(current_user, sections)), 200
+
+def compute_user_stats(current_user, sections):
+    user_id = str(current_user['_id'])
     
-    # Completion rate
-    completion_rate = (completed_todos / total_todos * 100) if total_todos > 0 else 0
+    # Every section is a branch of one $facet, so the user's todos are read once
+    facets = {}
+    
+    # Basic counts and time stats
+    if 'counts' in sections or 'time' in sections:
+        facets['totals'] = [
+            {'$group': {
+                '_id': None,
+                'total': {'$sum': 1},
+                'completed': {'$sum': {'$cond': ['$completed', 1, 0]}},
+                'total_time': {'$sum': '$time_spent'},
+                'avg_time': {'$avg': '$time_spent'}
+            }}
+        ]
     
     # Category breakdown
-    category_pipeline = [
-        {'$match': {'user_id': user_id}},
-        {'$group': {
-            '_id': '$category',
-            'total': {'$sum': 1},
-            'completed': {'$sum': {'$cond': ['$completed', 1, 0]}}
-        }}
-    ]
-    category_stats = list(mongo.db.todos.aggregate(category_pipeline))
+    if 'categories' in sections:
+        facets['categories'] = [
+            {'$group': {
+                '_id': '$category',
+                'total': {'$sum': 1},
+                'completed': {'$sum': {'$cond': ['$completed', 1, 0]}}
+            }}
+        ]
     
     # Priority breakdown
-    priority_pipeline = [
-        {'$match': {'user_id': user_id}},
-        {'$group': {
-            '_id': '$priority',
-            'total': {'$sum': 1},
-            'completed': {'$sum': {'$cond': ['$completed', 1, 0]}}
-        }}
-    ]
-    priority_stats = list(mongo.db.todos.aggregate(priority_pipeline))
+    if 'priorities' in sections:
+        facets['priorities'] = [
+            {'$group': {
+                '_id': '$priority',
+                'total': {'$sum': 1},
+                'completed': {'$sum': {'$cond': ['$completed', 1, 0]}}
+            }}
+        ]
     
-    # Daily completion trend (last 7 days)
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    daily_pipeline = [
-        {'$match': {
-            'user_id': user_id,
-            'completed': True,
-            'completed_at': {'$gte': seven_days_ago}
-        }},
-        {'$group': {
-            '_id': {
-                'year': {'$year': '$completed_at'},
-                'month': {'$month': '$completed_at'},
-                'day': {'$dayOfMonth': '$completed_at'}
-            },
-            'count': {'$sum': 1}
-        }},
-        {'$sort': {'_id': 1}}
-    ]
-    daily_completions = list(mongo.db.todos.aggregate(daily_pipeline))
+    result = {}
+    if facets:
+        pipeline = [
+            {'$match': {'user_id': user_id}},
+            {'$facet': facets}
+        ]
+        result = list(mongo.db.todos.aggregate(pipeline))
+        result = result[0] if result else {}
+    
+    stats = {}
+    totals = result['totals'][0] if result.get('totals') else {}
+    
+    if 'counts' in sections:
+        total_todos = totals.get('total', 0)
+        completed_todos = totals.get('completed', 0)
+        completion_rate = (completed_todos / total_todos * 100) if total_todos > 0 else 0
+        stats.update({
+            'total_todos': total_todos,
+            'completed_todos': completed_todos,
+            'active_todos': total_todos - completed_todos,
+            'completion_rate': round(completion_rate, 1)
+        })
     
-    return jsonify({
-        'total_todos': total_todos,
-        'completed_todos': completed_todos,
-        'active_todos': active_todos,
-        'completion_rate': round(completion_rate, 1),
-        'total_time_minutes': int(total_time),
-        'avg_time_minutes': round(avg_time, 1),
-        'category_breakdown': category_stats,
-        'priority_breakdown': priority_stats,
-        'daily_completions': daily_completions
-    }), 200
-
-# AI Task Suggestions with Multiple Providers
-@app.route('/api/ai/suggestions', methods=['POST'])
-@token_required
-def get_ai_suggestions(current_user):
-    data = request.get_json()
-    context = data.get('context', '')
+    if 'time' in sections:
+        stats.update({
+            'total_time_minutes': int(totals.get('total_time') or 0),
+            'avg_time_minutes': round(totals.get('avg_time') or 0, 1)
+        })
     
-    # Get user's recent tasks for context
-    recent_todos = list(mongo.db.todos.find(
-        {'user_id': str(current_user['_id'])}
-    ).sort('created_at', -1).limit(10))
+    if 'categories' in sections:
+        stats['category_breakdown'] = result.get('categories', [])
+    if 'priorities' in sections:
+        stats['priority_breakdown'] = result.get('priorities', [])
+    # Daily completion trend (last 7 days in the user's timezone) from the rollups
+    if 'daily' in sections:
+        first_day = local_date(current_user, datetime.utcnow() - timedelta(days=6))
+        rollups = mongo.db.daily_stats.find(
+            {'user_id': user_id, 'date': {'$gte': first_day}, 'completed': {'$gt': 0}}
+        ).sort('date', 1)
+        stats['daily_completions'] = [{
+            '_id': {
+                'year': int(rollup['date'][:4]),
+                'month': int(rollup['date'][5:7]),
+                'day': int(rollup['date'][8:10])
+            },
+            'count': rollup['completed'],
+            'time_spent': rollup.get('time_spent', 0)
+        } for rollup in rollups]
     
+    return stats
+
+# AI provider client - one pooled Session per provider so TLS connections are reused, explicit
+# (connect, read) timeouts so a hung provider can't pin a worker, and jittered retries on 429/5xx
+AI_CONNECT_TIMEOUT = float(os.getenv('AI_CONNECT_TIMEOUT', 5))
+AI_READ_TIMEOUT = float(os.getenv('AI_READ_TIMEOUT', 60))
+AI_MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', 2))
+AI_POOL_SIZE = int(os.getenv('AI_POOL_SIZE', 10))
+AI_RETRY_BACKOFF = 0.5
+AI_MAX_RETRY_DELAY = 8
+AI_RETRY_STATUSES = {429, 500, 502, 503, 504}
+GEMINI_URL = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent'
+
+AI_PROVIDERS = {
+    'gemini': {'label': 'Gemini', 'key_setting': 'gemini_api_key', 'env': 'GEMINI_API_KEY'},
+    'openai': {'label': 'OpenAI', 'key_setting': 'openai_api_key', 'env': 'OPENAI_API_KEY'},
+    'claude': {'label': 'Claude', 'key_setting': 'claude_api_key', 'env': 'CLAUDE_API_KEY'},
+    'custom': {'label': 'Custom', 'key_setting': 'custom_api_key', 'env': None}
+}
+
+class AIProviderError(Exception):
+    """The provider answered with a non-200 status after retries."""
+    def __init__(self, provider, response):
+        super().__init__(f'{provider} returned status {response.status_code}')
+        self.provider = provider
+        self.status_code = response.status_code
+        self.response_text = response.text[:500]
+        self.url = response.url
+
+def get_ai_settings(user):
+    """(provider, api_key, custom_endpoint) for a user; server keys back up the user's own."""
+    api_settings = user.get('api_settings', {})
+    provider = api_settings.get('ai_provider', 'gemini')
+    config = AI_PROVIDERS.get(provider)
+    if not config:
+        return provider, None, None
+    api_key = api_settings.get(config['key_setting'], '') or (os.getenv(config['env']) if config['env'] else '')
+    custom_endpoint = api_settings.get('custom_api_endpoint', '') if provider == 'custom' else None
+    return provider, api_key, custom_endpoint
+
+def parse_ai_json(text):
+    """Parse a JSON reply, dropping the markdown fence models like to wrap it in."""
+    clean_response = text.strip()
+    if clean_response.startswith('```json'):
+        clean_response = clean_response[7:]
+    if clean_response.endswith('```'):
+        clean_response = clean_response[:-3]
+    return json.loads(clean_response)
+
+class AIClient:
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+    
+    def session(self, provider):
+        with self.lock:
+            if provider not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=AI_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self.sessions[provider] = session
+            return self.sessions[provider]
+    
+    def build_request(self, provider, api_key, prompt, custom_endpoint=None, max_tokens=1000):
+        """(url, headers, payload) for a single-prompt completion."""
+        if provider == 'gemini':
+            return GEMINI_URL, {'x-goog-api-key': api_key}, {
+                'contents': [{'parts': [{'text': prompt}]}]
+            }
+        if provider == 'openai':
+            return 'https://api.openai.com/v1/chat/completions', {'Authorization': f'Bearer {api_key}'}, {
+                'model': 'gpt-3.5-turbo',
+                'messages': [{'role': 'user', 'content': prompt}],
+                'max_tokens': max_tokens
+            }
+        if provider == 'claude':
+            return 'https://api.anthropic.com/v1/messages', {'x-api-key': api_key, 'anthropic-version': '2023-06-01'}, {
+                'model': 'claude-3-sonnet-20240229',
+                'max_tokens': max_tokens,
+                'messages': [{'role': 'user', 'content': prompt}]
+            }
+        if provider == 'custom':
+            return custom_endpoint, {'Authorization': f'Bearer {api_key}'}, {
+                'prompt': prompt,
+                'max_tokens': max_tokens
+            }
+        raise ValueError(f'Unknown AI provider: {provider}')
+    
+    def extract_text(self, provider, result):
+        if provider == 'gemini':
+            return result['candidates'][0]['content']['parts'][0]['text']
+        if provider == 'openai':
+            return result['choices'][0]['message']['content']
+        if provider == 'claude':
+            return result['content'][0]['text']
+        return result.get('response', result.get('text', str(result)))
+    
+    def retry_delay(self, response, attempt):
+        """Seconds to wait before the next attempt, or None when a numeric Retry-After asks for longer
+        than AI_MAX_RETRY_DELAY - retrying sooner would only be refused again."""
+        delay = random.uniform(0, AI_RETRY_BACKOFF * 2 ** attempt)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            if float(retry_after) > AI_MAX_RETRY_DELAY:
+                return None
+            delay = max(delay, float(retry_after))
+        return min(delay, AI_MAX_RETRY_DELAY)
+    
+    def post(self, provider, url, headers, payload, stream=False):
+        """POST with retries on 429/5xx and failed connects; returns the last response."""
+        session = self.session(provider)
+        
+        for attempt in range(AI_MAX_RETRIES + 1):
+            try:
+                response = session.post(url, json=payload, headers=headers, stream=stream,
+                                         timeout=(AI_CONNECT_TIMEOUT, AI_READ_TIMEOUT))
+            except (requests.ConnectionError, requests.ConnectTimeout):
+                # Read timeouts are not retried - the provider may still be working on the first attempt
+                if attempt == AI_MAX_RETRIES:
+                    raise
+                time.sleep(self.retry_delay(None, attempt))
+                continue
+            
+            if response.status_code not in AI_RETRY_STATUSES or attempt == AI_MAX_RETRIES:
+                return response
+            delay = self.retry_delay(response, attempt)
+            if delay is None:
+                print(f"AI provider {provider} returned {response.status_code} with Retry-After {response.headers['Retry-After']}s, not retrying")
+                return response
+            print(f"AI provider {provider} returned {response.status_code}, retrying (attempt {attempt + 1})")
+            response.close()
+            time.sleep(delay)
+    
+    def send(self, provider, api_key, prompt, custom_endpoint=None, max_tokens=1000):
+        """POST a prompt and return the raw response."""
+        url, headers, payload = self.build_request(provider, api_key, prompt, custom_endpoint, max_tokens)
+        return self.post(provider, url, headers, payload)
+    
+    def generate(self, provider, api_key, prompt, custom_endpoint=None, max_tokens=1000):
+        """Return the completion text, or raise AIProviderError for a non-200 answer."""
+        response = self.send(provider, api_key, prompt, custom_endpoint, max_tokens)
+        if response.status_code != 200:
+            raise AIProviderError(provider, response)
+        return self.extract_text(provider, response.json())
+    
+    def stream_text(self, provider, event):
+        """Text carried by one streamed SSE payload, or '' for bookkeeping events."""
+        if provider == 'gemini':
+            parts = (event.get('candidates') or [{}])[0].get('content', {}).get('parts', [])
+            return ''.join(part.get('text', '') for part in parts)
+        if provider == 'openai':
+            return ((event.get('choices') or [{}])[0].get('delta') or {}).get('content') or ''
+        if provider == 'claude' and event.get('type') == 'content_block_delta':
+            return event.get('delta', {}).get('text', '')
+        return ''
+    
+    def stream(self, provider, api_key, prompt, custom_endpoint=None, max_tokens=1000):
+        """Yield the completion as it arrives, using each provider's SSE streaming API."""
+        if provider == 'custom':
+            # Custom endpoints have no streaming contract, so their reply arrives in one piece
+            yield self.generate(provider, api_key, prompt, custom_endpoint, max_tokens)
+            return
+        
+        url, headers, payload = self.build_request(provider, api_key, prompt, custom_endpoint, max_tokens)
+        if provider == 'gemini':
+            url = url.replace(':generateContent', ':streamGenerateContent') + '?alt=sse'
+        else:
+            payload['stream'] = True
+        
+        response = self.post(provider, url, headers, payload, stream=True)
+        with response:
+            if response.status_code != 200:
+                raise AIProviderError(provider, response)
+            response.encoding = response.encoding or 'utf-8'
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                body = line[5:].strip()
+                if body == '[DONE]':
+                    break
+                text = self.stream_text(provider, json.loads(body))
+                if text:
+                    yield text
+
+ai_client = AIClient()
+
+def ai_fingerprint(user_id, route, provider, prompt, custom_endpoint=None):
+    """Identity of an AI request - the prompt already embeds the task snapshot and request body."""
+    return hashlib.sha256('\0'.join([user_id, route, provider, custom_endpoint or '', prompt]).encode()).hexdigest()
+
+# Single-flight - identical AI requests (same fingerprint) running at the same time in this process
+# wait on one provider call and share its result or its error
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+    
+    def do(self, key, fn, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self.calls[key] = call
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            # The leader's call is bounded by the client's timeouts and retries, so this always returns
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        
+        try:
+            call['result'] = fn(*args)
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call['done'].set()
+    
+    def stats(self):
+        with self.lock:
+            return {'in_flight': len(self.calls), 'leaders': self.leaders, 'coalesced': self.coalesced}
+
+ai_flight = SingleFlight()
+
+# Streaming AI replies - raw text is relayed as `delta` events, each top-level key of the JSON reply
+# is sent as a `section` event as soon as it parses, and `done` carries the whole result
+class JSONSectionParser:
+    """Incrementally pick complete top-level members out of a JSON object as it streams in."""
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.start = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+    
+    def feed(self, text):
+        self.buffer += text
+        sections = []
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+            if self.start is None:
+                # Skip anything before the root object, like a markdown fence
+                if char == '{':
+                    self.depth = 1
+                    self.start = self.pos + 1
+            elif self.depth == 0:
+                break
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    sections.extend(self.member(self.pos))
+            elif char == ',' and self.depth == 1:
+                sections.extend(self.member(self.pos))
+                self.start = self.pos + 1
+            self.pos += 1
+        return sections
+    
+    def member(self, end):
+        text = self.buffer[self.start:end].strip()
+        if not text:
+            return []
+        try:
+            return list(json.loads('{' + text + '}').items())
+        except json.JSONDecodeError:
+            # Malformed sections are left to the final parse
+            return []
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {app.json.dumps(data)}\n\n'
+
+def stream_ai_reply(ai_provider, api_key, prompt, custom_endpoint, on_result=None, cached=None):
+    def generate():
+        if cached is not None:
+            if isinstance(cached, dict):
+                for key, value in cached.items():
+                    yield sse_event('section', {'key': key, 'value': value})
+            yield sse_event('done', cached)
+            return
+        
+        parser = JSONSectionParser()
+        chunks = []
+        started = time.perf_counter()
+        try:
+            for text in ai_client.stream(ai_provider, api_key, prompt, custom_endpoint):
+                chunks.append(text)
+                yield sse_event('delta', {'text': text})
+                for key, value in parser.feed(text):
+                    yield sse_event('section', {'key': key, 'value': value})
+        except AIProviderError as e:
+            yield sse_event('error', {'message': f'AI provider returned status {e.status_code}', 'status_code': e.status_code})
+            return
+        except Exception as e:
+            yield sse_event('error', {'message': f'AI service error: {str(e)}'})
+            return
+        
+        ai_response = ''.join(chunks)
+        try:
+            result = parse_ai_json(ai_response)
+        except json.JSONDecodeError:
+            yield sse_event('done', {
+                'raw_response': ai_response,
+                'message': 'AI response received but could not parse JSON'
+            })
+            return
+        if on_result:
+            on_result(result, time.perf_counter() - started)
+        yield sse_event('done', result)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# AI response cache - parsed replies keyed by user, route, provider and a hash of the prompt, which
+# already embeds the task snapshot and request body. AI_CACHE_PERSIST adds a MongoDB tier that
+# every worker shares and that survives restarts.
+AI_CACHE_SIZE = int(os.getenv('AI_CACHE_SIZE', 500))
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', 600))
+AI_CACHE_PERSIST = os.getenv('AI_CACHE_PERSIST', 'false').lower() == 'true'
+
+class AIResponseCache:
+    def __init__(self, max_size, ttl, persist):
+        self.memory = TTLCache(max_size, ttl)
+        self.ttl = ttl
+        self.persist = persist
+        self.lock = threading.Lock()
+        self.counts = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'bypassed': 0}
+        self.saved_seconds = 0.0
+    
+    def get(self, key):
+        # Entries are (reply, seconds the provider call took) so hits can report the time they saved
+        entry = self.memory.get(key)
+        tier = 'memory_hits'
+        if entry is None and self.persist:
+            try:
+                doc = mongo.db.ai_cache.find_one({'_id': key, 'expires_at': {'$gt': datetime.utcnow()}})
+            except PyMongoError as e:
+                print(f"AI cache read failed: {str(e)}")
+                doc = None
+            if doc:
+                entry = (json.loads(doc['response']), doc['latency'])
+                self.memory.set(key, entry)
+                tier = 'persistent_hits'
+        
+        with self.lock:
+            if entry is None:
+                self.counts['misses'] += 1
+                return None
+            self.counts[tier] += 1
+            self.saved_seconds += entry[1]
+        return entry[0]
+    
+    def set(self, key, user_id, route, reply, latency):
+        self.memory.set(key, (reply, latency))
+        if not self.persist:
+            return
+        try:
+            # Stored as a JSON string - model output may use keys MongoDB won't accept
+            mongo.db.ai_cache.replace_one({'_id': key}, {
+                'user_id': user_id,
+                'route': route,
+                'response': json.dumps(reply),
+                'latency': latency,
+                'expires_at': datetime.utcnow() + timedelta(seconds=self.ttl)
+            }, upsert=True)
+        except PyMongoError as e:
+            print(f"AI cache write failed: {str(e)}")
+    
+    def record_bypass(self):
+        with self.lock:
+            self.counts['bypassed'] += 1
+    
+    def stats(self):
+        with self.lock:
+            hits = self.counts['memory_hits'] + self.counts['persistent_hits']
+            lookups = hits + self.counts['misses']
+            return {
+                'size': self.memory.stats()['size'],
+                'max_size': self.memory.max_size,
+                'ttl_seconds': self.ttl,
+                'persistent': self.persist,
+                **self.counts,
+                'hit_rate': round(hits / lookups * 100, 1) if lookups else 0,
+                'saved_seconds': round(self.saved_seconds, 1)
+            }
+
+ai_cache = AIResponseCache(AI_CACHE_SIZE, AI_CACHE_TTL, AI_CACHE_PERSIST)
+
+def lookup_ai_cache(key, data):
+    """(cached reply or None, status for the X-AI-Cache header); {"cache": "bypass"} skips the lookup."""
+    if (data or {}).get('cache') == 'bypass':
+        ai_cache.record_bypass()
+        return None, 'bypass'
+    cached = ai_cache.get(key)
+    return cached, 'hit' if cached is not None else 'miss'
+
+def ai_cache_response(reply, cache_status):
+    response = jsonify(reply)
+    response.headers['X-AI-Cache'] = cache_status
+    return response, 200
+
+def get_recent_todos(user, limit=10):
+    return list(mongo.db.todos.find({'user_id': str(user['_id'])}).sort('created_at', -1).limit(limit))
+
+def build_suggestions_prompt(recent_todos, context):
     # Prepare context for AI
     task_context = []
     for todo in recent_todos:
@@ -726,77 +2401,6 @@ def get_ai_suggestions(current_user):
             'completed': todo['completed']
         })
     
-    # Get AI provider settings
-    api_settings = current_user.get('api_settings', {})
-    ai_provider = api_settings.get('ai_provider', 'gemini')
-    
-    # Get appropriate API key based on provider
-    if ai_provider == 'gemini':
-        api_key = api_settings.get('gemini_api_key', '') or os.getenv('GEMINI_API_KEY')
-        if not api_key:
-            # Smart fallback suggestions based on user's actual tasks
-            incomplete_tasks = [t for t in recent_todos if not t['completed']]
-            total_tasks = len(recent_todos)
-            
-            fallback_suggestions = [
-                {
-                    "text": "Set up your AI API key in Profile Settings for personalized suggestions",
-                    "category": "work",
-                    "priority": "medium",
-                    "reasoning": "AI can provide smarter task recommendations based on your patterns",
-                    "action_type": "optimize"
-                }
-            ]
-            
-            if incomplete_tasks:
-                fallback_suggestions.append({
-                    "text": f"Focus on completing your {len(incomplete_tasks)} pending tasks",
-                    "category": "work",
-                    "priority": "high",
-                    "reasoning": "Completing existing tasks before adding new ones improves productivity",
-                    "action_type": "focus"
-                })
-                
-                # Suggest specific incomplete task
-                if incomplete_tasks:
-                    fallback_suggestions.append({
-                        "text": f"Work on: {incomplete_tasks[0]['text'][:50]}{'...' if len(incomplete_tasks[0]['text']) > 50 else ''}",
-                        "category": incomplete_tasks[0]['category'],
-                        "priority": incomplete_tasks[0]['priority'],
-                        "reasoning": "This task is waiting for your attention",
-                        "action_type": "focus"
-                    })
-            else:
-                fallback_suggestions.append({
-                    "text": "Plan your next goals and create actionable tasks",
-                    "category": "personal",
-                    "priority": "medium",
-                    "reasoning": "Good planning leads to better productivity",
-                    "action_type": "plan"
-                })
-            return jsonify({
-                'suggestions': fallback_suggestions,
-                'message': 'Gemini API key not configured. Please set it in your profile settings for AI-powered suggestions.',
-                'fallback': True,
-                'setup_required': True
-            }), 200
-            
-    elif ai_provider == 'openai':
-        api_key = api_settings.get('openai_api_key', '') or os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            return jsonify({'message': 'OpenAI API key not configured. Please set it in your profile settings.'}), 500
-    elif ai_provider == 'claude':
-        api_key = api_settings.get('claude_api_key', '') or os.getenv('CLAUDE_API_KEY')
-        if not api_key:
-            return jsonify({'message': 'Claude API key not configured. Please set it in your profile settings.'}), 500
-    elif ai_provider == 'custom':
-        api_key = api_settings.get('custom_api_key', '')
-        custom_endpoint = api_settings.get('custom_api_endpoint', '')
-        if not api_key or not custom_endpoint:
-            return jsonify({'message': 'Custom API settings not configured. Please set API key and endpoint in your profile settings.'}), 500
-    else:
-        return jsonify({'message': 'Invalid AI provider selected.'}), 500
-    
     # Analyze user's task patterns
     total_tasks = len(recent_todos)
     completed_tasks = len([t for t in recent_todos if t['completed']])
@@ -861,116 +2465,130 @@ def get_ai_suggestions(current_user):
         ]
     }}
     """
+    return prompt
+
+# AI Task Suggestions with Multiple Providers
+@app.route('/api/ai/suggestions', methods=['POST'])
+@token_required
+def get_ai_suggestions(current_user):
+    data = request.get_json()
+    context = data.get('context', '')
     
-    try:
-        # Make API call based on provider
-        if ai_provider == 'gemini':
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-            payload = {
-                "contents": [{
-                    "parts": [{
-                        "text": prompt
-                    }]
-                }]
-            }
-            response = requests.post(url, json=payload)
-            
-        elif ai_provider == 'openai':
-            url = "https://api.openai.com/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "model": "gpt-3.5-turbo",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 1000
-            }
-            response = requests.post(url, json=payload, headers=headers)
-            
-        elif ai_provider == 'claude':
-            url = "https://api.anthropic.com/v1/messages"
-            headers = {
-                "x-api-key": api_key,
-                "Content-Type": "application/json",
-                "anthropic-version": "2023-06-01"
-            }
-            payload = {
-                "model": "claude-3-sonnet-20240229",
-                "max_tokens": 1000,
-                "messages": [{"role": "user", "content": prompt}]
-            }
-            response = requests.post(url, json=payload, headers=headers)
-            
-        elif ai_provider == 'custom':
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "prompt": prompt,
-                "max_tokens": 1000
-            }
-            response = requests.post(custom_endpoint, json=payload, headers=headers)
-        
-        if response.status_code == 200:
-            result = response.json()
+    # Get user's recent tasks for context
+    recent_todos = get_recent_todos(current_user)
+    
+    # Get AI provider settings
+    ai_provider, api_key, custom_endpoint = get_ai_settings(current_user)
+    
+    if ai_provider not in AI_PROVIDERS:
+        return jsonify({'message': 'Invalid AI provider selected.'}), 500
+    
+    if ai_provider == 'gemini':
+        if not api_key:
+            # Smart fallback suggestions based on user's actual tasks
+            incomplete_tasks = [t for t in recent_todos if not t['completed']]
+            total_tasks = len(recent_todos)
             
-            # Extract AI response based on provider
-            if ai_provider == 'gemini':
-                ai_response = result['candidates'][0]['content']['parts'][0]['text']
-            elif ai_provider == 'openai':
-                ai_response = result['choices'][0]['message']['content']
-            elif ai_provider == 'claude':
-                ai_response = result['content'][0]['text']
-            elif ai_provider == 'custom':
-                ai_response = result.get('response', result.get('text', str(result)))
+            fallback_suggestions = [
+                {
+                    "text": "Set up your AI API key in Profile Settings for personalized suggestions",
+                    "category": "work",
+                    "priority": "medium",
+                    "reasoning": "AI can provide smarter task recommendations based on your patterns",
+                    "action_type": "optimize"
+                }
+            ]
             
-            # Try to parse JSON from AI response
-            try:
-                # Clean the response (remove markdown formatting if present)
-                clean_response = ai_response.strip()
-                if clean_response.startswith('```json'):
-                    clean_response = clean_response[7:]
-                if clean_response.endswith('```'):
-                    clean_response = clean_response[:-3]
+            if incomplete_tasks:
+                fallback_suggestions.append({
+                    "text": f"Focus on completing your {len(incomplete_tasks)} pending tasks",
+                    "category": "work",
+                    "priority": "high",
+                    "reasoning": "Completing existing tasks before adding new ones improves productivity",
+                    "action_type": "focus"
+                })
                 
-                suggestions = json.loads(clean_response)
-                return jsonify(suggestions), 200
-            except json.JSONDecodeError:
-                # Fallback: return raw response
-                return jsonify({
-                    'suggestions': [],
-                    'raw_response': ai_response,
-                    'message': 'AI response received but could not parse JSON',
-                    'provider': ai_provider
-                }), 200
-        else:
-            # Log the error response for debugging
-            error_details = {
-                'status_code': response.status_code,
-                'response_text': response.text[:500],  # First 500 chars
-                'provider': ai_provider,
-                'url': response.url if hasattr(response, 'url') else 'unknown'
-            }
-            
-            # Check for specific error types
-            if response.status_code == 404:
-                error_message = f'API endpoint not found for {ai_provider}. Please check your API key and provider settings.'
-            elif response.status_code == 401:
-                error_message = f'Invalid API key for {ai_provider}. Please check your API key in profile settings.'
-            elif response.status_code == 403:
-                error_message = f'Access forbidden for {ai_provider}. Please check your API key permissions.'
-            elif response.status_code == 429:
-                error_message = f'Rate limit exceeded for {ai_provider}. Please try again later.'
+                # Suggest specific incomplete task
+                if incomplete_tasks:
+                    fallback_suggestions.append({
+                        "text": f"Work on: {incomplete_tasks[0]['text'][:50]}{'...' if len(incomplete_tasks[0]['text']) > 50 else ''}",
+                        "category": incomplete_tasks[0]['category'],
+                        "priority": incomplete_tasks[0]['priority'],
+                        "reasoning": "This task is waiting for your attention",
+                        "action_type": "focus"
+                    })
             else:
-                error_message = f'Failed to get AI suggestions from {ai_provider}. Status: {response.status_code}'
-            
+                fallback_suggestions.append({
+                    "text": "Plan your next goals and create actionable tasks",
+                    "category": "personal",
+                    "priority": "medium",
+                    "reasoning": "Good planning leads to better productivity",
+                    "action_type": "plan"
+                })
             return jsonify({
-                'message': error_message,
-                'error_details': error_details,
-                'fallback_available': True
-            }), 500
+                'suggestions': fallback_suggestions,
+                'message': 'Gemini API key not configured. Please set it in your profile settings for AI-powered suggestions.',
+                'fallback': True,
+                'setup_required': True
+            }), 200
+    elif ai_provider == 'custom':
+        if not api_key or not custom_endpoint:
+            return jsonify({'message': 'Custom API settings not configured. Please set API key and endpoint in your profile settings.'}), 500
+    elif not api_key:
+        return jsonify({'message': f'{AI_PROVIDERS[ai_provider]["label"]} API key not configured. Please set it in your profile settings.'}), 500
+    
+    prompt = build_suggestions_prompt(recent_todos, context)
+    
+    user_id = str(current_user['_id'])
+    cache_key = ai_fingerprint(user_id, 'suggestions', ai_provider, prompt, custom_endpoint)
+    cached, cache_status = lookup_ai_cache(cache_key, data)
+    if cached is not None:
+        return ai_cache_response(cached, cache_status)
+    
+    try:
+        started = time.perf_counter()
+        ai_response = ai_flight.do(cache_key, ai_client.generate, ai_provider, api_key, prompt, custom_endpoint)
+        
+        # Try to parse JSON from AI response
+        try:
+            suggestions = parse_ai_json(ai_response)
+            ai_cache.set(cache_key, user_id, 'suggestions', suggestions, time.perf_counter() - started)
+            return ai_cache_response(suggestions, cache_status)
+        except json.JSONDecodeError:
+            # Fallback: return raw response
+            return jsonify({
+                'suggestions': [],
+                'raw_response': ai_response,
+                'message': 'AI response received but could not parse JSON',
+                'provider': ai_provider
+            }), 200
+    
+    except AIProviderError as e:
+        # Log the error response for debugging
+        error_details = {
+            'status_code': e.status_code,
+            'response_text': e.response_text,
+            'provider': ai_provider,
+            'url': e.url
+        }
+        
+        # Check for specific error types
+        if e.status_code == 404:
+            error_message = f'API endpoint not found for {ai_provider}. Please check your API key and provider settings.'
+        elif e.status_code == 401:
+            error_message = f'Invalid API key for {ai_provider}. Please check your API key in profile settings.'
+        elif e.status_code == 403:
+            error_message = f'Access forbidden for {ai_provider}. Please check your API key permissions.'
+        elif e.status_code == 429:
+            error_message = f'Rate limit exceeded for {ai_provider}. Please try again later.'
+        else:
+            error_message = f'Failed to get AI suggestions from {ai_provider}. Status: {e.status_code}'
+        
+        return jsonify({
+            'message': error_message,
+            'error_details': error_details,
+            'fallback_available': True
+        }), 500
             
     except Exception as e:
         # Log the full error for debugging
@@ -1049,16 +2667,7 @@ def get_ai_suggestions(current_user):
             'fallback': True
         }), 200
 
-# Advanced AI Task Analysis & Insights
-@app.route('/api/ai/analyze', methods=['POST'])
-@token_required
-def analyze_task_with_ai(current_user):
-    data = request.get_json()
-    task_text = data.get('task_text', '')
-    
-    if not task_text:
-        return jsonify({'message': 'Task text required'}), 400
-    
+def build_analyze_prompt(current_user, task_text):
     # Get user's complete task history for context
     all_todos = list(mongo.db.todos.find({'user_id': str(current_user['_id'])}).sort('created_at', -1))
     completed_todos = [t for t in all_todos if t.get('completed')]
@@ -1086,26 +2695,6 @@ def analyze_task_with_ai(current_user):
             category_stats[cat]['avg_time'] /= category_stats[cat]['completed']
             category_stats[cat]['completion_rate'] = (category_stats[cat]['completed'] / category_stats[cat]['total']) * 100
     
-    # Get AI provider settings
-    api_settings = current_user.get('api_settings', {})
-    ai_provider = api_settings.get('ai_provider', 'gemini')
-    
-    # Get appropriate API key based on provider
-    if ai_provider == 'gemini':
-        api_key = api_settings.get('gemini_api_key', '') or os.getenv('GEMINI_API_KEY')
-    elif ai_provider == 'openai':
-        api_key = api_settings.get('openai_api_key', '') or os.getenv('OPENAI_API_KEY')
-    elif ai_provider == 'claude':
-        api_key = api_settings.get('claude_api_key', '') or os.getenv('CLAUDE_API_KEY')
-    elif ai_provider == 'custom':
-        api_key = api_settings.get('custom_api_key', '')
-        custom_endpoint = api_settings.get('custom_api_endpoint', '')
-    else:
-        return jsonify({'message': 'Invalid AI provider selected.'}), 500
-    
-    if not api_key:
-        return jsonify({'message': f'{ai_provider.title()} API key not configured. Please set it in your profile settings.'}), 500
-    
     prompt = f"""
     You are an expert productivity consultant with deep knowledge of task management, psychology, and efficiency optimization. 
     Analyze this task with the context of the user's historical performance and provide comprehensive insights.
@@ -1179,102 +2768,87 @@ def analyze_task_with_ai(current_user):
         "user_success_prediction": "likelihood of completion based on patterns"
     }}
     """
+    return prompt
+
+# Advanced AI Task Analysis & Insights
+@app.route('/api/ai/analyze', methods=['POST'])
+@token_required
+def analyze_task_with_ai(current_user):
+    data = request.get_json()
+    task_text = data.get('task_text', '')
+    
+    if not task_text:
+        return jsonify({'message': 'Task text required'}), 400
+    
+    # Get AI provider settings
+    ai_provider, api_key, custom_endpoint = get_ai_settings(current_user)
+    
+    if ai_provider not in AI_PROVIDERS:
+        return jsonify({'message': 'Invalid AI provider selected.'}), 500
+    
+    if not api_key:
+        return jsonify({'message': f'{AI_PROVIDERS[ai_provider]["label"]} API key not configured. Please set it in your profile settings.'}), 500
+    
+    prompt = build_analyze_prompt(current_user, task_text)
+    
+    user_id = str(current_user['_id'])
+    cache_key = ai_fingerprint(user_id, 'analyze', ai_provider, prompt, custom_endpoint)
+    cached, cache_status = lookup_ai_cache(cache_key, data)
+    if cached is not None:
+        return ai_cache_response(cached, cache_status)
     
     try:
-        # Make API call based on provider
-        if ai_provider == 'gemini':
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-            payload = {
-                "contents": [{
-                    "parts": [{
-                        "text": prompt
-                    }]
-                }]
-            }
-            response = requests.post(url, json=payload)
-            
-        elif ai_provider == 'openai':
-            url = "https://api.openai.com/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "model": "gpt-3.5-turbo",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 1000
-            }
-            response = requests.post(url, json=payload, headers=headers)
-            
-        elif ai_provider == 'claude':
-            url = "https://api.anthropic.com/v1/messages"
-            headers = {
-                "x-api-key": api_key,
-                "Content-Type": "application/json",
-                "anthropic-version": "2023-06-01"
-            }
-            payload = {
-                "model": "claude-3-sonnet-20240229",
-                "max_tokens": 1000,
-                "messages": [{"role": "user", "content": prompt}]
-            }
-            response = requests.post(url, json=payload, headers=headers)
-            
-        elif ai_provider == 'custom':
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "prompt": prompt,
-                "max_tokens": 1000
-            }
-            response = requests.post(custom_endpoint, json=payload, headers=headers)
+        started = time.perf_counter()
+        ai_response = ai_flight.do(cache_key, ai_client.generate, ai_provider, api_key, prompt, custom_endpoint)
         
-        if response.status_code == 200:
-            result = response.json()
-            
-            # Extract AI response based on provider
-            if ai_provider == 'gemini':
-                ai_response = result['candidates'][0]['content']['parts'][0]['text']
-            elif ai_provider == 'openai':
-                ai_response = result['choices'][0]['message']['content']
-            elif ai_provider == 'claude':
-                ai_response = result['content'][0]['text']
-            elif ai_provider == 'custom':
-                ai_response = result.get('response', result.get('text', str(result)))
-            
-            try:
-                # Clean the response
-                clean_response = ai_response.strip()
-                if clean_response.startswith('```json'):
-                    clean_response = clean_response[7:]
-                if clean_response.endswith('```'):
-                    clean_response = clean_response[:-3]
-                
-                analysis = json.loads(clean_response)
-                return jsonify(analysis), 200
-            except json.JSONDecodeError:
-                return jsonify({
-                    'raw_response': ai_response,
-                    'message': 'AI response received but could not parse JSON',
-                    'provider': ai_provider
-                }), 200
-        else:
-            return jsonify({'message': f'Failed to analyze task with {ai_provider}. Status: {response.status_code}'}), 500
-            
+        try:
+            analysis = parse_ai_json(ai_response)
+            ai_cache.set(cache_key, user_id, 'analyze', analysis, time.perf_counter() - started)
+            return ai_cache_response(analysis, cache_status)
+        except json.JSONDecodeError:
+            return jsonify({
+                'raw_response': ai_response,
+                'message': 'AI response received but could not parse JSON',
+                'provider': ai_provider
+            }), 200
+    
+    except AIProviderError as e:
+        return jsonify({'message': f'Failed to analyze task with {ai_provider}. Status: {e.status_code}'}), 500
     except Exception as e:
         return jsonify({'message': f'AI service error: {str(e)}', 'provider': ai_provider}), 500
 
-# AI-Powered Daily Planning
-@app.route('/api/ai/plan-day', methods=['POST'])
+@app.route('/api/ai/analyze/stream', methods=['POST'])
 @token_required
-def ai_plan_day(current_user):
+def analyze_task_stream(current_user):
     data = request.get_json()
-    available_hours = data.get('available_hours', 8)
-    energy_level = data.get('energy_level', 'medium')  # low, medium, high
-    focus_areas = data.get('focus_areas', [])  # work, personal, health, etc.
+    task_text = data.get('task_text', '')
+    
+    if not task_text:
+        return jsonify({'message': 'Task text required'}), 400
+    
+    ai_provider, api_key, custom_endpoint = get_ai_settings(current_user)
     
+    if ai_provider not in AI_PROVIDERS:
+        return jsonify({'message': 'Invalid AI provider selected.'}), 500
+    
+    if not api_key:
+        return jsonify({'message': f'{AI_PROVIDERS[ai_provider]["label"]} API key not configured. Please set it in your profile settings.'}), 500
+    
+    prompt = build_analyze_prompt(current_user, task_text)
+    
+    # Shares cache entries with the non-streaming route
+    user_id = str(current_user['_id'])
+    cache_key = ai_fingerprint(user_id, 'analyze', ai_provider, prompt, custom_endpoint)
+    cached, cache_status = lookup_ai_cache(cache_key, data)
+    
+    def on_result(analysis, latency):
+        ai_cache.set(cache_key, user_id, 'analyze', analysis, latency)
+    
+    response = stream_ai_reply(ai_provider, api_key, prompt, custom_endpoint, on_result, cached)
+    response.headers['X-AI-Cache'] = cache_status
+    return response
+
+def build_plan_day_prompt(current_user, available_hours, energy_level, focus_areas):
     # Get user's tasks and patterns
     all_todos = list(mongo.db.todos.find({'user_id': str(current_user['_id'])}).sort('created_at', -1))
     incomplete_todos = [t for t in all_todos if not t.get('completed')]
@@ -1289,13 +2863,6 @@ def ai_plan_day(current_user):
             hour = activity['created_at'].hour
             productivity_hours[hour] = productivity_hours.get(hour, 0) + 1
     
-    api_settings = current_user.get('api_settings', {})
-    ai_provider = api_settings.get('ai_provider', 'gemini')
-    api_key = api_settings.get('gemini_api_key', '') or os.getenv('GEMINI_API_KEY')
-    
-    if not api_key:
-        return jsonify({'message': 'AI API key required for daily planning'}), 400
-    
     prompt = f"""
     You are an expert productivity coach and time management consultant. Create an optimal daily plan for this user.
     
@@ -1364,56 +2931,78 @@ def ai_plan_day(current_user):
         "wellness_score": number_0_to_100
     }}
     """
+    return prompt
+
+# AI-Powered Daily Planning
+@app.route('/api/ai/plan-day', methods=['POST'])
+@token_required
+def ai_plan_day(current_user):
+    data = request.get_json()
+    available_hours = data.get('available_hours', 8)
+    energy_level = data.get('energy_level', 'medium')  # low, medium, high
+    focus_areas = data.get('focus_areas', [])  # work, personal, health, etc.
+    
+    ai_provider, api_key, custom_endpoint = get_ai_settings(current_user)
+    
+    if not api_key:
+        return jsonify({'message': 'AI API key required for daily planning'}), 400
+    
+    prompt = build_plan_day_prompt(current_user, available_hours, energy_level, focus_areas)
     
+    flight_key = ai_fingerprint(str(current_user['_id']), request.endpoint, ai_provider, prompt, custom_endpoint)
     try:
-        if ai_provider == 'gemini':
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-            payload = {
-                "contents": [{
-                    "parts": [{
-                        "text": prompt
-                    }]
-                }]
-            }
-            response = requests.post(url, json=payload)
+        ai_response = ai_flight.do(flight_key, ai_client.generate, ai_provider, api_key, prompt, custom_endpoint)
+        
+        try:
+            plan = parse_ai_json(ai_response)
             
-            if response.status_code == 200:
-                result = response.json()
-                ai_response = result['candidates'][0]['content']['parts'][0]['text']
-                
-                try:
-                    clean_response = ai_response.strip()
-                    if clean_response.startswith('```json'):
-                        clean_response = clean_response[7:]
-                    if clean_response.endswith('```'):
-                        clean_response = clean_response[:-3]
-                    
-                    plan = json.loads(clean_response)
-                    
-                    # Log the planning activity
-                    mongo.db.activities.insert_one({
-                        'user_id': str(current_user['_id']),
-                        'type': 'ai_daily_plan',
-                        'description': f'Generated AI daily plan for {available_hours} hours',
-                        'created_at': datetime.utcnow()
-                    })
-                    
-                    return jsonify(plan), 200
-                except json.JSONDecodeError:
-                    return jsonify({
-                        'raw_response': ai_response,
-                        'message': 'AI response received but could not parse JSON'
-                    }), 200
-            else:
-                return jsonify({'message': f'Failed to generate daily plan. Status: {response.status_code}'}), 500
-                
+            # Log the planning activity
+            activity_logger.log({
+                'user_id': str(current_user['_id']),
+                'type': 'ai_daily_plan',
+                'description': f'Generated AI daily plan for {available_hours} hours',
+                'created_at': datetime.utcnow()
+            })
+            
+            return jsonify(plan), 200
+        except json.JSONDecodeError:
+            return jsonify({
+                'raw_response': ai_response,
+                'message': 'AI response received but could not parse JSON'
+            }), 200
+    
+    except AIProviderError as e:
+        return jsonify({'message': f'Failed to generate daily plan. Status: {e.status_code}'}), 500
     except Exception as e:
         return jsonify({'message': f'AI service error: {str(e)}'}), 500
 
-# AI Task Optimization & Workflow Analysis
-@app.route('/api/ai/optimize-workflow', methods=['POST'])
+@app.route('/api/ai/plan-day/stream', methods=['POST'])
 @token_required
-def ai_optimize_workflow(current_user):
+def ai_plan_day_stream(current_user):
+    data = request.get_json()
+    available_hours = data.get('available_hours', 8)
+    energy_level = data.get('energy_level', 'medium')
+    focus_areas = data.get('focus_areas', [])
+    
+    ai_provider, api_key, custom_endpoint = get_ai_settings(current_user)
+    
+    if not api_key:
+        return jsonify({'message': 'AI API key required for daily planning'}), 400
+    
+    prompt = build_plan_day_prompt(current_user, available_hours, energy_level, focus_areas)
+    user_id = str(current_user['_id'])
+    
+    def on_result(plan, latency):
+        activity_logger.log({
+            'user_id': user_id,
+            'type': 'ai_daily_plan',
+            'description': f'Generated AI daily plan for {available_hours} hours',
+            'created_at': datetime.utcnow()
+        })
+    
+    return stream_ai_reply(ai_provider, api_key, prompt, custom_endpoint, on_result)
+
+def build_optimize_workflow_prompt(current_user):
     # Get comprehensive user data
     all_todos = list(mongo.db.todos.find({'user_id': str(current_user['_id'])}).sort('created_at', -1))
     activities = list(mongo.db.activities.find({'user_id': str(current_user['_id'])}).sort('created_at', -1).limit(100))
@@ -1442,12 +3031,6 @@ def ai_optimize_workflow(current_user):
         if category_efficiency[cat]['count'] > 0:
             category_efficiency[cat]['avg_time'] = category_efficiency[cat]['total_time'] / category_efficiency[cat]['count']
     
-    api_settings = current_user.get('api_settings', {})
-    api_key = api_settings.get('gemini_api_key', '') or os.getenv('GEMINI_API_KEY')
-    
-    if not api_key:
-        return jsonify({'message': 'AI API key required for workflow optimization'}), 400
-    
     prompt = f"""
     You are a world-class productivity expert and workflow optimization specialist. Analyze this user's complete task management patterns and provide comprehensive optimization recommendations.
     
@@ -1548,60 +3131,47 @@ def ai_optimize_workflow(current_user):
         "success_probability": number_0_to_100
     }}
     """
+    return prompt
+
+# AI Task Optimization & Workflow Analysis
+@app.route('/api/ai/optimize-workflow', methods=['POST'])
+@token_required
+def ai_optimize_workflow(current_user):
+    ai_provider, api_key, custom_endpoint = get_ai_settings(current_user)
+    
+    if not api_key:
+        return jsonify({'message': 'AI API key required for workflow optimization'}), 400
+    
+    prompt = build_optimize_workflow_prompt(current_user)
     
+    flight_key = ai_fingerprint(str(current_user['_id']), request.endpoint, ai_provider, prompt, custom_endpoint)
     try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-        payload = {
-            "contents": [{
-                "parts": [{
-                    "text": prompt
-                }]
-            }]
-        }
-        response = requests.post(url, json=payload)
+        ai_response = ai_flight.do(flight_key, ai_client.generate, ai_provider, api_key, prompt, custom_endpoint)
         
-        if response.status_code == 200:
-            result = response.json()
-            ai_response = result['candidates'][0]['content']['parts'][0]['text']
+        try:
+            optimization = parse_ai_json(ai_response)
             
-            try:
-                clean_response = ai_response.strip()
-                if clean_response.startswith('```json'):
-                    clean_response = clean_response[7:]
-                if clean_response.endswith('```'):
-                    clean_response = clean_response[:-3]
-                
-                optimization = json.loads(clean_response)
-                
-                # Log the optimization activity
-                mongo.db.activities.insert_one({
-                    'user_id': str(current_user['_id']),
-                    'type': 'ai_workflow_optimization',
-                    'description': 'Generated comprehensive workflow optimization analysis',
-                    'created_at': datetime.utcnow()
-                })
-                
-                return jsonify(optimization), 200
-            except json.JSONDecodeError:
-                return jsonify({
-                    'raw_response': ai_response,
-                    'message': 'AI response received but could not parse JSON'
-                }), 200
-        else:
-            return jsonify({'message': f'Failed to generate optimization. Status: {response.status_code}'}), 500
+            # Log the optimization activity
+            activity_logger.log({
+                'user_id': str(current_user['_id']),
+                'type': 'ai_workflow_optimization',
+                'description': 'Generated comprehensive workflow optimization analysis',
+                'created_at': datetime.utcnow()
+            })
             
+            return jsonify(optimization), 200
+        except json.JSONDecodeError:
+            return jsonify({
+                'raw_response': ai_response,
+                'message': 'AI response received but could not parse JSON'
+            }), 200
+    
+    except AIProviderError as e:
+        return jsonify({'message': f'Failed to generate optimization. Status: {e.status_code}'}), 500
     except Exception as e:
         return jsonify({'message': f'AI service error: {str(e)}'}), 500
 
-# AI Context-Aware Smart Suggestions
-@app.route('/api/ai/smart-suggestions', methods=['POST'])
-@token_required
-def ai_smart_suggestions(current_user):
-    data = request.get_json()
-    context_type = data.get('context_type', 'general')  # general, morning, afternoon, evening, weekend
-    current_mood = data.get('mood', 'neutral')  # energetic, tired, stressed, focused, creative
-    available_time = data.get('available_time', 30)  # minutes
-    
+def get_smart_suggestion_context(current_user):
     # Get comprehensive user context
     all_todos = list(mongo.db.todos.find({'user_id': str(current_user['_id'])}).sort('created_at', -1))
     recent_activities = list(mongo.db.activities.find({'user_id': str(current_user['_id'])}).sort('created_at', -1).limit(20))
@@ -1615,8 +3185,100 @@ def ai_smart_suggestions(current_user):
     recent_completions = [a for a in recent_activities if a.get('type') == 'task_completed']
     recent_categories = [a.get('description', '').split(':')[-1].strip() for a in recent_completions[:5]]
     
-    api_settings = current_user.get('api_settings', {})
-    api_key = api_settings.get('gemini_api_key', '') or os.getenv('GEMINI_API_KEY')
+    return incomplete_todos, high_priority_todos, recent_categories
+
+def build_smart_suggestions_prompt(context_type, current_mood, available_time, incomplete_todos, high_priority_todos, recent_categories):
+    prompt = f"""
+    You are an advanced AI productivity assistant with deep understanding of human psychology, circadian rhythms, and optimal performance patterns. 
+    Provide highly contextual and personalized suggestions based on the user's current situation.
+    
+    CURRENT CONTEXT:
+    - Time context: {context_type}
+    - User's mood/energy: {current_mood}
+    - Available time: {available_time} minutes
+    - Incomplete tasks: {len(incomplete_todos)}
+    - High priority tasks: {len(high_priority_todos)}
+    - Recent activity pattern: {recent_categories}
+    
+    USER'S TASK LANDSCAPE:
+    High Priority Tasks: {json.dumps([t['text'][:50] for t in high_priority_todos[:3]])}
+    Recent Categories Worked On: {recent_categories}
+    
+    PROVIDE CONTEXT-AWARE SUGGESTIONS:
+    
+    Consider these factors:
+    1. CIRCADIAN OPTIMIZATION:
+       - Morning: Complex cognitive tasks, planning, creative work
+       - Afternoon: Collaborative work, meetings, routine tasks
+       - Evening: Reflection, planning, light administrative work
+    
+    2. MOOD-ENERGY MATCHING:
+       - Energetic: Challenging tasks, new projects, problem-solving
+       - Tired: Routine tasks, organization, easy completions
+       - Stressed: Calming activities, small wins, organization
+       - Focused: Deep work, complex analysis, important projects
+       - Creative: Brainstorming, design, innovative thinking
+    
+    3. TIME OPTIMIZATION:
+       - Short time (5-15 min): Quick wins, organization, planning
+       - Medium time (15-45 min): Focused work sessions, specific tasks
+       - Long time (45+ min): Deep work, complex projects, learning
+    
+    4. PSYCHOLOGICAL FACTORS:
+       - Build momentum with quick wins
+       - Match task difficulty to current capacity
+       - Consider context switching costs
+       - Optimize for flow state potential
+    
+    Return response in JSON format:
+    {{
+        "suggestions": [
+            {{
+                "text": "specific contextual suggestion",
+                "category": "work|personal|shopping|health",
+                "priority": "low|medium|high",
+                "reasoning": "why this is perfect for current context",
+                "action_type": "focus|organize|plan|review|create|learn",
+                "estimated_time": minutes,
+                "energy_match": "how well this matches current energy",
+                "flow_potential": "likelihood of entering flow state",
+                "momentum_builder": "whether this builds positive momentum",
+                "context_optimization": "how this leverages current context"
+            }}
+        ],
+        "context_analysis": {{
+            "optimal_activities": ["best activities for current context"],
+            "energy_assessment": "analysis of current energy state",
+            "time_utilization": "how to best use available time",
+            "momentum_strategy": "approach to build positive momentum"
+        }},
+        "next_context_preparation": {{
+            "upcoming_context": "what context comes next",
+            "preparation_suggestions": ["how to prepare for next phase"],
+            "transition_activities": ["activities to bridge contexts"]
+        }},
+        "personalization_insights": {{
+            "pattern_recognition": ["patterns noticed in user behavior"],
+            "optimization_opportunities": ["ways to improve based on patterns"],
+            "success_predictors": ["factors that predict user success"]
+        }}
+    }}
+    """
+    return prompt
+
+# AI Context-Aware Smart Suggestions
+@app.route('/api/ai/smart-suggestions', methods=['POST'])
+@token_required
+def ai_smart_suggestions(current_user):
+    data = request.get_json()
+    context_type = data.get('context_type', 'general')  # general, morning, afternoon, evening, weekend
+    current_mood = data.get('mood', 'neutral')  # energetic, tired, stressed, focused, creative
+    available_time = data.get('available_time', 30)  # minutes
+    
+    # Get comprehensive user context
+    incomplete_todos, high_priority_todos, recent_categories = get_smart_suggestion_context(current_user)
+    
+    ai_provider, api_key, custom_endpoint = get_ai_settings(current_user)
     
     if not api_key:
         # Smart fallback based on context
@@ -1686,144 +3348,450 @@ def ai_smart_suggestions(current_user):
             'fallback': True
         }), 200
     
-    prompt = f"""
-    You are an advanced AI productivity assistant with deep understanding of human psychology, circadian rhythms, and optimal performance patterns. 
-    Provide highly contextual and personalized suggestions based on the user's current situation.
+    prompt = build_smart_suggestions_prompt(context_type, current_mood, available_time, incomplete_todos, high_priority_todos, recent_categories)
     
-    CURRENT CONTEXT:
-    - Time context: {context_type}
-    - User's mood/energy: {current_mood}
-    - Available time: {available_time} minutes
-    - Incomplete tasks: {len(incomplete_todos)}
-    - High priority tasks: {len(high_priority_todos)}
-    - Recent activity pattern: {recent_categories}
+    flight_key = ai_fingerprint(str(current_user['_id']), request.endpoint, ai_provider, prompt, custom_endpoint)
+    try:
+        ai_response = ai_flight.do(flight_key, ai_client.generate, ai_provider, api_key, prompt, custom_endpoint)
+        
+        try:
+            suggestions = parse_ai_json(ai_response)
+            
+            # Log the smart suggestion activity
+            activity_logger.log({
+                'user_id': str(current_user['_id']),
+                'type': 'ai_smart_suggestions',
+                'description': f'Generated context-aware suggestions for {context_type} context',
+                'created_at': datetime.utcnow()
+            })
+            
+            return jsonify(suggestions), 200
+        except json.JSONDecodeError:
+            return jsonify({
+                'raw_response': ai_response,
+                'message': 'AI response received but could not parse JSON'
+            }), 200
     
-    USER'S TASK LANDSCAPE:
-    High Priority Tasks: {json.dumps([t['text'][:50] for t in high_priority_todos[:3]])}
-    Recent Categories Worked On: {recent_categories}
+    except AIProviderError as e:
+        return jsonify({'message': f'Failed to generate smart suggestions. Status: {e.status_code}'}), 500
+    except Exception as e:
+        return jsonify({'message': f'AI service error: {str(e)}'}), 500
+
+# Background AI jobs - POST /api/ai/jobs queues the job in MongoDB and returns its id at once; the
+# provider call is made by `flask ai-worker` processes, which lease jobs the same way export workers do.
+# At most AI_PROVIDER_CONCURRENCY jobs per provider run at a time across all workers (a bulkhead), so a
+# slow provider can't take every worker from the others. Clients poll GET /api/ai/jobs/<id> for the
+# result; with EVENT_BACKEND=changestream the status changes also reach /api/events.
+AI_PROVIDER_CONCURRENCY = int(os.getenv('AI_PROVIDER_CONCURRENCY', 3))
+AI_MAX_PENDING_JOBS = int(os.getenv('AI_MAX_PENDING_JOBS', 50))
+AI_JOB_TTL = int(os.getenv('AI_JOB_TTL', 3600))
+# Longer than a call can take with AI_CONNECT_TIMEOUT/AI_READ_TIMEOUT and retries; a running job
+# whose lease runs out belonged to a worker that went away and is picked up again
+AI_JOB_LEASE = int(os.getenv('AI_JOB_LEASE', 300))
+# Workers check in this often; a job is only queued while at least one has checked in recently
+AI_WORKER_HEARTBEAT = 10
+
+def smart_suggestions_job_prompt(user, params):
+    return build_smart_suggestions_prompt(
+        params.get('context_type', 'general'), params.get('mood', 'neutral'), params.get('available_time', 30),
+        *get_smart_suggestion_context(user)
+    )
+
+# Per kind: prompt builder, the route name shared with the cache/single-flight keys, whether replies
+# are cached, and the activity logged on success
+AI_JOB_KINDS = {
+    'suggestions': {
+        'prompt': lambda user, params: build_suggestions_prompt(get_recent_todos(user), params.get('context', '')),
+        'route': 'suggestions',
+        'cache': True,
+        'activity': None
+    },
+    'analyze': {
+        'prompt': lambda user, params: build_analyze_prompt(user, params['task_text']),
+        'route': 'analyze',
+        'cache': True,
+        'activity': None
+    },
+    'plan-day': {
+        'prompt': lambda user, params: build_plan_day_prompt(
+            user, params.get('available_hours', 8), params.get('energy_level', 'medium'), params.get('focus_areas', [])
+        ),
+        'route': 'ai_plan_day',
+        'cache': False,
+        'activity': lambda params: ('ai_daily_plan', f"Generated AI daily plan for {params.get('available_hours', 8)} hours")
+    },
+    'optimize-workflow': {
+        'prompt': lambda user, params: build_optimize_workflow_prompt(user),
+        'route': 'ai_optimize_workflow',
+        'cache': False,
+        'activity': lambda params: ('ai_workflow_optimization', 'Generated comprehensive workflow optimization analysis')
+    },
+    'smart-suggestions': {
+        'prompt': smart_suggestions_job_prompt,
+        'route': 'ai_smart_suggestions',
+        'cache': False,
+        'activity': lambda params: ('ai_smart_suggestions', f"Generated context-aware suggestions for {params.get('context_type', 'general')} context")
+    }
+}
+
+def claim_ai_job():
+    """Lease the oldest runnable job of a provider that has fewer than AI_PROVIDER_CONCURRENCY running."""
+    now = datetime.utcnow()
+    # Providers are tried in a random order so one busy queue doesn't starve the rest
+    for provider in random.sample(list(AI_PROVIDERS), len(AI_PROVIDERS)):
+        running = {'provider': provider, 'status': 'running', 'lease_expires_at': {'$gt': now}}
+        if mongo.db.ai_jobs.count_documents(running) >= AI_PROVIDER_CONCURRENCY:
+            continue
+        
+        job = mongo.db.ai_jobs.find_one_and_update(
+            {'provider': provider, '$or': [
+                {'status': 'queued'},
+                {'status': 'running', 'lease_expires_at': {'$lte': now}}
+            ], 'expires_at': {'$gt': now}},
+            {'$set': {'status': 'running', 'started_at': now, 'lease_expires_at': now + timedelta(seconds=AI_JOB_LEASE)}},
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            continue
+        
+        # Another worker may have taken the last slot between the count and the claim; hand the job back
+        if mongo.db.ai_jobs.count_documents(running) > AI_PROVIDER_CONCURRENCY:
+            mongo.db.ai_jobs.update_one(
+                {'_id': job['_id'], 'status': 'running'},
+                {'$set': {'status': 'queued'}, '$unset': {'started_at': '', 'lease_expires_at': ''}}
+            )
+            continue
+        return job
+    return None
+
+def ai_job_stats():
+    counts = mongo.db.ai_jobs.aggregate([
+        {'$match': {'status': {'$in': ['queued', 'running']}}},
+        {'$group': {'_id': {'provider': '$provider', 'status': '$status'}, 'count': {'$sum': 1}}}
+    ])
+    stats = {'concurrency': AI_PROVIDER_CONCURRENCY, 'max_pending': AI_MAX_PENDING_JOBS, 'queued': {}, 'running': {}}
+    for row in counts:
+        stats[row['_id']['status']][row['_id']['provider']] = row['count']
+    return stats
+
+def ai_worker_alive():
+    return mongo.db.ai_workers.count_documents({'expires_at': {'$gt': datetime.utcnow()}}, limit=1) > 0
+
+def record_ai_worker_heartbeat(worker_id):
+    now = datetime.utcnow()
+    mongo.db.ai_workers.update_one(
+        {'_id': worker_id},
+        {'$set': {'seen_at': now, 'expires_at': now + timedelta(seconds=AI_WORKER_HEARTBEAT * 3)}},
+        upsert=True
+    )
+
+# Nothing is published from here: the worker is a separate process, so the memory event backend
+# would only reach its own (empty) broker; the change stream picks these writes up by itself
+def finish_ai_job(job_id, user_id, update):
+    update['finished_at'] = datetime.utcnow()
+    mongo.db.ai_jobs.update_one({'_id': job_id}, {'$set': update, '$unset': {'prompt': '', 'lease_expires_at': ''}})
+
+def run_ai_job(job):
+    job_id, user_id, params = job['_id'], job['user_id'], job['params']
+    config = AI_JOB_KINDS[job['kind']]
+    
+    # Keys are read now rather than stored with the job
+    user = mongo.db.users.find_one({'_id': ObjectId(user_id)})
+    ai_provider, api_key, custom_endpoint = get_ai_settings(user) if user else (None, None, None)
+    if ai_provider != job['provider'] or not api_key:
+        finish_ai_job(job_id, user_id, {'status': 'failed', 'error': 'AI settings changed since the job was queued, please submit it again'})
+        return
+    
+    key = ai_fingerprint(user_id, config['route'], ai_provider, job['prompt'], custom_endpoint)
+    try:
+        started = time.perf_counter()
+        ai_response = ai_flight.do(key, ai_client.generate, ai_provider, api_key, job['prompt'], custom_endpoint)
+    except AIProviderError as e:
+        finish_ai_job(job_id, user_id, {'status': 'failed', 'error': f'AI provider returned status {e.status_code}'})
+        return
+    except Exception as e:
+        print(f"AI job {job_id} failed: {str(e)}")
+        finish_ai_job(job_id, user_id, {'status': 'failed', 'error': f'AI service error: {str(e)}'})
+        return
     
-    PROVIDE CONTEXT-AWARE SUGGESTIONS:
+    try:
+        result = parse_ai_json(ai_response)
+    except json.JSONDecodeError:
+        result = {'raw_response': ai_response, 'message': 'AI response received but could not parse JSON'}
+    else:
+        if config['cache']:
+            ai_cache.set(key, user_id, config['route'], result, time.perf_counter() - started)
+        if config['activity']:
+            activity_type, description = config['activity'](params)
+            activity_logger.log({
+                'user_id': user_id,
+                'type': activity_type,
+                'description': description,
+                'created_at': datetime.utcnow()
+            })
     
-    Consider these factors:
-    1. CIRCADIAN OPTIMIZATION:
-       - Morning: Complex cognitive tasks, planning, creative work
-       - Afternoon: Collaborative work, meetings, routine tasks
-       - Evening: Reflection, planning, light administrative work
+    # Stored as a JSON string - model output may use keys MongoDB won't accept
+    finish_ai_job(job_id, user_id, {'status': 'done', 'result': json.dumps(result)})
+
+def ai_job_response(job):
+    status = job['status']
+    response = {
+        'id': str(job['_id']),
+        'kind': job['kind'],
+        'status': status,
+        'provider': job['provider'],
+        'created_at': job['created_at'],
+        'finished_at': job.get('finished_at')
+    }
+    if status == 'done':
+        response['result'] = json.loads(job['result'])
+    elif status == 'failed':
+        response['error'] = job.get('error')
+    return response
+
+@app.route('/api/ai/jobs', methods=['POST'])
+@token_required
+def create_ai_job(current_user):
+    data = request.get_json() or {}
+    kind = data.get('kind')
+    params = data.get('params') or {}
+    
+    if kind not in AI_JOB_KINDS:
+        return jsonify({'message': f'kind must be one of: {", ".join(AI_JOB_KINDS)}'}), 400
+    if not isinstance(params, dict):
+        return jsonify({'message': 'params must be an object'}), 400
+    if kind == 'analyze' and not params.get('task_text'):
+        return jsonify({'message': 'Task text required'}), 400
     
-    2. MOOD-ENERGY MATCHING:
-       - Energetic: Challenging tasks, new projects, problem-solving
-       - Tired: Routine tasks, organization, easy completions
-       - Stressed: Calming activities, small wins, organization
-       - Focused: Deep work, complex analysis, important projects
-       - Creative: Brainstorming, design, innovative thinking
+    ai_provider, api_key, custom_endpoint = get_ai_settings(current_user)
+    if ai_provider not in AI_PROVIDERS:
+        return jsonify({'message': 'Invalid AI provider selected.'}), 400
+    # `code` tells the client to use the matching /api/ai/* route instead, which has fallbacks of its own
+    if not api_key or (ai_provider == 'custom' and not custom_endpoint):
+        return jsonify({
+            'message': f'{AI_PROVIDERS[ai_provider]["label"]} API key not configured. Please set it in your profile settings.',
+            'code': 'not_configured'
+        }), 400
     
-    3. TIME OPTIMIZATION:
-       - Short time (5-15 min): Quick wins, organization, planning
-       - Medium time (15-45 min): Focused work sessions, specific tasks
-       - Long time (45+ min): Deep work, complex projects, learning
+    # The prompt is built here, from the data as it is now; only the provider call is deferred
+    config = AI_JOB_KINDS[kind]
+    user_id = str(current_user['_id'])
+    prompt = config['prompt'](current_user, params)
+    now = datetime.utcnow()
+    job = {
+        'user_id': user_id,
+        'kind': kind,
+        'params': params,
+        'provider': ai_provider,
+        'prompt': prompt,
+        'status': 'queued',
+        'created_at': now,
+        'expires_at': now + timedelta(seconds=AI_JOB_TTL)
+    }
     
-    4. PSYCHOLOGICAL FACTORS:
-       - Build momentum with quick wins
-       - Match task difficulty to current capacity
-       - Consider context switching costs
-       - Optimize for flow state potential
+    if config['cache']:
+        cached, cache_status = lookup_ai_cache(ai_fingerprint(user_id, config['route'], ai_provider, prompt, custom_endpoint), data)
+        if cached is not None:
+            job.update({'status': 'done', 'result': json.dumps(cached), 'finished_at': now})
+            mongo.db.ai_jobs.insert_one(job)
+            return jsonify(ai_job_response(job)), 202
     
-    Return response in JSON format:
-    {{
-        "suggestions": [
-            {{
-                "text": "specific contextual suggestion",
-                "category": "work|personal|shopping|health",
-                "priority": "low|medium|high",
-                "reasoning": "why this is perfect for current context",
-                "action_type": "focus|organize|plan|review|create|learn",
-                "estimated_time": minutes,
-                "energy_match": "how well this matches current energy",
-                "flow_potential": "likelihood of entering flow state",
-                "momentum_builder": "whether this builds positive momentum",
-                "context_optimization": "how this leverages current context"
-            }}
-        ],
-        "context_analysis": {{
-            "optimal_activities": ["best activities for current context"],
-            "energy_assessment": "analysis of current energy state",
-            "time_utilization": "how to best use available time",
-            "momentum_strategy": "approach to build positive momentum"
-        }},
-        "next_context_preparation": {{
-            "upcoming_context": "what context comes next",
-            "preparation_suggestions": ["how to prepare for next phase"],
-            "transition_activities": ["activities to bridge contexts"]
-        }},
-        "personalization_insights": {{
-            "pattern_recognition": ["patterns noticed in user behavior"],
-            "optimization_opportunities": ["ways to improve based on patterns"],
-            "success_predictors": ["factors that predict user success"]
-        }}
-    }}
-    """
+    # Without a worker (e.g. on Vercel) a queued job would never run
+    if not ai_worker_alive():
+        return jsonify({'message': 'No AI worker is running', 'code': 'no_worker'}), 503
+    
+    if mongo.db.ai_jobs.count_documents({'provider': ai_provider, 'status': 'queued'}) >= AI_MAX_PENDING_JOBS:
+        response = jsonify({'message': f'Too many {AI_PROVIDERS[ai_provider]["label"]} requests queued, please try again shortly'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
     
+    mongo.db.ai_jobs.insert_one(job)
+    return jsonify(ai_job_response(job)), 202
+
+@app.route('/api/ai/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_ai_job(current_user, job_id):
     try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-        payload = {
-            "contents": [{
-                "parts": [{
-                    "text": prompt
-                }]
-            }]
-        }
-        response = requests.post(url, json=payload)
-        
-        if response.status_code == 200:
-            result = response.json()
-            ai_response = result['candidates'][0]['content']['parts'][0]['text']
+        job = mongo.db.ai_jobs.find_one({'_id': ObjectId(job_id), 'user_id': str(current_user['_id'])})
+    except InvalidId:
+        job = None
+    if not job:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(ai_job_response(job)), 200
+
+@app.cli.command('ai-worker')
+@click.option('--threads', default=AI_PROVIDER_CONCURRENCY, help='Jobs this process runs at once')
+@click.option('--poll-interval', default=1.0, help='Seconds to wait when no job can be claimed')
+def ai_worker_command(threads, poll_interval):
+    """Run queued AI jobs until stopped. The per-provider limit holds across every worker process."""
+    def work():
+        while True:
+            job = claim_ai_job()
+            if not job:
+                time.sleep(poll_interval)
+                continue
             
             try:
-                clean_response = ai_response.strip()
-                if clean_response.startswith('```json'):
-                    clean_response = clean_response[7:]
-                if clean_response.endswith('```'):
-                    clean_response = clean_response[:-3]
-                
-                suggestions = json.loads(clean_response)
-                
-                # Log the smart suggestion activity
-                mongo.db.activities.insert_one({
-                    'user_id': str(current_user['_id']),
-                    'type': 'ai_smart_suggestions',
-                    'description': f'Generated context-aware suggestions for {context_type} context',
-                    'created_at': datetime.utcnow()
-                })
-                
-                return jsonify(suggestions), 200
-            except json.JSONDecodeError:
-                return jsonify({
-                    'raw_response': ai_response,
-                    'message': 'AI response received but could not parse JSON'
-                }), 200
-        else:
-            return jsonify({'message': f'Failed to generate smart suggestions. Status: {response.status_code}'}), 500
-            
-    except Exception as e:
-        return jsonify({'message': f'AI service error: {str(e)}'}), 500
+                run_ai_job(job)
+                print(f"AI job {job['_id']} ({job['kind']}) {job['provider']} done")
+            except Exception as e:
+                print(f"AI job {job['_id']} failed: {str(e)}")
+                finish_ai_job(job['_id'], job['user_id'], {'status': 'failed', 'error': f'AI service error: {str(e)}'})
+    
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    record_ai_worker_heartbeat(worker_id)
+    workers = [threading.Thread(target=work, name=f'ai-worker-{n}', daemon=True) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(AI_WORKER_HEARTBEAT)
+            try:
+                record_ai_worker_heartbeat(worker_id)
+            except PyMongoError as e:
+                print(f"AI worker heartbeat failed: {str(e)}")
+    finally:
+        mongo.db.ai_workers.delete_one({'_id': worker_id})
 
 # Ticket Routes
 @app.route('/api/tickets', methods=['GET'])
 @token_required
+@versioned_etag('tickets')
 def get_tickets(current_user):
-    tickets = list(mongo.db.tickets.find({'user_id': str(current_user['_id'])}).sort('created_at', -1))
-    for ticket in tickets:
-        ticket['_id'] = str(ticket['_id'])
-        ticket['created_at'] = ticket['created_at'].isoformat()
-        if ticket.get('updated_at'):
-            ticket['updated_at'] = ticket['updated_at'].isoformat()
+    query = {'user_id': str(current_user['_id'])}
+    
+    # Exact-match filters are served by the (user_id, field, created_at) indexes
+    for field in ['client_name', 'status', 'priority']:
+        if request.args.get(field):
+            query[field] = request.args.get(field)
+    
+    try:
+        date_filter = parse_date_range(request.args.get('start_date'), request.args.get('end_date'))
+    except ValueError:
+        return jsonify({'message': 'Invalid start_date or end_date'}), 400
+    if date_filter:
+        query['created_at'] = date_filter
+    
+    # Served by the tickets text index, scoped by its user_id prefix. Searched as one phrase, so every
+    # word must appear, in order; matching is by whole words, so a fragment like "inv" finds nothing
+    search = request.args.get('search', '').replace('"', ' ').strip()
+    if search:
+        query['$text'] = {'$search': f'"{search}"'}
+    
+    try:
+        projection = get_projection(TICKET_FIELDS, TICKET_VIEWS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    if not wants_pagination():
+        tickets = list(mongo.db.tickets.find(query, projection).sort('created_at', -1))
+    else:
+        try:
+            tickets, next_cursor = paginate(mongo.db.tickets, query, projection)
+        except (ValueError, KeyError, TypeError, InvalidId):
+            return jsonify({'message': 'Invalid limit or cursor'}), 400
+    
+    if wants_pagination():
+        response = {'tickets': tickets, 'next_cursor': next_cursor}
+        if request.args.get('include_total', '').lower() == 'true':
+            response['total'] = mongo.db.tickets.count_documents(query)
+        return jsonify(response), 200
+    
     return jsonify(tickets), 200
 
 # Get unique clients for filter
+# Client directory - one document per (user, client_name) with a ticket count, kept in step by
+# every ticket write so client lookups never scan tickets
+MAX_CLIENT_SUGGESTIONS = 50
+
+def update_clients(user_id, changes, when=None):
+    """Apply {client_name: ticket count delta}; a delta of 0 only refreshes last_activity_at.
+    Only a positive delta creates an entry, so clients missing from the directory stay missing."""
+    when = when or datetime.utcnow()
+    writes = [
+        UpdateOne(
+            {'user_id': user_id, 'name': name},
+            {
+                '$inc': {'ticket_count': delta},
+                '$max': {'last_activity_at': when},
+                '$setOnInsert': {'name_key': name.lower()}
+            },
+            upsert=delta > 0
+        )
+        for name, delta in changes.items() if isinstance(name, str) and name
+    ]
+    if not writes:
+        return
+    mongo.db.clients.bulk_write(writes, ordered=False)
+    if any(delta < 0 for delta in changes.values()):
+        mongo.db.clients.delete_many({'user_id': user_id, 'ticket_count': {'$lte': 0}})
+
+def rebuild_clients(user_id=None):
+    match = {'client_name': {'$nin': [None, '']}}
+    if user_id:
+        match['user_id'] = user_id
+    
+    mongo.db.clients.delete_many({'user_id': user_id} if user_id else {})
+    clients = []
+    count = 0
+    for group in mongo.db.tickets.aggregate([
+        {'$match': match},
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'name': '$client_name'},
+            'ticket_count': {'$sum': 1},
+            'last_activity_at': {'$max': {'$ifNull': ['$updated_at', '$created_at']}}
+        }}
+    ]):
+        name = group['_id']['name']
+        if not isinstance(name, str):
+            continue
+        clients.append({
+            'user_id': group['_id']['user_id'],
+            'name': name,
+            'name_key': name.lower(),
+            'ticket_count': group['ticket_count'],
+            'last_activity_at': group['last_activity_at']
+        })
+        if len(clients) >= IMPORT_BATCH_SIZE:
+            mongo.db.clients.insert_many(clients, ordered=False)
+            count += len(clients)
+            clients = []
+    if clients:
+        mongo.db.clients.insert_many(clients, ordered=False)
+        count += len(clients)
+    return count
+
+@app.cli.command('backfill-clients')
+@click.option('--user-id', default=None, help='Only rebuild the directory for this user')
+def backfill_clients_command(user_id):
+    """Rebuild the client directory from existing tickets."""
+    print(f"Rebuilt {rebuild_clients(user_id)} client entries")
+
 @app.route('/api/tickets/clients', methods=['GET'])
 @token_required
+@versioned_etag('tickets')
 def get_ticket_clients(current_user):
-    clients = mongo.db.tickets.distinct('client_name', {'user_id': str(current_user['_id'])})
+    clients = mongo.db.clients.find({'user_id': str(current_user['_id'])}, {'name': 1, '_id': 0}).sort('name', 1)
+    return jsonify([client['name'] for client in clients]), 200
+
+@app.route('/api/tickets/clients/search', methods=['GET'])
+@token_required
+def search_clients(current_user):
+    prefix = request.args.get('prefix', '').strip().lower()
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), MAX_CLIENT_SUGGESTIONS))
+    except ValueError:
+        return jsonify({'message': 'Invalid limit'}), 400
+    
+    query = {'user_id': str(current_user['_id'])}
+    if prefix:
+        # An anchored, case-sensitive regex on the lowercased key is an index range scan
+        query['name_key'] = {'$regex': '^' + re.escape(prefix)}
+    
+    clients = list(mongo.db.clients.find(
+        query, {'_id': 0, 'name': 1, 'ticket_count': 1, 'last_activity_at': 1}
+    ).sort('name_key', 1).limit(limit))
     return jsonify(clients), 200
 
 @app.route('/api/tickets', methods=['POST'])
@@ -1848,25 +3816,191 @@ def create_ticket(current_user):
         'created_at': datetime.utcnow(),
         'updated_at': datetime.utcnow()
     }
-    result = mongo.db.tickets.insert_one(ticket)
-    ticket['_id'] = str(result.inserted_id)
-    ticket['created_at'] = ticket['created_at'].isoformat()
-    ticket['updated_at'] = ticket['updated_at'].isoformat()
+    mongo.db.tickets.insert_one(ticket)
+    bump_data_version(str(current_user['_id']), 'tickets')
+    update_clients(str(current_user['_id']), {ticket['client_name']: 1}, ticket['created_at'])
+    publish_change(str(current_user['_id']), 'ticket', ticket['_id'], 'create', ticket)
     return jsonify(ticket), 201
 
+# Bulk ticket import from CSV/XLSX, streamed row by row and inserted in fixed-size batches
+IMPORT_BATCH_SIZE = 500
+MAX_IMPORT_ERRORS = 1000
+TICKET_STATUSES = ['open', 'in-progress', 'resolved', 'closed']
+TICKET_PRIORITIES = ['low', 'medium', 'high']
+IMPORT_COLUMNS = ['ticket_id', 'client_name', 'subject', 'description', 'status', 'priority']
+REQUIRED_IMPORT_COLUMNS = ['ticket_id', 'client_name', 'subject']
+
+class ImportHeaderError(Exception):
+    """The file's header row lacks columns every row needs."""
+    def __init__(self, missing):
+        super().__init__(f"Missing required columns: {', '.join(missing)}")
+        self.missing = missing
+
+def import_header(names):
+    """Normalise the header row; raises before any row is read if a required column is absent."""
+    header = [import_cell(name).lower().replace(' ', '_') for name in names or []]
+    missing = [column for column in REQUIRED_IMPORT_COLUMNS if column not in header]
+    if missing:
+        raise ImportHeaderError(missing)
+    return header
+
+def import_cell(value):
+    if value is None:
+        return ''
+    # Spreadsheet ids like 1042 come back as 1042.0
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def iter_csv_rows(stream):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = import_header(next(reader, None))
+    for row_number, row in enumerate(reader, start=2):
+        yield row_number, dict(zip(header, (import_cell(value) for value in row)))
+
+def iter_xlsx_rows(stream):
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = import_header(next(rows, None))
+        for row_number, row in enumerate(rows, start=2):
+            if all(value is None for value in row):
+                continue
+            yield row_number, dict(zip(header, (import_cell(value) for value in row)))
+    finally:
+        wb.close()
+
+def validate_import_row(row):
+    # The ticket list and exports show ticket_id as a string, so a row can't leave it blank
+    if not row.get('ticket_id'):
+        return 'ticket_id is required'
+    if not row.get('subject'):
+        return 'subject is required'
+    if not row.get('client_name'):
+        return 'client_name is required'
+    if row.get('status') and row['status'] not in TICKET_STATUSES:
+        return f"status must be one of {', '.join(TICKET_STATUSES)}"
+    if row.get('priority') and row['priority'] not in TICKET_PRIORITIES:
+        return f"priority must be one of {', '.join(TICKET_PRIORITIES)}"
+    return None
+
+@app.route('/api/tickets/import', methods=['POST'])
+@token_required
+def import_tickets(current_user):
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'message': 'No file uploaded'}), 400
+    
+    filename = upload.filename.lower()
+    if filename.endswith('.csv'):
+        rows = iter_csv_rows(upload.stream)
+    elif filename.endswith('.xlsx'):
+        rows = iter_xlsx_rows(upload.stream)
+    else:
+        return jsonify({'message': 'Only .csv and .xlsx files are supported'}), 400
+    
+    user_id = str(current_user['_id'])
+    summary = {'imported': 0, 'skipped': 0, 'error_count': 0}
+    errors = []
+    
+    def add_error(row_number, message):
+        summary['skipped'] += 1
+        summary['error_count'] += 1
+        if len(errors) < MAX_IMPORT_ERRORS:
+            errors.append({'row': row_number, 'message': message})
+    
+    def flush(batch):
+        # Duplicates within the batch are caught here, against earlier batches and
+        # existing tickets by the $in lookup, so no id set is kept for the whole file
+        seen = set()
+        unique = []
+        for row_number, row in batch:
+            ticket_id = row['ticket_id']
+            if ticket_id in seen:
+                add_error(row_number, f'Duplicate ticket_id {ticket_id} in file')
+                continue
+            seen.add(ticket_id)
+            unique.append((row_number, row))
+        
+        existing = {ticket['ticket_id'] for ticket in mongo.db.tickets.find(
+            {'user_id': user_id, 'ticket_id': {'$in': list(seen)}},
+            {'ticket_id': 1, '_id': 0}
+        )}
+        
+        now = datetime.utcnow()
+        tickets = []
+        for row_number, row in unique:
+            if row['ticket_id'] in existing:
+                add_error(row_number, f"Ticket ID {row['ticket_id']} already exists")
+                continue
+            tickets.append({
+                'ticket_id': row['ticket_id'],
+                'client_name': row['client_name'],
+                'subject': row['subject'],
+                'description': row.get('description', ''),
+                'status': row.get('status') or 'open',
+                'priority': row.get('priority') or 'medium',
+                'user_id': user_id,
+                'created_at': now,
+                'updated_at': now
+            })
+        
+        if tickets:
+            mongo.db.tickets.insert_many(tickets, ordered=False)
+            bump_data_version(user_id, 'tickets')
+            client_counts = {}
+            for ticket in tickets:
+                client_counts[ticket['client_name']] = client_counts.get(ticket['client_name'], 0) + 1
+            update_clients(user_id, client_counts, now)
+            summary['imported'] += len(tickets)
+    
+    batch = []
+    try:
+        for row_number, row in rows:
+            error = validate_import_row(row)
+            if error:
+                add_error(row_number, error)
+                continue
+            batch.append((row_number, {field: row.get(field, '') for field in IMPORT_COLUMNS}))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    except ImportHeaderError as e:
+        # The header is read before the first row, so nothing has been imported
+        return jsonify({'message': str(e), 'missing_columns': e.missing}), 400
+    except (UnicodeDecodeError, csv.Error, InvalidFileException, zipfile.BadZipFile) as e:
+        return jsonify({
+            'message': f'Could not read file: {str(e)}',
+            **summary,
+            'errors': errors
+        }), 400
+    
+    if summary['imported'] and EVENT_BACKEND == 'memory':
+        # Too many rows to push one by one; have open tabs refetch tickets instead
+        event_broker.publish(user_id, {'type': 'ticket', 'op': 'resync'})
+    
+    return jsonify({
+        'message': f"Imported {summary['imported']} tickets",
+        **summary,
+        'errors': sorted(errors, key=lambda error: error['row']),
+        'errors_truncated': summary['error_count'] > len(errors)
+    }), 200
+
 @app.route('/api/tickets/<ticket_id>', methods=['GET'])
 @token_required
 def get_ticket(current_user, ticket_id):
+    try:
+        projection = get_projection(TICKET_FIELDS, TICKET_VIEWS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     ticket = mongo.db.tickets.find_one({
         '_id': ObjectId(ticket_id),
         'user_id': str(current_user['_id'])
-    })
+    }, projection)
     if not ticket:
         return jsonify({'message': 'Ticket not found'}), 404
-    ticket['_id'] = str(ticket['_id'])
-    ticket['created_at'] = ticket['created_at'].isoformat()
-    if ticket.get('updated_at'):
-        ticket['updated_at'] = ticket['updated_at'].isoformat()
     return jsonify(ticket), 200
 
 @app.route('/api/tickets/<ticket_id>', methods=['PUT'])
@@ -1891,6 +4025,12 @@ def update_ticket(current_user, ticket_id):
         
         print(f"Update data: {update_data}")
         result = mongo.db.tickets.update_one({'_id': ObjectId(ticket_id)}, {'$set': update_data})
+        bump_data_version(str(current_user['_id']), 'tickets')
+        if update_data.get('client_name', ticket.get('client_name')) != ticket.get('client_name'):
+            update_clients(str(current_user['_id']), {ticket.get('client_name'): -1, update_data['client_name']: 1}, update_data['updated_at'])
+        else:
+            update_clients(str(current_user['_id']), {ticket.get('client_name'): 0}, update_data['updated_at'])
+        publish_change(str(current_user['_id']), 'ticket', ticket_id, 'update', update_data)
         print(f"Update result: {result.modified_count} documents modified")
         
         return jsonify({'message': 'Ticket updated successfully'}), 200
@@ -1901,13 +4041,17 @@ def update_ticket(current_user, ticket_id):
 @app.route('/api/tickets/<ticket_id>', methods=['DELETE'])
 @token_required
 def delete_ticket(current_user, ticket_id):
-    result = mongo.db.tickets.delete_one({
+    ticket = mongo.db.tickets.find_one_and_delete({
         '_id': ObjectId(ticket_id),
         'user_id': str(current_user['_id'])
-    })
-    if result.deleted_count == 0:
+    }, projection={'client_name': 1})
+    if not ticket:
         return jsonify({'message': 'Ticket not found'}), 404
+    update_clients(str(current_user['_id']), {ticket.get('client_name'): -1})
     mongo.db.ticket_comments.delete_many({'ticket_id': ticket_id})
+    bump_data_version(str(current_user['_id']), 'tickets')
+    record_tombstones(str(current_user['_id']), 'ticket', [ticket_id])
+    publish_change(str(current_user['_id']), 'ticket', ticket_id, 'delete')
     return jsonify({'message': 'Ticket deleted successfully'}), 200
 
 # Ticket Comments
@@ -1915,9 +4059,6 @@ def delete_ticket(current_user, ticket_id):
 @token_required
 def get_ticket_comments(current_user, ticket_id):
     comments = list(mongo.db.ticket_comments.find({'ticket_id': ticket_id}).sort('created_at', -1))
-    for comment in comments:
-        comment['_id'] = str(comment['_id'])
-        comment['created_at'] = comment['created_at'].isoformat()
     return jsonify(comments), 200
 
 @app.route('/api/tickets/<ticket_id>/comments', methods=['POST'])
@@ -1926,40 +4067,80 @@ def add_ticket_comment(current_user, ticket_id):
     data = request.get_json()
     comment = {
         'ticket_id': ticket_id,
+        'user_id': str(current_user['_id']),
         'text': data.get('text'),
         'user_email': current_user['email'],
         'created_at': datetime.utcnow()
     }
-    result = mongo.db.ticket_comments.insert_one(comment)
-    comment['_id'] = str(result.inserted_id)
-    comment['created_at'] = comment['created_at'].isoformat()
+    mongo.db.ticket_comments.insert_one(comment)
+    # Ticket exports include comments, so they count as a ticket change
+    bump_data_version(str(current_user['_id']), 'tickets')
+    publish_change(str(current_user['_id']), 'ticket_comment', comment['_id'], 'create', comment)
     return jsonify(comment), 201
 
-# Export to PDF
-@app.route('/api/export/pdf', methods=['GET'])
-@token_required
-def export_pdf(current_user):
-    # Get date range parameters
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    
-    # Build query
-    query = {'user_id': str(current_user['_id'])}
-    if start_date or end_date:
-        date_filter = {}
-        if start_date:
-            date_filter['$gte'] = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        if end_date:
-            # Add one day to include the end date
-            end_datetime = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-            end_datetime = end_datetime.replace(hour=23, minute=59, second=59)
-            date_filter['$lte'] = end_datetime
+# Export helpers
+EXPORT_BATCH_SIZE = 1000
+# Files up to this size stay in memory, larger ones roll over to disk
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def build_export_query(user_id, start_date, end_date):
+    query = {'user_id': user_id}
+    date_filter = parse_date_range(start_date, end_date)
+    if date_filter:
         query['created_at'] = date_filter
+    return query
+
+def header_cells(ws, headers):
+    cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True)
+        cells.append(cell)
+    return cells
+
+def with_ticket_comments(tickets):
+    """Yield (ticket, comments) pairs, loading comments with one $in query per batch of tickets."""
+    batch = []
+    for ticket in tickets:
+        batch.append(ticket)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield from join_ticket_comments(batch)
+            batch = []
+    if batch:
+        yield from join_ticket_comments(batch)
+
+def join_ticket_comments(tickets):
+    comments_by_ticket = {}
+    for comment in mongo.db.ticket_comments.find(
+        {'ticket_id': {'$in': [str(ticket['_id']) for ticket in tickets]}},
+        {'ticket_id': 1, 'text': 1, 'user_email': 1, 'created_at': 1}
+    ):
+        comments_by_ticket.setdefault(comment['ticket_id'], []).append(comment)
+    
+    for ticket in tickets:
+        comments = comments_by_ticket.get(str(ticket['_id']), [])
+        comments.sort(key=lambda comment: comment['created_at'])
+        yield ticket, comments
+
+def track_progress(items, progress):
+    """Pass items through, reporting the running count every EXPORT_BATCH_SIZE items."""
+    processed = 0
+    for item in items:
+        yield item
+        processed += 1
+        if progress and processed % EXPORT_BATCH_SIZE == 0:
+            progress(processed)
+    if progress:
+        progress(processed)
+
+# Export to PDF
+def render_todos_pdf(user_id, start_date, end_date, output, progress=None):
+    query = build_export_query(user_id, start_date, end_date)
     
     todos = list(mongo.db.todos.find(query))
     
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    doc = SimpleDocTemplate(output, pagesize=letter)
     elements = []
     styles = getSampleStyleSheet()
     
@@ -1973,7 +4154,7 @@ def export_pdf(current_user):
     
     # Table data
     data = [['Task', 'Category', 'Priority', 'Status', 'Created']]
-    for todo in todos:
+    for todo in track_progress(todos, progress):
         status = '✓ Done' if todo.get('completed') else 'Pending'
         created = todo['created_at'].strftime('%Y-%m-%d') if isinstance(todo['created_at'], datetime) else str(todo['created_at'])[:10]
         data.append([
@@ -2003,36 +4184,24 @@ def export_pdf(current_user):
     elements.append(table)
     
     doc.build(elements)
-    buffer.seek(0)
-    
-    return send_file(buffer, mimetype='application/pdf', as_attachment=True, download_name='todos.pdf')
 
 # Export to Excel
-@app.route('/api/export/excel', methods=['GET'])
-@token_required
-def export_excel(current_user):
-    # Get date range parameters
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
+def render_todos_excel(user_id, start_date, end_date, output, progress=None):
+    query = build_export_query(user_id, start_date, end_date)
     
-    # Build query
-    query = {'user_id': str(current_user['_id'])}
-    if start_date or end_date:
-        date_filter = {}
-        if start_date:
-            date_filter['$gte'] = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        if end_date:
-            # Add one day to include the end date
-            end_datetime = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-            end_datetime = end_datetime.replace(hour=23, minute=59, second=59)
-            date_filter['$lte'] = end_datetime
-        query['created_at'] = date_filter
+    todos = mongo.db.todos.find(
+        query, {'text': 1, 'category': 1, 'priority': 1, 'completed': 1, 'created_at': 1}
+    ).batch_size(EXPORT_BATCH_SIZE)
     
-    todos = list(mongo.db.todos.find(query))
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Todos")
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Todos"
+    # Adjust column widths
+    ws.column_dimensions['A'].width = 40
+    ws.column_dimensions['B'].width = 15
+    ws.column_dimensions['C'].width = 12
+    ws.column_dimensions['D'].width = 12
+    ws.column_dimensions['E'].width = 15
     
     # Add date range info if provided
     if start_date or end_date:
@@ -2040,15 +4209,10 @@ def export_excel(current_user):
         ws.append([])  # Empty row
     
     # Headers
-    headers = ['Task', 'Category', 'Priority', 'Status', 'Created Date']
-    ws.append(headers)
-    
-    # Style headers
-    for col in range(1, 6):
-        ws.cell(row=1, column=col).font = ws.cell(row=1, column=col).font.copy(bold=True)
+    ws.append(header_cells(ws, ['Task', 'Category', 'Priority', 'Status', 'Created Date']))
     
     # Data
-    for todo in todos:
+    for todo in track_progress(todos, progress):
         status = 'Completed' if todo.get('completed') else 'Pending'
         created = todo['created_at'].strftime('%Y-%m-%d') if isinstance(todo['created_at'], datetime) else str(todo['created_at'])[:10]
         ws.append([
@@ -2059,45 +4223,15 @@ def export_excel(current_user):
             created
         ])
     
-    # Adjust column widths
-    ws.column_dimensions['A'].width = 40
-    ws.column_dimensions['B'].width = 15
-    ws.column_dimensions['C'].width = 12
-    ws.column_dimensions['D'].width = 12
-    ws.column_dimensions['E'].width = 15
-    
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    return send_file(buffer, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 
-                     as_attachment=True, download_name='todos.xlsx')
+    wb.save(output)
 
 # Export Tickets to PDF
-@app.route('/api/export/tickets/pdf', methods=['GET'])
-@token_required
-def export_tickets_pdf(current_user):
-    # Get date range parameters
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    
-    # Build query
-    query = {'user_id': str(current_user['_id'])}
-    if start_date or end_date:
-        date_filter = {}
-        if start_date:
-            date_filter['$gte'] = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        if end_date:
-            # Add one day to include the end date
-            end_datetime = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-            end_datetime = end_datetime.replace(hour=23, minute=59, second=59)
-            date_filter['$lte'] = end_datetime
-        query['created_at'] = date_filter
+def render_tickets_pdf(user_id, start_date, end_date, output, progress=None):
+    query = build_export_query(user_id, start_date, end_date)
     
     tickets = list(mongo.db.tickets.find(query))
     
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    doc = SimpleDocTemplate(output, pagesize=letter)
     elements = []
     styles = getSampleStyleSheet()
     
@@ -2111,7 +4245,7 @@ def export_tickets_pdf(current_user):
     
     # Table data
     data = [['Ticket ID', 'Client', 'Subject', 'Status', 'Priority', 'Created']]
-    for ticket in tickets:
+    for ticket in track_progress(tickets, progress):
         created = ticket['created_at'].strftime('%Y-%m-%d') if isinstance(ticket['created_at'], datetime) else str(ticket['created_at'])[:10]
         data.append([
             ticket.get('ticket_id', '')[:15],
@@ -2145,7 +4279,7 @@ def export_tickets_pdf(current_user):
     elements.append(Paragraph("Ticket Details & Comments", styles['Heading2']))
     elements.append(Spacer(1, 15))
     
-    for ticket in tickets:
+    for ticket, comments in with_ticket_comments(tickets):
         # Ticket header
         elements.append(Paragraph(f"<b>{ticket.get('ticket_id', 'N/A')}</b> - {ticket.get('subject', 'No Subject')}", styles['Heading3']))
         elements.append(Paragraph(f"Client: {ticket.get('client_name', 'N/A')} | Status: {ticket.get('status', 'open')} | Priority: {ticket.get('priority', 'medium')}", styles['Normal']))
@@ -2153,8 +4287,6 @@ def export_tickets_pdf(current_user):
         if ticket.get('description'):
             elements.append(Paragraph(f"Description: {ticket.get('description')}", styles['Normal']))
         
-        # Get comments for this ticket
-        comments = list(mongo.db.ticket_comments.find({'ticket_id': str(ticket['_id'])}).sort('created_at', 1))
         if comments:
             elements.append(Paragraph("Comments:", styles['Heading4']))
             for comment in comments:
@@ -2164,38 +4296,30 @@ def export_tickets_pdf(current_user):
         elements.append(Spacer(1, 15))
     
     doc.build(elements)
-    buffer.seek(0)
-    
-    return send_file(buffer, mimetype='application/pdf', as_attachment=True, download_name='tickets.pdf')
 
 # Export Tickets to Excel
-@app.route('/api/export/tickets/excel', methods=['GET'])
-@token_required
-def export_tickets_excel(current_user):
-    # Get date range parameters
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    
-    # Build query
-    query = {'user_id': str(current_user['_id'])}
-    if start_date or end_date:
-        date_filter = {}
-        if start_date:
-            date_filter['$gte'] = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        if end_date:
-            # Add one day to include the end date
-            end_datetime = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-            end_datetime = end_datetime.replace(hour=23, minute=59, second=59)
-            date_filter['$lte'] = end_datetime
-        query['created_at'] = date_filter
+def render_tickets_excel(user_id, start_date, end_date, output, progress=None):
+    query = build_export_query(user_id, start_date, end_date)
     
-    tickets = list(mongo.db.tickets.find(query))
+    tickets = mongo.db.tickets.find(
+        query, {'ticket_id': 1, 'client_name': 1, 'subject': 1, 'description': 1,
+                'status': 1, 'priority': 1, 'created_at': 1}
+    ).batch_size(EXPORT_BATCH_SIZE)
     
-    wb = Workbook()
+    # Write-only sheets each stream to their own temp file, so both are filled in one pass
+    wb = Workbook(write_only=True)
     
     # Tickets sheet
-    ws = wb.active
-    ws.title = "Tickets"
+    ws = wb.create_sheet("Tickets")
+    
+    # Adjust column widths
+    ws.column_dimensions['A'].width = 15
+    ws.column_dimensions['B'].width = 20
+    ws.column_dimensions['C'].width = 30
+    ws.column_dimensions['D'].width = 40
+    ws.column_dimensions['E'].width = 12
+    ws.column_dimensions['F'].width = 12
+    ws.column_dimensions['G'].width = 15
     
     # Add date range info if provided
     if start_date or end_date:
@@ -2203,15 +4327,21 @@ def export_tickets_excel(current_user):
         ws.append([])  # Empty row
     
     # Headers
-    headers = ['Ticket ID', 'Client Name', 'Subject', 'Description', 'Status', 'Priority', 'Created Date']
-    ws.append(headers)
+    ws.append(header_cells(ws, ['Ticket ID', 'Client Name', 'Subject', 'Description', 'Status', 'Priority', 'Created Date']))
+    
+    # Comments sheet
+    ws_comments = wb.create_sheet("Comments")
+    
+    # Adjust comment sheet column widths
+    ws_comments.column_dimensions['A'].width = 15
+    ws_comments.column_dimensions['B'].width = 50
+    ws_comments.column_dimensions['C'].width = 25
+    ws_comments.column_dimensions['D'].width = 20
     
-    # Style headers
-    for col in range(1, 8):
-        ws.cell(row=1, column=col).font = ws.cell(row=1, column=col).font.copy(bold=True)
+    ws_comments.append(header_cells(ws_comments, ['Ticket ID', 'Comment', 'User', 'Date']))
     
     # Data
-    for ticket in tickets:
+    for ticket, comments in with_ticket_comments(track_progress(tickets, progress)):
         created = ticket['created_at'].strftime('%Y-%m-%d') if isinstance(ticket['created_at'], datetime) else str(ticket['created_at'])[:10]
         ws.append([
             ticket.get('ticket_id', ''),
@@ -2222,28 +4352,8 @@ def export_tickets_excel(current_user):
             ticket.get('priority', 'medium'),
             created
         ])
-    
-    # Adjust column widths
-    ws.column_dimensions['A'].width = 15
-    ws.column_dimensions['B'].width = 20
-    ws.column_dimensions['C'].width = 30
-    ws.column_dimensions['D'].width = 40
-    ws.column_dimensions['E'].width = 12
-    ws.column_dimensions['F'].width = 12
-    ws.column_dimensions['G'].width = 15
-    
-    # Comments sheet
-    ws_comments = wb.create_sheet("Comments")
-    comment_headers = ['Ticket ID', 'Comment', 'User', 'Date']
-    ws_comments.append(comment_headers)
-    
-    # Style headers
-    for col in range(1, 5):
-        ws_comments.cell(row=1, column=col).font = ws_comments.cell(row=1, column=col).font.copy(bold=True)
-    
-    # Add comments data
-    for ticket in tickets:
-        comments = list(mongo.db.ticket_comments.find({'ticket_id': str(ticket['_id'])}).sort('created_at', 1))
+        
+        # Add comments data
         for comment in comments:
             comment_date = comment['created_at'].strftime('%Y-%m-%d %H:%M') if isinstance(comment['created_at'], datetime) else str(comment['created_at'])[:16]
             ws_comments.append([
@@ -2253,18 +4363,318 @@ def export_tickets_excel(current_user):
                 comment_date
             ])
     
-    # Adjust comment sheet column widths
-    ws_comments.column_dimensions['A'].width = 15
-    ws_comments.column_dimensions['B'].width = 50
-    ws_comments.column_dimensions['C'].width = 25
-    ws_comments.column_dimensions['D'].width = 20
+    wb.save(output)
+
+EXPORT_TYPES = {
+    'pdf': {'render': render_todos_pdf, 'collection': 'todos', 'filename': 'todos.pdf', 'mimetype': 'application/pdf'},
+    'excel': {'render': render_todos_excel, 'collection': 'todos', 'filename': 'todos.xlsx', 'mimetype': XLSX_MIMETYPE},
+    'tickets_pdf': {'render': render_tickets_pdf, 'collection': 'tickets', 'filename': 'tickets.pdf', 'mimetype': 'application/pdf'},
+    'tickets_excel': {'render': render_tickets_excel, 'collection': 'tickets', 'filename': 'tickets.xlsx', 'mimetype': XLSX_MIMETYPE}
+}
+
+# Rendered exports on local disk, named by a hash of everything that determines their content.
+# Least recently used files are evicted once the directory grows past max_bytes.
+class ExportCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, user_id, export_type, start_date, end_date, data_version):
+        parts = [user_id, export_type, start_date or '', end_date or '', str(data_version)]
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+    def path(self, key, filename):
+        return os.path.join(self.directory, key + os.path.splitext(filename)[1])
+
+    def get(self, key, filename):
+        path = self.path(key, filename)
+        try:
+            # mtime doubles as the last-used time for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def store(self, key, filename, render):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key, filename)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                render(output)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        with self.lock:
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith('.tmp') and entry.path != keep:
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files) + (os.path.getsize(keep) if keep else 0)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'directory': self.directory,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups * 100, 1) if lookups else 0
+            }
+
+export_cache = ExportCache(
+    os.getenv('EXPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'todo-export-cache')),
+    int(os.getenv('EXPORT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+)
+
+def send_export(current_user, export_type):
+    # Get date range parameters
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    
+    user_id = str(current_user['_id'])
+    export = EXPORT_TYPES[export_type]
+    
+    try:
+        parse_date_range(start_date, end_date)
+    except ValueError:
+        return jsonify({'message': 'Invalid start_date or end_date'}), 400
+    
+    if export_cache.max_bytes <= 0:
+        output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        export['render'](user_id, start_date, end_date, output)
+        output.seek(0)
+        # send_file streams the file in chunks and closes it when the response is done
+        return send_file(output, mimetype=export['mimetype'], as_attachment=True, download_name=export['filename'])
+    
+    data_version = get_data_version(user_id, export['collection'])
+    key = export_cache.key(user_id, export_type, start_date, end_date, data_version)
+    path = export_cache.get(key, export['filename'])
+    if path is None:
+        path = export_cache.store(key, export['filename'],
+                                  lambda output: export['render'](user_id, start_date, end_date, output))
+    
+    return send_file(path, mimetype=export['mimetype'], as_attachment=True, download_name=export['filename'])
+
+@app.route('/api/export/pdf', methods=['GET'])
+@token_required
+def export_pdf(current_user):
+    return send_export(current_user, 'pdf')
+
+@app.route('/api/export/excel', methods=['GET'])
+@token_required
+def export_excel(current_user):
+    return send_export(current_user, 'excel')
+
+@app.route('/api/export/tickets/pdf', methods=['GET'])
+@token_required
+def export_tickets_pdf(current_user):
+    return send_export(current_user, 'tickets_pdf')
+
+@app.route('/api/export/tickets/excel', methods=['GET'])
+@token_required
+def export_tickets_excel(current_user):
+    return send_export(current_user, 'tickets_excel')
+
+# Export jobs - queued in MongoDB and rendered by `flask export-worker` processes.
+# Finished files are stored in GridFS and removed once the job expires.
+EXPORT_JOB_TTL = int(os.getenv('EXPORT_JOB_TTL', 3600))
+# A running job whose worker stops renewing this lease is picked up again
+EXPORT_JOB_LEASE = 300
+
+def export_job_response(job):
+    response = {
+        'job_id': job['_id'],
+        'type': job['type'],
+        'status': job['status'],
+        'processed': job.get('processed', 0),
+        'total': job.get('total'),
+        'progress': round(job['processed'] / job['total'] * 100) if job.get('total') else (100 if job['status'] == 'done' else 0),
+        'created_at': job['created_at'],
+        'expires_at': job['expires_at']
+    }
+    if job.get('error'):
+        response['error'] = job['error']
+    if job['status'] == 'done':
+        response['download_url'] = f"/api/export/jobs/{job['_id']}/download"
+    return response
+
+@app.route('/api/export/jobs', methods=['POST'])
+@token_required
+def create_export_job(current_user):
+    data = request.get_json() or {}
+    export_type = data.get('type')
+    
+    if export_type not in EXPORT_TYPES:
+        return jsonify({'message': f"type must be one of {', '.join(EXPORT_TYPES)}"}), 400
+    
+    try:
+        parse_date_range(data.get('start_date'), data.get('end_date'))
+    except ValueError:
+        return jsonify({'message': 'Invalid start_date or end_date'}), 400
     
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
+    now = datetime.utcnow()
+    job = {
+        'user_id': str(current_user['_id']),
+        'type': export_type,
+        'start_date': data.get('start_date'),
+        'end_date': data.get('end_date'),
+        'status': 'queued',
+        'processed': 0,
+        'total': None,
+        'file_id': None,
+        'created_at': now,
+        'expires_at': now + timedelta(seconds=EXPORT_JOB_TTL)
+    }
+    job['_id'] = mongo.db.export_jobs.insert_one(job).inserted_id
     
-    return send_file(buffer, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 
-                     as_attachment=True, download_name='tickets.xlsx')
+    return jsonify(export_job_response(job)), 202
+
+@app.route('/api/export/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_export_job(current_user, job_id):
+    try:
+        job = mongo.db.export_jobs.find_one({
+            '_id': ObjectId(job_id),
+            'user_id': str(current_user['_id']),
+            'expires_at': {'$gt': datetime.utcnow()}
+        })
+    except InvalidId:
+        job = None
+    if not job:
+        return jsonify({'message': 'Export job not found'}), 404
+    return jsonify(export_job_response(job)), 200
+
+@app.route('/api/export/jobs/<job_id>/download', methods=['GET'])
+@token_required
+def download_export_job(current_user, job_id):
+    try:
+        job = mongo.db.export_jobs.find_one({
+            '_id': ObjectId(job_id),
+            'user_id': str(current_user['_id']),
+            'expires_at': {'$gt': datetime.utcnow()}
+        })
+    except InvalidId:
+        job = None
+    if not job:
+        return jsonify({'message': 'Export job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'message': 'Export is not ready yet', 'status': job['status']}), 409
+    
+    export = EXPORT_TYPES[job['type']]
+    artefact = GridFS(mongo.db, collection='export_files').get(job['file_id'])
+    return send_file(artefact, mimetype=export['mimetype'], as_attachment=True, download_name=export['filename'])
+
+def claim_export_job():
+    now = datetime.utcnow()
+    return mongo.db.export_jobs.find_one_and_update(
+        {'$or': [
+            {'status': 'queued'},
+            {'status': 'running', 'lease_expires_at': {'$lt': now}}
+        ], 'expires_at': {'$gt': now}},
+        # lease_id tells this claim apart from a later one, should the lease run out
+        {'$set': {'status': 'running', 'started_at': now, 'lease_id': ObjectId(),
+                  'lease_expires_at': now + timedelta(seconds=EXPORT_JOB_LEASE)}},
+        sort=[('created_at', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def held_lease(job):
+    return {'_id': job['_id'], 'lease_id': job['lease_id'], 'status': 'running'}
+
+def renew_export_lease(job, stop):
+    """Keep the lease alive until stop is set; rendering (doc.build in particular) reports no progress."""
+    while not stop.wait(EXPORT_JOB_LEASE / 3):
+        mongo.db.export_jobs.update_one(held_lease(job), {'$set': {
+            'lease_expires_at': datetime.utcnow() + timedelta(seconds=EXPORT_JOB_LEASE)
+        }})
+
+def run_export_job(job):
+    """Render and store the export; False if another worker took the job over meanwhile."""
+    export = EXPORT_TYPES[job['type']]
+    query = build_export_query(job['user_id'], job['start_date'], job['end_date'])
+    total = mongo.db[export['collection']].count_documents(query)
+    mongo.db.export_jobs.update_one(held_lease(job), {'$set': {'total': total}})
+    
+    def progress(processed):
+        mongo.db.export_jobs.update_one(held_lease(job), {'$set': {'processed': processed}})
+    
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=renew_export_lease, args=(job, stop), name='export-lease', daemon=True)
+    heartbeat.start()
+    files = GridFS(mongo.db, collection='export_files')
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as output:
+            export['render'](job['user_id'], job['start_date'], job['end_date'], output, progress)
+            output.seek(0)
+            file_id = files.put(output, filename=export['filename'], job_id=job['_id'], user_id=job['user_id'])
+    finally:
+        stop.set()
+        heartbeat.join()
+    
+    result = mongo.db.export_jobs.update_one(held_lease(job), {'$set': {
+        'status': 'done',
+        'file_id': file_id,
+        'finished_at': datetime.utcnow()
+    }, '$unset': {'lease_id': '', 'lease_expires_at': ''}})
+    if not result.matched_count:
+        # The lease was lost and the job belongs to another worker now; its file is the one kept
+        files.delete(file_id)
+        return False
+    return True
+
+def purge_expired_export_jobs():
+    files = GridFS(mongo.db, collection='export_files')
+    for job in mongo.db.export_jobs.find({'expires_at': {'$lte': datetime.utcnow()}}, {'file_id': 1}):
+        if job.get('file_id'):
+            files.delete(job['file_id'])
+        mongo.db.export_jobs.delete_one({'_id': job['_id']})
+
+@app.cli.command('export-worker')
+@click.option('--poll-interval', default=2.0, help='Seconds to wait when the queue is empty')
+def export_worker_command(poll_interval):
+    """Render queued export jobs until stopped. Run one process per concurrent export."""
+    last_purge = 0
+    while True:
+        if time.monotonic() - last_purge > 60:
+            purge_expired_export_jobs()
+            last_purge = time.monotonic()
+        
+        job = claim_export_job()
+        if not job:
+            time.sleep(poll_interval)
+            continue
+        
+        try:
+            if run_export_job(job):
+                print(f"Export job {job['_id']} ({job['type']}) done")
+            else:
+                print(f"Export job {job['_id']} lost its lease, discarded this render")
+        except Exception as e:
+            print(f"Export job {job['_id']} failed: {str(e)}")
+            mongo.db.export_jobs.update_one(held_lease(job), {'$set': {'status': 'failed', 'error': str(e)}})
 
 @app.route('/', methods=['GET'])
 def home():
@@ -0,0 +1,257 @@
+# benchmarks.py - Benchmark commands for the Flask backend
+# Registered on the app from app.py, so run them with `flask --app benchmarks <command>`
+from app import (app, mongo, apply_index_migrations, build_todo, bson_default, orjson, compute_user_stats,
+                 rebuild_daily_stats, STATS_SECTIONS, EXPORT_TYPES, EXPORT_BATCH_SIZE, EXPORT_SPOOL_SIZE)
+from bson.objectid import ObjectId
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+import click
+import json
+import jwt
+import sys
+import tempfile
+import time
+
+# Benchmark commands run against a scratch copy of the database, indexed like production,
+# so they never write to live collections
+@contextmanager
+def benchmark_database():
+    live = mongo.db
+    name = f'{live.name}_benchmark'
+    if name in mongo.cx.list_database_names():
+        raise click.ClickException(f'Database {name} already exists; drop it or wait for the other benchmark to finish')
+    
+    mongo.db = mongo.cx[name]
+    try:
+        apply_index_migrations()
+        yield mongo.db
+    finally:
+        mongo.cx.drop_database(name)
+        mongo.db = live
+
+def create_benchmark_user():
+    user = {'email': f'benchmark-{ObjectId()}@example.com', 'name': 'Benchmark', 'timezone': 'UTC',
+            'created_at': datetime.utcnow()}
+    user['_id'] = mongo.db.users.insert_one(user).inserted_id
+    return user
+
+def time_runs(fn, runs):
+    """Sorted wall-clock milliseconds of `runs` calls to fn."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return sorted(timings)
+
+def format_timings(timings):
+    return f"p50 {timings[len(timings) // 2]:.1f}ms  p95 {timings[int(len(timings) * 0.95)]:.1f}ms  max {timings[-1]:.1f}ms"
+
+@app.cli.command('benchmark-json')
+@click.option('--documents', default=10000, help='Todo-shaped documents per encode')
+@click.option('--runs', default=20, help='Timed encodes per encoder')
+def benchmark_json_command(documents, runs):
+    """Time encoding a list response of raw Mongo documents with each JSON path."""
+    now = datetime.utcnow()
+    docs = []
+    for index in range(documents):
+        doc = build_todo({'text': f'Benchmark todo {index}', 'estimated_time': 30}, str(ObjectId()))
+        doc.update({'_id': ObjectId(), 'completed': index % 2 == 0, 'completed_at': now if index % 2 == 0 else None})
+        docs.append(doc)
+    
+    def per_document_conversion():
+        # What routes did before the provider: copy each document and stringify its BSON values
+        converted = []
+        for doc in docs:
+            doc = dict(doc)
+            doc['_id'] = str(doc['_id'])
+            for field in ('created_at', 'updated_at', 'completed_at', 'started_at'):
+                if doc.get(field):
+                    doc[field] = doc[field].isoformat()
+            converted.append(doc)
+        return json.dumps(converted)
+    
+    encoders = [
+        ('per-document conversion + json', per_document_conversion),
+        ('json + bson_default', lambda: json.dumps(docs, default=bson_default, ensure_ascii=False))
+    ]
+    if orjson is not None:
+        encoders.append(('orjson + bson_default', lambda: orjson.dumps(docs, default=bson_default, option=orjson.OPT_NON_STR_KEYS)))
+    else:
+        print('orjson is not installed; the provider is using the stdlib encoder')
+    
+    for label, encode in encoders:
+        size = len(encode())
+        print(f"{label:32} {size / 1024:8.1f} KiB  {format_timings(time_runs(encode, runs))}")
+
+def six_query_user_stats(user_id):
+    """The stats path from before the $facet pipeline, kept as the baseline for benchmark-stats."""
+    total_todos = mongo.db.todos.count_documents({'user_id': user_id})
+    completed_todos = mongo.db.todos.count_documents({'user_id': user_id, 'completed': True})
+    time_stats = list(mongo.db.todos.aggregate([
+        {'$match': {'user_id': user_id}},
+        {'$group': {'_id': None, 'total_time': {'$sum': '$time_spent'}, 'avg_time': {'$avg': '$time_spent'}}}
+    ]))
+    category_stats = list(mongo.db.todos.aggregate([
+        {'$match': {'user_id': user_id}},
+        {'$group': {'_id': '$category', 'total': {'$sum': 1}, 'completed': {'$sum': {'$cond': ['$completed', 1, 0]}}}}
+    ]))
+    priority_stats = list(mongo.db.todos.aggregate([
+        {'$match': {'user_id': user_id}},
+        {'$group': {'_id': '$priority', 'total': {'$sum': 1}, 'completed': {'$sum': {'$cond': ['$completed', 1, 0]}}}}
+    ]))
+    daily_completions = list(mongo.db.todos.aggregate([
+        {'$match': {'user_id': user_id, 'completed': True, 'completed_at': {'$gte': datetime.utcnow() - timedelta(days=7)}}},
+        {'$group': {
+            '_id': {'year': {'$year': '$completed_at'}, 'month': {'$month': '$completed_at'}, 'day': {'$dayOfMonth': '$completed_at'}},
+            'count': {'$sum': 1}
+        }},
+        {'$sort': {'_id': 1}}
+    ]))
+    return total_todos, completed_todos, time_stats, category_stats, priority_stats, daily_completions
+
+@app.cli.command('benchmark-stats')
+@click.option('--sizes', default='1000,10000,100000', help='Comma-separated todo counts to seed')
+@click.option('--runs', default=20, help='Timed runs per path and size')
+def benchmark_stats_command(sizes, runs):
+    """Time the six-query stats path against the $facet pipeline on a scratch database."""
+    categories = ['work', 'personal', 'shopping', 'health']
+    priorities = ['low', 'medium', 'high']
+    with benchmark_database():
+        for size in [int(size) for size in sizes.split(',')]:
+            user = create_benchmark_user()
+            user_id = str(user['_id'])
+            now = datetime.utcnow()
+            for start in range(0, size, EXPORT_BATCH_SIZE):
+                todos = []
+                for index in range(start, min(start + EXPORT_BATCH_SIZE, size)):
+                    todo = build_todo({'text': f'Benchmark todo {index}', 'category': categories[index % len(categories)],
+                                       'priority': priorities[index % len(priorities)]}, user_id)
+                    todo.update({'completed': index % 3 == 0, 'time_spent': index % 90})
+                    if todo['completed']:
+                        todo['completed_at'] = now - timedelta(hours=index % 240)
+                    todos.append(todo)
+                mongo.db.todos.insert_many(todos, ordered=False)
+            rebuild_daily_stats(user)
+            
+            six_queries = time_runs(lambda: six_query_user_stats(user_id), runs)
+            facet = time_runs(lambda: compute_user_stats(user, STATS_SECTIONS), runs)
+            print(f"{size:>7} todos  six queries: {format_timings(six_queries)}")
+            print(f"{'':>7}        $facet:      {format_timings(facet)}")
+
+@app.cli.command('benchmark-projections')
+@click.option('--tickets', default=5000, help='Tickets to seed')
+@click.option('--description-length', default=1000, help='Characters per ticket description')
+@click.option('--runs', default=20, help='Timed requests per variant')
+def benchmark_projections_command(tickets, description_length, runs):
+    """Compare GET /api/tickets response size and latency with and without a projection."""
+    with benchmark_database():
+        user = create_benchmark_user()
+        user_id = str(user['_id'])
+        description = ('Printer on the third floor drops jobs after the driver update. ' * (description_length // 64 + 1))[:description_length]
+        for start in range(0, tickets, EXPORT_BATCH_SIZE):
+            now = datetime.utcnow()
+            mongo.db.tickets.insert_many([{
+                'ticket_id': f'BENCH-{index}', 'client_name': f'Client {index % 50}', 'subject': f'Benchmark ticket {index}',
+                'description': description, 'status': 'open', 'priority': 'medium', 'user_id': user_id,
+                'created_at': now, 'updated_at': now
+            } for index in range(start, min(start + EXPORT_BATCH_SIZE, tickets))], ordered=False)
+        
+        client = app.test_client()
+        headers = {'Authorization': f"Bearer {jwt.encode({'user_id': user_id}, app.config['SECRET_KEY'], algorithm='HS256')}"}
+        for label, query in [('whole documents', ''), ('view=list', '?view=list'),
+                             ('fields=ticket_id,subject,status', '?fields=ticket_id,subject,status')]:
+            size = len(client.get(f'/api/tickets{query}', headers=headers).data)
+            timings = time_runs(lambda: client.get(f'/api/tickets{query}', headers=headers), runs)
+            print(f"{label:32} {size / 1024:9.1f} KiB  {format_timings(timings)}")
+
+def benchmark_export_row(export_type, user_id, index, now):
+    if EXPORT_TYPES[export_type]['collection'] == 'todos':
+        todo = build_todo({'text': f'Benchmark todo {index} with a typical length of description text',
+                           'category': 'work', 'estimated_time': 30}, user_id)
+        todo.update({'completed': index % 2 == 0, 'time_spent': index % 120})
+        return todo
+    return {
+        'ticket_id': f'BENCH-{index}', 'client_name': f'Client {index % 50}', 'subject': f'Benchmark ticket {index}',
+        'description': 'Printer on the third floor drops jobs after the driver update.', 'status': 'open',
+        'priority': 'medium', 'user_id': user_id, 'created_at': now, 'updated_at': now
+    }
+
+@app.cli.command('benchmark-export-memory')
+@click.option('--sizes', default='10000,100000,500000', help='Comma-separated row counts, smallest first')
+@click.option('--type', 'export_type', default='excel', type=click.Choice(['excel', 'tickets_excel']), help='Export to render')
+def benchmark_export_memory_command(sizes, export_type):
+    """Render an Excel export at growing row counts and report time, file size and peak memory."""
+    import resource  # Unix only, so imported here rather than for the whole app
+    import tracemalloc
+    
+    export = EXPORT_TYPES[export_type]
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss_unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    with benchmark_database():
+        user_id = str(create_benchmark_user()['_id'])
+        seeded = 0
+        for size in sorted(int(size) for size in sizes.split(',')):
+            while seeded < size:
+                now = datetime.utcnow()
+                batch = min(EXPORT_BATCH_SIZE, size - seeded)
+                mongo.db[export['collection']].insert_many(
+                    [benchmark_export_row(export_type, user_id, seeded + index, now) for index in range(batch)], ordered=False
+                )
+                seeded += batch
+            
+            tracemalloc.start()
+            started = time.perf_counter()
+            with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as output:
+                export['render'](user_id, None, None, output)
+                file_size = output.tell()
+            elapsed = time.perf_counter() - started
+            heap_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            # Process-wide and never reset, so with sizes in ascending order it is the peak up to this size
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / rss_unit
+            print(f"{size:>7} rows  {elapsed:6.1f}s  file {file_size / 1024 / 1024:6.1f} MiB  "
+                  f"Python heap peak {heap_peak / 1024 / 1024:6.1f} MiB  max RSS {max_rss:6.1f} MiB")
+
+@app.cli.command('benchmark-search')
+@click.option('--documents', default=250000, help='Documents to seed into each of todos, tickets, comments and ticket comments')
+@click.option('--runs', default=50, help='Timed searches per variant')
+def benchmark_search_command(documents, runs):
+    """Seed todos, tickets and comments on a scratch database and time GET /api/search against them."""
+    words = ['report', 'invoice', 'deploy', 'review', 'meeting', 'client', 'budget', 'design', 'release',
+             'backup', 'refactor', 'hiring', 'roadmap', 'contract', 'support', 'migration', 'audit', 'launch']
+    
+    def phrase(index):
+        return ' '.join(words[(index * step) % len(words)] for step in (1, 7, 11))
+    
+    with benchmark_database():
+        user = create_benchmark_user()
+        user_id = str(user['_id'])
+        started = time.perf_counter()
+        for start in range(0, documents, EXPORT_BATCH_SIZE):
+            indexes = range(start, min(start + EXPORT_BATCH_SIZE, documents))
+            now = datetime.utcnow()
+            todo_ids = mongo.db.todos.insert_many([build_todo({'text': phrase(index)}, user_id) for index in indexes],
+                                                  ordered=False).inserted_ids
+            ticket_ids = mongo.db.tickets.insert_many([{
+                'ticket_id': f'BENCH-{index}', 'client_name': f'Client {index % 50}', 'subject': phrase(index),
+                'description': f'{phrase(index + 1)} {phrase(index + 2)}', 'status': 'open', 'priority': 'medium',
+                'user_id': user_id, 'created_at': now, 'updated_at': now
+            } for index in indexes], ordered=False).inserted_ids
+            mongo.db.comments.insert_many([
+                {'todo_id': str(todo_id), 'user_id': user_id, 'text': phrase(index + 3), 'created_at': now}
+                for index, todo_id in zip(indexes, todo_ids)
+            ], ordered=False)
+            mongo.db.ticket_comments.insert_many([
+                {'ticket_id': str(ticket_id), 'user_id': user_id, 'text': phrase(index + 4), 'created_at': now}
+                for index, ticket_id in zip(indexes, ticket_ids)
+            ], ordered=False)
+        print(f"Seeded {documents} documents into each collection in {time.perf_counter() - started:.1f}s")
+        
+        client = app.test_client()
+        headers = {'Authorization': f"Bearer {jwt.encode({'user_id': user_id}, app.config['SECRET_KEY'], algorithm='HS256')}"}
+        for label, types in [('all types', ''), ('types=todo', '&types=todo'), ('types=ticket', '&types=ticket'),
+                             ('types=comment,ticket_comment', '&types=comment,ticket_comment')]:
+            queries = iter(range(runs))
+            timings = time_runs(lambda: client.get(f'/api/search?q={words[next(queries) % len(words)]}{types}', headers=headers), runs)
+            print(f"{label:32} {format_timings(timings)}")
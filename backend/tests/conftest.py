@@ -0,0 +1,60 @@
+import os
+import sys
+
+os.environ.setdefault('ACTIVITY_LOG_MODE', 'sync')
+os.environ.setdefault('AUTO_MIGRATE_INDEXES', 'false')
+os.environ.setdefault('EVENT_BACKEND', 'memory')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import mongomock
+import pytest
+from pymongo import InsertOne, UpdateOne, UpdateMany, DeleteOne
+
+import app as app_module
+
+
+def _bulk_write(self, requests, ordered=True, **kwargs):
+    # mongomock's bulk_write can't build the operations of current pymongo releases,
+    # so run them one at a time
+    modified = 0
+    for operation in requests:
+        if isinstance(operation, InsertOne):
+            self.insert_one(operation._doc)
+        elif isinstance(operation, UpdateOne):
+            modified += self.update_one(operation._filter, operation._doc, upsert=operation._upsert).modified_count
+        elif isinstance(operation, UpdateMany):
+            modified += self.update_many(operation._filter, operation._doc, upsert=operation._upsert).modified_count
+        elif isinstance(operation, DeleteOne):
+            self.delete_one(operation._filter)
+
+    class Result:
+        modified_count = modified
+
+    return Result()
+
+
+mongomock.collection.Collection.bulk_write = _bulk_write
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(app_module.mongo, 'db', database)
+    app_module.user_cache.entries.clear()
+    return database
+
+
+@pytest.fixture
+def client(db):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def auth_headers(client):
+    response = client.post('/api/auth/register', json={'email': 'tester@example.com', 'password': 'secret', 'name': 'Tester'})
+    return {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+
+@pytest.fixture
+def todo_id(client, auth_headers):
+    return client.post('/api/todos', headers=auth_headers, json={'text': 'Write report'}).get_json()['_id']
@@ -0,0 +1,78 @@
+from pymongo.errors import AutoReconnect
+
+import app as app_module
+
+
+def make_logger():
+    return app_module.ActivityLogger(mode='buffered', flush_size=50, flush_interval=60,
+                                     write_concern=app_module.parse_write_concern('1'), max_buffer=100)
+
+
+def lose_acknowledgement(monkeypatch, db, fail_lookup=False):
+    """Make the next insert_many store its documents and then raise, as a lost ack does."""
+    collection_class = type(db.activities)
+    original = collection_class.insert_many
+    calls = {'count': 0}
+
+    def insert_many(self, documents, *args, **kwargs):
+        calls['count'] += 1
+        result = original(self, documents, *args, **kwargs)
+        if calls['count'] == 1:
+            raise AutoReconnect('connection closed before the reply')
+        return result
+
+    monkeypatch.setattr(collection_class, 'insert_many', insert_many)
+    if fail_lookup:
+        original_find = collection_class.find
+
+        def find(self, *args, **kwargs):
+            if calls['count'] == 1:
+                raise AutoReconnect('still down')
+            return original_find(self, *args, **kwargs)
+
+        monkeypatch.setattr(collection_class, 'find', find)
+
+
+def activities(count):
+    return [{'user_id': 'u1', 'type': 'todo_created', 'description': f'Event {index}'} for index in range(count)]
+
+
+def test_lost_ack_is_not_written_twice(db, monkeypatch):
+    lose_acknowledgement(monkeypatch, db)
+    logger = make_logger()
+    logger.buffer = activities(5)
+
+    logger.flush()
+
+    assert logger.buffer == []
+    assert db.activities.count_documents({}) == 5
+
+
+def test_duplicates_count_as_written_on_the_next_flush(db, monkeypatch):
+    lose_acknowledgement(monkeypatch, db, fail_lookup=True)
+    logger = make_logger()
+    logger.buffer = activities(5)
+
+    logger.flush()
+    assert len(logger.buffer) == 5
+
+    logger.buffer.extend(activities(2))
+    logger.flush()
+
+    assert logger.buffer == []
+    assert db.activities.count_documents({}) == 7
+
+
+def test_events_are_kept_when_the_database_is_down(db, monkeypatch):
+    def unavailable(self, documents=None, *args, **kwargs):
+        raise AutoReconnect('no primary')
+
+    collection_class = type(db.activities)
+    monkeypatch.setattr(collection_class, 'insert_many', unavailable)
+    monkeypatch.setattr(collection_class, 'find', unavailable)
+    logger = make_logger()
+    logger.buffer = activities(3)
+
+    logger.flush()
+
+    assert len(logger.buffer) == 3
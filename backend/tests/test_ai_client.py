@@ -0,0 +1,55 @@
+import pytest
+
+import app as app_module
+
+
+class FakeResponse:
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.headers = {'Retry-After': retry_after} if retry_after else {}
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def post(self, *args, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(app_module.time, 'sleep', slept.append)
+    monkeypatch.setattr(app_module, 'AI_MAX_RETRIES', 2)
+    return slept
+
+
+def post(session):
+    client = app_module.AIClient()
+    client.session = lambda provider: session
+    return client.post('custom', 'http://example.invalid/', {}, {})
+
+
+def test_retry_after_within_the_cap_is_honoured(sleeps):
+    session = FakeSession([FakeResponse(429, '3'), FakeResponse(200)])
+
+    assert post(session).status_code == 200
+    assert session.calls == 2
+    assert sleeps[0] >= 3
+
+
+def test_retry_after_above_the_cap_returns_without_retrying(sleeps):
+    retry_after = str(app_module.AI_MAX_RETRY_DELAY + 1)
+    session = FakeSession([FakeResponse(429, retry_after), FakeResponse(200)])
+
+    response = post(session)
+
+    assert response.status_code == 429
+    assert session.calls == 1
+    assert sleeps == []
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def ai_user(db, auth_headers, monkeypatch):
+    db.users.update_many({}, {'$set': {'api_settings': {
+        'ai_provider': 'custom', 'custom_api_key': 'test-key', 'custom_api_endpoint': 'http://127.0.0.1:9/'
+    }}})
+    app_module.user_cache.entries.clear()
+    monkeypatch.setattr(app_module.ai_client, 'generate',
+                        lambda *args: json.dumps({'suggestions': [{'text': 'Plan the week'}]}))
+    return auth_headers
+
+
+def create_job(client, headers):
+    return client.post('/api/ai/jobs', headers=headers, json={'kind': 'smart-suggestions', 'params': {'context_type': 'morning'}})
+
+
+def test_job_is_refused_without_a_live_worker(client, ai_user, db):
+    response = create_job(client, ai_user)
+    assert response.status_code == 503
+    assert response.get_json()['code'] == 'no_worker'
+    assert db.ai_jobs.count_documents({}) == 0
+
+    # A worker that stopped checking in doesn't count
+    db.ai_workers.insert_one({'_id': 'gone:1', 'expires_at': app_module.datetime.utcnow() - app_module.timedelta(seconds=1)})
+    assert create_job(client, ai_user).status_code == 503
+
+
+def test_job_runs_on_a_worker_and_is_polled_to_completion(client, ai_user):
+    app_module.record_ai_worker_heartbeat('test:1')
+    response = create_job(client, ai_user)
+    assert response.status_code == 202
+    job_id = response.get_json()['id']
+    assert client.get(f'/api/ai/jobs/{job_id}', headers=ai_user).get_json()['status'] == 'queued'
+
+    app_module.run_ai_job(app_module.claim_ai_job())
+
+    job = client.get(f'/api/ai/jobs/{job_id}', headers=ai_user).get_json()
+    assert job['status'] == 'done'
+    assert job['result'] == {'suggestions': [{'text': 'Plan the week'}]}
+
+
+def test_missing_key_points_the_client_at_the_inline_route(client, auth_headers):
+    app_module.record_ai_worker_heartbeat('test:1')
+    response = create_job(client, auth_headers)
+    assert response.status_code == 400
+    assert response.get_json()['code'] == 'not_configured'
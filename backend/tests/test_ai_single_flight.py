@@ -0,0 +1,111 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app as app_module
+
+
+class FakeProvider:
+    """Local stand-in for a custom AI endpoint; holds every reply until released."""
+
+    def __init__(self):
+        self.calls = 0
+        self.status = 200
+        self.release = threading.Event()
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                provider.calls += 1
+                provider.release.wait(10)
+                body = json.dumps({'response': json.dumps({'suggestions': ['Plan the week']})}).encode()
+                self.send_response(provider.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def provider(db, auth_headers, monkeypatch):
+    fake = FakeProvider()
+    db.users.update_many({}, {'$set': {'api_settings': {
+        'ai_provider': 'custom', 'custom_api_key': 'test-key', 'custom_api_endpoint': fake.url
+    }}})
+    app_module.user_cache.entries.clear()
+    monkeypatch.setattr(app_module, 'ai_flight', app_module.SingleFlight())
+    monkeypatch.setattr(app_module, 'AI_MAX_RETRIES', 0)
+    yield fake
+    fake.close()
+
+
+def burst(auth_headers, requests=8):
+    """Send identical smart-suggestion requests at once; returns (status, body) per request."""
+    responses = []
+
+    def send():
+        response = app_module.app.test_client().post('/api/ai/smart-suggestions', headers=auth_headers,
+                                                      json={'context_type': 'morning'})
+        responses.append((response.status_code, response.get_json()))
+
+    threads = [threading.Thread(target=send) for _ in range(requests)]
+    for thread in threads:
+        thread.start()
+    return threads, responses
+
+
+def wait_for_followers(count):
+    deadline = time.monotonic() + 10
+    while app_module.ai_flight.stats()['coalesced'] < count:
+        assert time.monotonic() < deadline, 'requests did not join the in-flight call'
+        time.sleep(0.01)
+
+
+def test_identical_requests_share_one_provider_call(provider, auth_headers):
+    threads, responses = burst(auth_headers)
+    wait_for_followers(7)
+    provider.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert provider.calls == 1
+    assert [status for status, _ in responses] == [200] * 8
+    assert all(body == responses[0][1] for _, body in responses)
+    assert app_module.ai_flight.stats() == {'in_flight': 0, 'leaders': 1, 'coalesced': 7}
+
+
+def test_provider_error_reaches_every_waiter(provider, auth_headers):
+    provider.status = 503
+    threads, responses = burst(auth_headers)
+    wait_for_followers(7)
+    provider.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert provider.calls == 1
+    assert [status for status, _ in responses] == [500] * 8
+
+
+def test_next_request_after_completion_calls_again(provider, auth_headers):
+    provider.release.set()
+    client = app_module.app.test_client()
+    for _ in range(2):
+        assert client.post('/api/ai/smart-suggestions', headers=auth_headers, json={}).status_code == 200
+
+    assert provider.calls == 2
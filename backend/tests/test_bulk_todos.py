@@ -0,0 +1,23 @@
+import pytest
+
+
+@pytest.mark.parametrize('data', [['text', 'Oops'], 'Oops', 42])
+def test_non_object_data_is_an_invalid_item(client, auth_headers, todo_id, data):
+    response = client.post('/api/todos/bulk', headers=auth_headers, json={'operations': [
+        {'op': 'create', 'data': data},
+        {'op': 'update', 'id': todo_id, 'data': data},
+        {'op': 'complete', 'id': todo_id}
+    ]})
+
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['status'] for result in results] == ['invalid', 'invalid', 'updated']
+    assert results[0]['message'] == 'data must be an object'
+
+
+@pytest.mark.parametrize('body', [[{'op': 'create', 'data': {'text': 'Oops'}}], 'Oops', None])
+def test_non_object_body_is_rejected(client, auth_headers, body):
+    response = client.post('/api/todos/bulk', headers=auth_headers, json=body)
+
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Request body must be a JSON object'
@@ -0,0 +1,91 @@
+import io
+
+import pytest
+
+
+def etag_of(client, path, headers):
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+def assert_invalidates(client, path, headers, write):
+    """The cached tag answers 304 until the write, then the same request gets a fresh 200."""
+    etag = etag_of(client, path, headers)
+    assert client.get(path, headers={**headers, 'If-None-Match': etag}).status_code == 304
+
+    assert write().status_code in (200, 201)
+
+    response = client.get(path, headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+@pytest.fixture
+def ticket_id(client, auth_headers):
+    response = client.post('/api/tickets', headers=auth_headers,
+                           json={'ticket_id': 'T-1', 'client_name': 'Acme', 'subject': 'Printer jam'})
+    return response.get_json()['_id']
+
+
+def test_create_todo(client, auth_headers):
+    assert_invalidates(client, '/api/todos', auth_headers,
+                       lambda: client.post('/api/todos', headers=auth_headers, json={'text': 'New todo'}))
+
+
+def test_update_todo(client, auth_headers, todo_id):
+    assert_invalidates(client, '/api/todos', auth_headers,
+                       lambda: client.put(f'/api/todos/{todo_id}', headers=auth_headers, json={'completed': True}))
+
+
+def test_toggle_time_tracking(client, auth_headers, todo_id):
+    assert_invalidates(client, '/api/todos', auth_headers,
+                       lambda: client.post(f'/api/todos/{todo_id}/time', headers=auth_headers, json={'action': 'start'}))
+
+
+def test_bulk_todos(client, auth_headers, todo_id):
+    operations = [{'op': 'complete', 'id': todo_id}]
+    assert_invalidates(client, '/api/todos', auth_headers,
+                       lambda: client.post('/api/todos/bulk', headers=auth_headers, json={'operations': operations}))
+
+
+def test_delete_todo(client, auth_headers, todo_id):
+    assert_invalidates(client, '/api/todos', auth_headers,
+                       lambda: client.delete(f'/api/todos/{todo_id}', headers=auth_headers))
+
+
+def test_create_ticket(client, auth_headers):
+    assert_invalidates(client, '/api/tickets', auth_headers,
+                       lambda: client.post('/api/tickets', headers=auth_headers,
+                                           json={'ticket_id': 'T-2', 'client_name': 'Beta', 'subject': 'VPN down'}))
+
+
+def test_update_ticket(client, auth_headers, ticket_id):
+    assert_invalidates(client, '/api/tickets', auth_headers,
+                       lambda: client.put(f'/api/tickets/{ticket_id}', headers=auth_headers, json={'status': 'closed'}))
+
+
+def test_add_ticket_comment(client, auth_headers, ticket_id):
+    assert_invalidates(client, '/api/tickets', auth_headers,
+                       lambda: client.post(f'/api/tickets/{ticket_id}/comments', headers=auth_headers, json={'text': 'On it'}))
+
+
+def test_import_tickets(client, auth_headers):
+    upload = b'ticket_id,client_name,subject\nT-3,Gamma,Laptop battery\n'
+    assert_invalidates(client, '/api/tickets', auth_headers,
+                       lambda: client.post('/api/tickets/import', headers=auth_headers,
+                                           data={'file': (io.BytesIO(upload), 'tickets.csv')}))
+
+
+def test_delete_ticket(client, auth_headers, ticket_id):
+    assert_invalidates(client, '/api/tickets', auth_headers,
+                       lambda: client.delete(f'/api/tickets/{ticket_id}', headers=auth_headers))
+
+
+def test_other_users_writes_keep_the_tag(client, auth_headers):
+    etag = etag_of(client, '/api/todos', auth_headers)
+    other = client.post('/api/auth/register', json={'email': 'other@example.com', 'password': 'secret', 'name': 'Other'})
+    other_headers = {'Authorization': f"Bearer {other.get_json()['token']}"}
+    client.post('/api/todos', headers=other_headers, json={'text': 'Not yours'})
+
+    assert client.get('/api/todos', headers={**auth_headers, 'If-None-Match': etag}).status_code == 304
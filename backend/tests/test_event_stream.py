@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = app_module.EventBroker(queue_size=10, max_streams=3, max_streams_per_user=2)
+    monkeypatch.setattr(app_module, 'event_broker', broker)
+    return broker
+
+
+def stream_token(client, auth_headers):
+    return client.post('/api/events/token', headers=auth_headers).get_json()['token']
+
+
+def open_stream(client, token):
+    return client.get(f'/api/events?token={token}', buffered=False)
+
+
+def test_stream_token_opens_a_stream(client, auth_headers, broker):
+    response = open_stream(client, stream_token(client, auth_headers))
+
+    assert response.status_code == 200
+    assert next(response.response) == b'retry: 3000\n\n'
+    response.close()
+    assert broker.stats()['streams'] == 0
+
+
+def test_login_token_is_not_accepted_in_the_url(client, auth_headers, broker):
+    login_token = auth_headers['Authorization'].split(' ')[1]
+
+    assert open_stream(client, login_token).status_code == 401
+
+
+def test_expired_stream_token_is_rejected(client, auth_headers, broker):
+    data = jwt.decode(stream_token(client, auth_headers), app_module.app.config['SECRET_KEY'], algorithms=['HS256'])
+    data['exp'] = datetime.utcnow() - timedelta(seconds=1)
+    expired = jwt.encode(data, app_module.app.config['SECRET_KEY'], algorithm='HS256')
+
+    assert open_stream(client, expired).status_code == 401
+
+
+def test_stream_token_does_not_authorise_the_api(client, auth_headers, broker):
+    headers = {'Authorization': f'Bearer {stream_token(client, auth_headers)}'}
+
+    assert client.get('/api/todos', headers=headers).status_code == 401
+
+
+def test_streams_are_capped_per_user_and_per_process(client, auth_headers, broker):
+    token = stream_token(client, auth_headers)
+    streams = [open_stream(client, token) for _ in range(2)]
+    assert [response.status_code for response in streams] == [200, 200]
+    assert open_stream(client, token).status_code == 429
+
+    other = client.post('/api/auth/register', json={'email': 'other@example.com', 'password': 'secret', 'name': 'Other'})
+    other_token = stream_token(client, {'Authorization': f"Bearer {other.get_json()['token']}"})
+    streams.append(open_stream(client, other_token))
+    assert streams[-1].status_code == 200
+    assert open_stream(client, other_token).status_code == 503
+
+    for response in streams:
+        response.close()
+    assert open_stream(client, token).status_code == 200
@@ -0,0 +1,69 @@
+import time
+from datetime import datetime, timedelta
+
+import mongomock.gridfs
+import pytest
+
+import app as app_module
+
+
+@pytest.mark.parametrize('path', ['/api/export/jobs/not-an-id', '/api/export/jobs/not-an-id/download'])
+def test_malformed_job_id_is_not_found(client, auth_headers, path):
+    response = client.get(path, headers=auth_headers)
+
+    assert response.status_code == 404
+    assert response.get_json() == {'message': 'Export job not found'}
+
+
+def test_queued_job_is_found_and_not_ready(client, auth_headers):
+    job = client.post('/api/export/jobs', headers=auth_headers, json={'type': 'excel'}).get_json()
+
+    assert client.get(f"/api/export/jobs/{job['job_id']}", headers=auth_headers).get_json()['status'] == 'queued'
+    assert client.get(f"/api/export/jobs/{job['job_id']}/download", headers=auth_headers).status_code == 409
+
+
+@pytest.fixture
+def export_files(db):
+    mongomock.gridfs.enable_gridfs_integration()
+    return db['export_files.files']
+
+
+def queue_job(client, auth_headers):
+    return client.post('/api/export/jobs', headers=auth_headers, json={'type': 'excel'}).get_json()['job_id']
+
+
+def test_worker_that_lost_its_lease_discards_its_file(client, auth_headers, db, export_files):
+    job_id = queue_job(client, auth_headers)
+    first = app_module.claim_export_job()
+    # The first worker stalls past its lease and a second worker claims the job
+    db.export_jobs.update_one({'_id': first['_id']}, {'$set': {'lease_expires_at': datetime.utcnow() - timedelta(seconds=1)}})
+    second = app_module.claim_export_job()
+    assert second['_id'] == first['_id'] and second['lease_id'] != first['lease_id']
+
+    assert app_module.run_export_job(second) is True
+    assert app_module.run_export_job(first) is False
+
+    job = db.export_jobs.find_one({'_id': first['_id']})
+    assert job['status'] == 'done'
+    assert [stored['_id'] for stored in export_files.find()] == [job['file_id']]
+    assert client.get(f'/api/export/jobs/{job_id}/download', headers=auth_headers).status_code == 200
+
+
+def test_lease_is_renewed_while_rendering(client, auth_headers, db, export_files, monkeypatch):
+    queue_job(client, auth_headers)
+    monkeypatch.setattr(app_module, 'EXPORT_JOB_LEASE', 0.3)
+    job = app_module.claim_export_job()
+    render = app_module.EXPORT_TYPES['excel']['render']
+    renewals = []
+
+    def slow_render(*args):
+        # Longer than the lease, with no progress reported, like doc.build() on a large PDF
+        for _ in range(5):
+            time.sleep(0.1)
+            renewals.append(db.export_jobs.find_one({'_id': job['_id']})['lease_expires_at'])
+        render(*args)
+
+    monkeypatch.setitem(app_module.EXPORT_TYPES['excel'], 'render', slow_render)
+
+    assert app_module.run_export_job(job) is True
+    assert renewals[-1] > job['lease_expires_at']
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+from pymongo import MongoClient
+
+import app as app_module
+
+TEST_MONGO_URI = os.getenv('TEST_MONGO_URI')
+
+pytestmark = pytest.mark.skipif(not TEST_MONGO_URI, reason='set TEST_MONGO_URI to check query plans against a real MongoDB')
+
+
+@pytest.fixture
+def migrated_db(monkeypatch):
+    client = MongoClient(TEST_MONGO_URI)
+    name = f'todo_index_test_{os.getpid()}'
+    client.drop_database(name)
+    monkeypatch.setattr(app_module.mongo, 'db', client[name])
+    app_module.apply_index_migrations()
+    yield client[name]
+    client.drop_database(name)
+    client.close()
+
+
+def test_every_route_query_uses_an_index(migrated_db):
+    results = app_module.explain_indexed_queries()
+    unindexed = [f"{result['route']} ({result['collection']}): {' <- '.join(result['stages'])}"
+                 for result in results if not result['indexed']]
+    assert not unindexed
+
+
+def test_migrations_are_recorded_once(migrated_db):
+    assert app_module.apply_index_migrations() == []
+    assert app_module.get_index_version() == app_module.INDEX_MIGRATIONS[-1]['version']
@@ -0,0 +1,23 @@
+import pytest
+
+
+@pytest.fixture
+def ticket(client, auth_headers):
+    return client.post('/api/tickets', headers=auth_headers, json={
+        'ticket_id': 'T-1', 'client_name': 'Acme', 'subject': 'Printer jams', 'description': 'Third floor'
+    }).get_json()
+
+
+@pytest.mark.parametrize('fields', ['', ',', ' , ,'])
+def test_empty_fields_list_is_rejected(client, auth_headers, ticket, fields):
+    response = client.get(f'/api/tickets?fields={fields}', headers=auth_headers)
+
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'fields must name at least one field'
+
+
+def test_fields_limit_the_response(client, auth_headers, ticket):
+    response = client.get('/api/tickets?fields=ticket_id,subject', headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.get_json() == [{'_id': ticket['_id'], 'ticket_id': 'T-1', 'subject': 'Printer jams'}]
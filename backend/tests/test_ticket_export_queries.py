@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def query_counts(db, monkeypatch):
+    """Count find() calls per collection for the collections a ticket export reads."""
+    counts = {'tickets': 0, 'ticket_comments': 0}
+    for name in counts:
+        collection = db[name]
+        original = collection.find
+
+        def counting_find(*args, _name=name, _original=original, **kwargs):
+            counts[_name] += 1
+            return _original(*args, **kwargs)
+
+        monkeypatch.setattr(collection, 'find', counting_find)
+    monkeypatch.setattr(app_module.export_cache, 'max_bytes', 0)
+    return counts
+
+
+def seed_tickets(db, user_id, count, comments_per_ticket=2):
+    now = datetime.utcnow()
+    tickets = [{
+        'ticket_id': f'T-{index}', 'client_name': 'Acme', 'subject': f'Ticket {index}', 'description': '',
+        'status': 'open', 'priority': 'medium', 'user_id': user_id,
+        'created_at': now - timedelta(minutes=index), 'updated_at': now
+    } for index in range(count)]
+    db.tickets.insert_many(tickets)
+    db.ticket_comments.insert_many([{
+        'ticket_id': str(ticket['_id']), 'user_id': user_id, 'text': f'Comment {number}',
+        'user_email': 'tester@example.com', 'created_at': now + timedelta(seconds=number)
+    } for ticket in tickets for number in range(comments_per_ticket)])
+
+
+def export(client, auth_headers, kind):
+    response = client.get(f'/api/export/tickets/{kind}', headers=auth_headers)
+    assert response.status_code == 200
+    return response
+
+
+@pytest.fixture
+def user_id(db, auth_headers):
+    return str(db.users.find_one({'email': 'tester@example.com'})['_id'])
+
+
+@pytest.mark.parametrize('kind', ['pdf', 'excel'])
+@pytest.mark.parametrize('tickets', [1, 20, 200])
+def test_query_count_does_not_grow_with_tickets(client, auth_headers, db, user_id, query_counts, kind, tickets):
+    seed_tickets(db, user_id, tickets)
+    export(client, auth_headers, kind)
+
+    assert query_counts == {'tickets': 1, 'ticket_comments': 1}
+
+
+@pytest.mark.parametrize('kind', ['pdf', 'excel'])
+def test_comments_are_loaded_once_per_batch(client, auth_headers, db, user_id, query_counts, monkeypatch, kind):
+    monkeypatch.setattr(app_module, 'EXPORT_BATCH_SIZE', 10)
+    seed_tickets(db, user_id, 25)
+    export(client, auth_headers, kind)
+
+    assert query_counts == {'tickets': 1, 'ticket_comments': 3}
+
+
+def test_comments_stay_with_their_ticket(client, auth_headers, db, user_id, query_counts):
+    seed_tickets(db, user_id, 3)
+    tickets = list(db.tickets.find({'user_id': user_id}))
+
+    joined = list(app_module.with_ticket_comments(tickets))
+
+    assert [ticket['_id'] for ticket, _ in joined] == [ticket['_id'] for ticket in tickets]
+    for ticket, comments in joined:
+        assert [comment['ticket_id'] for comment in comments] == [str(ticket['_id'])] * 2
+        assert [comment['text'] for comment in comments] == ['Comment 0', 'Comment 1']
@@ -0,0 +1,42 @@
+import io
+
+from openpyxl import Workbook
+
+
+def upload(client, auth_headers, content, filename='tickets.csv'):
+    return client.post('/api/tickets/import', headers=auth_headers,
+                       data={'file': (io.BytesIO(content), filename)})
+
+
+def test_header_missing_required_columns_is_rejected(client, auth_headers, db):
+    response = upload(client, auth_headers, b'ticket_id,description\nT-1,Printer jams\nT-2,No wifi\n')
+
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body['missing_columns'] == ['client_name', 'subject']
+    assert body['message'] == 'Missing required columns: client_name, subject'
+    assert db.tickets.count_documents({}) == 0
+
+
+def test_xlsx_header_is_checked_too(client, auth_headers):
+    wb = Workbook()
+    wb.active.append(['Ticket ID', 'Client Name'])
+    wb.active.append(['T-1', 'Acme'])
+    content = io.BytesIO()
+    wb.save(content)
+
+    response = upload(client, auth_headers, content.getvalue(), 'tickets.xlsx')
+
+    assert response.status_code == 400
+    assert response.get_json()['missing_columns'] == ['subject']
+
+
+def test_empty_file_is_rejected(client, auth_headers):
+    assert upload(client, auth_headers, b'').status_code == 400
+
+
+def test_complete_header_imports_rows(client, auth_headers):
+    response = upload(client, auth_headers, b'Ticket ID,Client Name,Subject\nT-1,Acme,Printer jams\n')
+
+    assert response.status_code == 200
+    assert response.get_json()['imported'] == 1
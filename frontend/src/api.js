@@ -24,10 +24,12 @@ export const auth = {
 
 export const todos = {
   getAll: () => api.get('/todos'),
+  getPage: (limit, cursor) => api.get('/todos', { params: { limit, cursor } }),
   getOne: (id) => api.get(`/todos/${id}`),
   create: (todo) => api.post('/todos', todo),
   update: (id, todo) => api.put(`/todos/${id}`, todo),
-  delete: (id) => api.delete(`/todos/${id}`)
+  delete: (id) => api.delete(`/todos/${id}`),
+  bulk: (operations) => api.post('/todos/bulk', { operations })
 };
 
 export const comments = {
@@ -60,14 +62,25 @@ export const exportData = {
     if (startDate) params.append('start_date', startDate);
     if (endDate) params.append('end_date', endDate);
     return api.get(`/export/tickets/excel?${params.toString()}`, { responseType: 'blob' });
-  }
+  },
+  createJob: (type, startDate, endDate) =>
+    api.post('/export/jobs', { type, start_date: startDate, end_date: endDate }),
+  getJob: (jobId) => api.get(`/export/jobs/${jobId}`),
+  downloadJob: (jobId) => api.get(`/export/jobs/${jobId}/download`, { responseType: 'blob' })
 };
 
 export const tickets = {
   getAll: () => api.get('/tickets'),
+  query: (params) => api.get('/tickets', { params }),
   getOne: (id) => api.get(`/tickets/${id}`),
   getClients: () => api.get('/tickets/clients'),
+  searchClients: (prefix, limit = 10) => api.get('/tickets/clients/search', { params: { prefix, limit } }),
   create: (ticket) => api.post('/tickets', ticket),
+  import: (file) => {
+    const form = new FormData();
+    form.append('file', file);
+    return api.post('/tickets/import', form);
+  },
   update: (id, ticket) => api.put(`/tickets/${id}`, ticket),
   delete: (id) => api.delete(`/tickets/${id}`)
 };
@@ -82,6 +95,14 @@ export const timeTracking = {
   stop: (todoId) => api.post(`/todos/${todoId}/time`, { action: 'stop' })
 };
 
+export const sync = {
+  changes: (since) => api.get('/sync', { params: since ? { since } : {} })
+};
+
+export const search = {
+  query: (q, params = {}) => api.get('/search', { params: { q, ...params } })
+};
+
 export const activities = {
   getAll: (limit = 50) => api.get(`/activities?limit=${limit}`)
 };
@@ -90,20 +111,80 @@ export const analytics = {
   getStats: () => api.get('/analytics/stats')
 };
 
+const AI_JOB_POLL_INTERVAL = 1000;
+
+// Runs an AI request as a background job and polls it until it finishes, resolving like an axios
+// response. When the server can't queue it (no AI worker running, or no API key so the route's own
+// fallback suggestions apply) the request goes to the blocking route instead.
+const runAIJob = async (kind, params, inline, options = {}) => {
+  let job;
+  try {
+    job = (await api.post('/ai/jobs', { kind, params, ...options })).data;
+  } catch (e) {
+    if (['no_worker', 'not_configured'].includes(e.response?.data?.code)) return inline();
+    throw e;
+  }
+  while (job.status === 'queued' || job.status === 'running') {
+    await new Promise((resolve) => setTimeout(resolve, AI_JOB_POLL_INTERVAL));
+    job = (await api.get(`/ai/jobs/${job.id}`)).data;
+  }
+  if (job.status === 'failed') throw new Error(job.error);
+  return { data: job.result };
+};
+
 export const ai = {
-  getSuggestions: (context) => api.post('/ai/suggestions', { context }),
-  analyzeTask: (taskText) => api.post('/ai/analyze', { task_text: taskText }),
-  planDay: (availableHours, energyLevel, focusAreas) => api.post('/ai/plan-day', { 
-    available_hours: availableHours, 
-    energy_level: energyLevel, 
-    focus_areas: focusAreas 
-  }),
-  optimizeWorkflow: () => api.post('/ai/optimize-workflow'),
-  getSmartSuggestions: (contextType, mood, availableTime) => api.post('/ai/smart-suggestions', {
-    context_type: contextType,
-    mood: mood,
-    available_time: availableTime
-  })
+  getSuggestions: (context, options = {}) => runAIJob('suggestions', { context },
+    () => api.post('/ai/suggestions', { context, ...options }), options),
+  analyzeTask: (taskText, options = {}) => runAIJob('analyze', { task_text: taskText },
+    () => api.post('/ai/analyze', { task_text: taskText, ...options }), options),
+  planDay: (availableHours, energyLevel, focusAreas) => {
+    const params = { available_hours: availableHours, energy_level: energyLevel, focus_areas: focusAreas };
+    return runAIJob('plan-day', params, () => api.post('/ai/plan-day', params));
+  },
+  optimizeWorkflow: () => runAIJob('optimize-workflow', {}, () => api.post('/ai/optimize-workflow')),
+  getSmartSuggestions: (contextType, mood, availableTime) => {
+    const params = { context_type: contextType, mood, available_time: availableTime };
+    return runAIJob('smart-suggestions', params, () => api.post('/ai/smart-suggestions', params));
+  }
+};
+
+// Streams an AI reply; onEvent receives ({ event, data }) for each delta/section/done/error event
+const streamAI = async (path, body, onEvent) => {
+  const response = await fetch(`${API_URL}${path}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      Authorization: `Bearer ${localStorage.getItem('token')}`
+    },
+    body: JSON.stringify(body)
+  });
+  if (!response.ok) {
+    throw new Error((await response.json()).message);
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const messages = buffer.split('\n\n');
+    buffer = messages.pop();
+    for (const message of messages) {
+      const event = message.match(/^event: (.*)$/m)?.[1];
+      const data = message.match(/^data: (.*)$/m)?.[1];
+      if (event && data) onEvent({ event, data: JSON.parse(data) });
+    }
+  }
+};
+
+export const aiStream = {
+  analyzeTask: (taskText, onEvent) => streamAI('/ai/analyze/stream', { task_text: taskText }, onEvent),
+  planDay: (availableHours, energyLevel, focusAreas, onEvent) => streamAI('/ai/plan-day/stream', {
+    available_hours: availableHours,
+    energy_level: energyLevel,
+    focus_areas: focusAreas
+  }, onEvent)
 };
 
 export const userProfile = {